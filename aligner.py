@@ -0,0 +1,169 @@
+"""
+A local, rule-based replacement for the LLM aligner.
+
+The StuckDetector looks at the session events since the aligner last spoke for the patterns the aligner
+prompt used to describe: repeated messages, turns without tool calls, the same failing tests over and
+over, agents waiting on the user, announcing work without doing it, and asking questions. LocalAligner
+runs it as the last agent of the loop and only adds a message to the conversation when a rule fires,
+so a healthy iteration costs no model call.
+"""
+
+import difflib
+import logging
+import re
+from typing import AsyncGenerator
+
+from google.adk.agents import BaseAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+from google.genai import types
+from pydantic import Field
+
+
+LOOP = "GUYS, YOU ARE STUCK IN A LOOP. PLANNER, ISSUE A NEW TASK TO A SPECIFIC AGENT."
+CODER_IDLE = "Coder, stop talking and code."
+NO_USER = "Guys, the user is not available to do anything. You have the tools to do it yourself."
+PASSING_OFF = "Guys, stop passing it off and actually do the thing."
+QUESTIONS = "Guys, stop asking questions and just do the thing."
+
+USER_PHRASES = (
+    "you can run",
+    "please run",
+    "run the following",
+    "you should run",
+    "on your machine",
+    "let me know when",
+    "once you have",
+    "could you provide",
+)
+PASSING_OFF_RE = re.compile(r"\b(i will|i'll|once (this|that|the|it)|next,? i)\b", re.I)
+FAILING_RE = re.compile(r"^Failing \(\d+\): (.+)$", re.M)
+
+
+class Turn:
+    """
+    The consecutive events of one agent: what it said, which tools it called and its pytest results.
+    """
+
+    def __init__(self, author: str):
+        self.author = author
+        self.texts = []
+        self.calls = []
+        self.failing = []
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.texts)
+
+
+def turns(events: list) -> list:
+    """
+    Groups the agent events of a session into turns, skipping user messages and state-only events.
+    """
+    result = []
+    for event in events:
+        if event.author == "user" or not (event.content and event.content.parts):
+            continue
+        if not result or result[-1].author != event.author:
+            result.append(Turn(event.author))
+        turn = result[-1]
+        for part in event.content.parts:
+            if part.text and part.text.strip():
+                turn.texts.append(part.text.strip())
+            elif part.function_call:
+                turn.calls.append(part.function_call.name)
+            elif part.function_response and part.function_response.name == "run_pytest":
+                response = part.function_response.response or {}
+                match = FAILING_RE.search(str(response.get("result", "")))
+                # passing runs are recorded too, so they break a streak of identical failures
+                turn.failing.append(match.group(1) if match else "")
+    return result
+
+
+class StuckDetector:
+    """
+    Checks a window of turns for signs that the agents are stuck and returns the unstick messages.
+
+    idle_turns consecutive turns without a tool call, a message at least similarity alike to an earlier
+    one, failing_repeats pytest runs in a row with the same failing tests, or let_me_know "let me know"
+    phrases count as a loop.
+    """
+
+    def __init__(
+        self, idle_turns: int = 4, similarity: float = 0.9, failing_repeats: int = 3, let_me_know: int = 2
+    ):
+        self.idle_turns = idle_turns
+        self.similarity = similarity
+        self.failing_repeats = failing_repeats
+        self.let_me_know = let_me_know
+
+    def _repeated(self, history: list, recent: int) -> bool:
+        # the recent turns are the tail of the history; each is compared with the turns before it
+        for i in range(max(0, len(history) - recent), len(history)):
+            text = history[i].text
+            if len(text) < 20:
+                continue
+            for other in history[:i]:
+                matcher = difflib.SequenceMatcher(None, text, other.text, autojunk=False)
+                if matcher.real_quick_ratio() >= self.similarity and matcher.ratio() >= self.similarity:
+                    return True
+        return False
+
+    def check(self, history: list, recent: list) -> list:
+        """
+        history holds the turns since the aligner last spoke, recent the turns of the latest iteration.
+        """
+        messages = []
+        recent_text = " ".join(turn.text for turn in recent).lower()
+        if any(phrase in recent_text for phrase in USER_PHRASES):
+            messages.append(NO_USER)
+
+        failing = [result for turn in history for result in turn.failing][-self.failing_repeats :]
+        if len(failing) == self.failing_repeats and failing[0] and len(set(failing)) == 1:
+            messages.append(f"{LOOP} The same tests failed {self.failing_repeats} times in a row: {failing[0]}")
+        elif self._repeated(history, len(recent)):
+            messages.append(LOOP)
+        elif len(history) >= self.idle_turns and not any(turn.calls for turn in history[-self.idle_turns :]):
+            messages.append(LOOP)
+        elif recent_text.count("let me know") >= self.let_me_know:
+            messages.append(LOOP)
+
+        coder = [turn for turn in recent if turn.author == "coder"]
+        if coder and coder[-1].text and not any(turn.calls for turn in coder):
+            messages.append(CODER_IDLE)
+        idle = [turn for turn in recent if turn.text and not turn.calls]
+        if any(PASSING_OFF_RE.search(turn.text) for turn in idle):
+            messages.append(PASSING_OFF)
+        if any(turn.text.rstrip().endswith("?") for turn in idle):
+            messages.append(QUESTIONS)
+        return messages
+
+
+class LocalAligner(BaseAgent):
+    """
+    Runs a StuckDetector over the session and speaks only when it fires. The position of the latest
+    check is kept in the session state, so each iteration's phrases are judged once.
+    """
+
+    detector: StuckDetector = Field(default_factory=StuckDetector)
+
+    @property
+    def seen_key(self) -> str:
+        return f"{self.name}:seen"
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        events = ctx.session.events
+        spoke = max((i + 1 for i, event in enumerate(events) if event.author == self.name and event.content), default=0)
+        seen = max(spoke, ctx.session.state.get(self.seen_key) or 0)
+        messages = self.detector.check(turns(events[spoke:]), turns(events[seen:]))
+        content = None
+        if messages:
+            logging.info(f"[{self.name}] Stuck detector fired: {' | '.join(messages)}")
+            content = types.Content(role="model", parts=[types.Part(text="\n".join(messages))])
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            content=content,
+            actions=EventActions(state_delta={self.seen_key: len(events) + 1}),
+        )
@@ -0,0 +1,120 @@
+"""
+Runs many tasks concurrently, each in its own workdir, log file and session.
+
+Usage: uv run batch.py tasks.txt [--concurrency 4] [--agent teddy|teddy_lite] [--out runs]
+
+The task file holds one task per paragraph (tasks separated by blank lines), or one JSON object per line
+with a "task" and an optional "id" if it ends in .jsonl. Task i runs in <out>/<id>/ with its log in
+<out>/<id>/<agent>.log and session id <id>. A summary table is printed at the end and saved to
+<out>/summary.json.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import importlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+import report
+import worker
+from subprocs import Limits
+from workspace import Workspace
+
+
+COLUMNS = ("id", "status", "iterations", "wall time", "tokens", "tests passed", "workdir")
+
+
+def read_tasks(path: str) -> list:
+    """
+    Returns [(id, task)] from a task file.
+    """
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    if path.endswith(".jsonl"):
+        entries = [json.loads(line) for line in text.splitlines() if line.strip()]
+        return [(str(entry.get("id") or f"task-{i:03d}"), entry["task"]) for i, entry in enumerate(entries, 1)]
+    paragraphs = [" ".join(block.split()) for block in text.split("\n\n") if block.strip()]
+    return [(f"task-{i:03d}", task) for i, task in enumerate(paragraphs, 1)]
+
+
+def run_task(agent: str, root: str, task_id: str, query: str, workdir: str, limits: dict = None) -> dict:
+    """
+    Runs one task in a pool process. The agent module is set up in the task's workdir, so the tools, the
+    session database and the log all live there. limits holds the Limits arguments for the task's code.
+    """
+    result = {"id": task_id, "workdir": workdir}
+    # setup reads the API key relative to the repository root, and a pool process runs several tasks
+    os.chdir(root)
+    module = importlib.import_module(agent)
+    start = time.perf_counter()
+    try:
+        module.setup(workdir, f"{agent}.log")
+        # the transcript printed by call_agent_async would interleave with other tasks; the log has it all
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            workspace = Workspace(workdir, Limits(**(limits or {})))
+            result.update(asyncio.run(module.task(query, session_id=task_id, workspace=workspace)))
+    except Exception as e:
+        logging.error(f"ERROR: {e}")
+        result.update(status="error", final=str(e))
+    finally:
+        worker.stop(workdir)
+    counts = report.counts(workdir) or {}
+    result["tests passed"] = counts.get("passed", "-")
+    result["wall time"] = round(time.perf_counter() - start, 1)
+    return result
+
+
+def table(results: list) -> str:
+    rows = [[str(result.get(column, "-")) for column in COLUMNS] for result in results]
+    rows = [list(COLUMNS)] + rows
+    widths = [max(len(row[i]) for row in rows) for i in range(len(COLUMNS))]
+    lines = ["  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in rows]
+    lines.insert(1, "  ".join("-" * width for width in widths))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a file of tasks concurrently in isolated workdirs.")
+    parser.add_argument("tasks", help="task file: paragraphs separated by blank lines, or .jsonl with task and id")
+    parser.add_argument("--concurrency", type=int, default=os.cpu_count() or 1, help="tasks run at once")
+    parser.add_argument("--agent", default="teddy", choices=("teddy", "teddy_lite"))
+    parser.add_argument("--out", default="runs", help="directory holding one workdir per task")
+    parser.add_argument("--timeout", type=float, help="seconds a program or test run may take")
+    parser.add_argument("--cpu-seconds", type=float, help="CPU seconds a program or test run may use")
+    parser.add_argument("--memory-mb", type=float, help="address space a program or test run may use")
+    args = parser.parse_args()
+    limits = {"timeout": args.timeout, "cpu_seconds": args.cpu_seconds, "memory_mb": args.memory_mb}
+
+    root = os.getcwd()
+    tasks = read_tasks(args.tasks)
+    out = os.path.abspath(args.out)
+    results = []
+    # spawned processes start clean: no inherited event loop, session database or worker sockets
+    with ProcessPoolExecutor(max_workers=max(1, args.concurrency), mp_context=get_context("spawn")) as pool:
+        futures = {
+            pool.submit(run_task, args.agent, root, task_id, query, os.path.join(out, task_id), limits): task_id
+            for task_id, query in tasks
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"id": futures[future], "status": "error", "final": str(e)}
+            results.append(result)
+            print(f"{result['id']}: {result['status']} ({len(results)}/{len(tasks)})")
+
+    order = {task_id: i for i, (task_id, _) in enumerate(tasks)}
+    results.sort(key=lambda result: order[result["id"]])
+    os.makedirs(out, exist_ok=True)
+    with open(os.path.join(out, "summary.json"), "w") as f:
+        json.dump(results, f, indent=2)
+    print(table(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""
+Offline benchmark of the orchestration: the real system loop and tools, with a scripted model.
+
+Usage: uv run bench.py [scenario ...] [--agent teddy|teddy_lite] [--out bench_runs] [--max-iterations N]
+                       [--baseline bench_runs/bench.json]
+
+Every LiteLlm in the agent tree is replaced by a ScriptedLlm that answers each model call with the next
+step of a recorded conversation (text and/or function calls), whichever agent asks, and with IDLE once
+the script is used up. The tools run for real in <out>/<scenario>/, so the numbers include test runs,
+installs and file I/O, but no API calls or keys. Installs still need an index; set TEDDY_FIND_LINKS to a
+wheel directory to run without network (see deps.py).
+
+Scenarios are seeded from examples/:
+    stock_app              the function calls and messages of the working stock_app run, from its teddy.log
+    road_trip_weather_app  the files of the stuck road trip run written one by one, then a test run that
+                           does not pass, after which the agents idle until the loop gives up
+
+For each scenario the wall time, time spent in tools, model calls, session events per second, loop
+iterations and the iteration of the first green run_pytest are reported, and saved to <out>/bench.json.
+With --baseline the wall and tool times are compared with an earlier bench.json.
+"""
+
+import argparse
+import ast
+import asyncio
+import contextlib
+import importlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from typing import AsyncGenerator
+
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+from google.genai import types
+
+import telemetry
+from sessions import SqliteSessionService
+from state import STATE_DIR
+from workspace import Workspace
+
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "examples")
+STOCK_LOG = os.path.join(EXAMPLES, "working", "requirements_incomplete", "stock_app", "stock_app", "teddy.log")
+ROAD_TRIP_DIR = os.path.join(EXAMPLES, "stuck", "road_trip_weather_app")
+IDLE = "Continue."
+COLUMNS = ("scenario", "status", "wall time", "tool time", "model calls", "events/s", "iterations", "green at")
+
+LOG_LINE_RE = re.compile(r"^(DEBUG|INFO|WARNING|ERROR|CRITICAL):")
+AGENT_LINE_RE = re.compile(r"^INFO:root:\[(\w+)\]\s?(.*)$")
+GREEN_RE = re.compile(r"^pytest: .*\(exit code 0\)$", re.M)
+
+
+class ScriptedLlm(BaseLlm):
+    """
+    Answers model calls with the steps of a script in order: {"text": str or None, "calls": [(name, args)]}.
+    """
+
+    steps: list = []
+    position: int = 0
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        if self.position < len(self.steps):
+            step = self.steps[self.position]
+            self.position += 1
+        else:
+            step = {"text": IDLE, "calls": []}
+        parts = [types.Part(text=step["text"])] if step.get("text") else []
+        parts += [types.Part(function_call=types.FunctionCall(name=name, args=args)) for name, args in step["calls"]]
+        yield LlmResponse(content=types.Content(role="model", parts=parts))
+
+
+class Scenario:
+    def __init__(self, name: str, task: str, steps: list):
+        self.name = name
+        self.task = task
+        self.steps = steps
+
+
+def from_log(name: str, path: str) -> Scenario:
+    """
+    Builds a scenario from a teddy.log: the query, then one step per model response, i.e. the messages
+    and function calls up to the next function responses.
+    """
+    task, steps, step, in_text = "", [], {"text": None, "calls": []}, False
+
+    def flush():
+        nonlocal step
+        if step["text"] or step["calls"]:
+            steps.append(step)
+        step = {"text": None, "calls": []}
+
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not LOG_LINE_RE.match(line):
+                # continuation of a multi-line message
+                if in_text:
+                    step["text"] += "\n" + line
+                continue
+            in_text = False
+            if line.startswith("INFO:root:Running query: "):
+                task = line[len("INFO:root:Running query: ") :]
+                continue
+            match = AGENT_LINE_RE.match(line)
+            if not match:
+                continue
+            message = match.group(2)
+            if message.startswith("Function call: "):
+                step["calls"].append(ast.literal_eval(message[len("Function call: ") :]))
+            elif message.startswith("Function response: "):
+                flush()
+            elif message.startswith("Task Complete: "):
+                flush()
+                step["text"] = message[len("Task Complete: ") :]
+                flush()
+            elif message and not message.startswith("==>"):
+                if step["calls"]:
+                    flush()
+                step["text"] = f"{step['text']}\n{message}" if step["text"] else message
+                in_text = True
+    flush()
+    return Scenario(name, task, steps)
+
+
+def from_files(name: str, directory: str, task: str) -> Scenario:
+    """
+    Builds a scenario that writes the python files of directory (code, then tests) and runs pytest.
+    """
+    files = sorted(f for f in os.listdir(directory) if f.endswith((".py", ".txt")))
+    files.sort(key=lambda f: f.startswith("test_"))
+    steps = []
+    for filename in files:
+        # the examples were recorded on Windows; a stray cp1252 byte is not worth failing over
+        with open(os.path.join(directory, filename), encoding="utf-8", errors="replace") as f:
+            steps.append({"text": None, "calls": [("write_file", {"file_path": filename, "content": f.read()})]})
+    steps.append({"text": None, "calls": [("run_pytest", {"tests_dir": ""})]})
+    steps.append({"text": "The code and tests are written.", "calls": []})
+    return Scenario(name, task, steps)
+
+
+def scenarios() -> dict:
+    road_trip_task = importlib.import_module("teddy_lite").TASK
+    return {
+        "stock_app": lambda: from_log("stock_app", STOCK_LOG),
+        "road_trip_weather_app": lambda: from_files("road_trip_weather_app", ROAD_TRIP_DIR, road_trip_task),
+    }
+
+
+def _llm_agents(agent):
+    if hasattr(agent, "model"):
+        yield agent
+    for sub_agent in agent.sub_agents:
+        yield from _llm_agents(sub_agent)
+
+
+def _progress(events: list, iterations_key: str) -> int:
+    # the iteration of the first passing run_pytest, or None
+    iteration = 0
+    for event in events:
+        iteration = event.actions.state_delta.get(iterations_key, iteration)
+        for part in (event.content.parts if event.content else None) or []:
+            response = part.function_response
+            if response and response.name == "run_pytest":
+                if GREEN_RE.search(str((response.response or {}).get("result", ""))):
+                    return iteration
+    return None
+
+
+async def run_scenario(module, scenario: Scenario, out: str) -> dict:
+    workdir = os.path.join(out, scenario.name)
+    shutil.rmtree(workdir, ignore_errors=True)
+    os.makedirs(workdir)
+    # the same pytest.ini that setup() writes, without reading the API key
+    with open(os.path.join(workdir, "pytest.ini"), "w") as f:
+        f.write("[pytest]\npythonpath = .\n")
+    logging.basicConfig(filename=os.path.join(workdir, "bench.log"), level=logging.INFO, force=True)
+
+    model = ScriptedLlm(model="scripted", steps=scenario.steps)
+    for agent in _llm_agents(module.system):
+        agent.model = model
+    workspace = Workspace(workdir)
+    start = time.perf_counter()
+    result = await module.task(scenario.task, session_id=scenario.name, workspace=workspace)
+    wall = time.perf_counter() - start
+
+    session_service = SqliteSessionService(os.path.join(workspace.root, STATE_DIR, module.SESSION_DB))
+    try:
+        session = session_service.get_session(
+            app_name=module.APP_NAME, user_id=module.USER_ID, session_id=scenario.name
+        )
+        events = session.events if session else []
+    finally:
+        session_service.close()
+    summary = telemetry.summarize(workspace.root)
+    return {
+        "scenario": scenario.name,
+        "status": result["status"],
+        "wall time": round(wall, 2),
+        "tool time": round(sum(tool["time"] for tool in summary["tools"].values()), 2),
+        "model calls": summary["totals"]["model_calls"],
+        "events": len(events),
+        "events/s": round(len(events) / wall, 1) if wall else 0,
+        "iterations": result.get("iterations", 0),
+        "green at": _progress(events, module.system.iterations_key),
+    }
+
+
+def table(results: list, baseline: dict = None) -> str:
+    rows = [list(COLUMNS)]
+    for result in results:
+        row = ["-" if result.get(column) is None else str(result[column]) for column in COLUMNS]
+        previous = (baseline or {}).get(result["scenario"])
+        if previous:
+            for i, column in enumerate(COLUMNS):
+                if column in ("wall time", "tool time") and previous.get(column):
+                    row[i] += f" ({(result[column] - previous[column]) / previous[column]:+.0%})"
+        rows.append(row)
+    widths = [max(len(row[i]) for row in rows) for i in range(len(COLUMNS))]
+    lines = ["  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in rows]
+    lines.insert(1, "  ".join("-" * width for width in widths))
+    return "\n".join(lines)
+
+
+def main():
+    available = scenarios()
+    parser = argparse.ArgumentParser(description="Benchmark the agent loop offline with a scripted model.")
+    parser.add_argument("scenarios", nargs="*", help=f"scenarios to run: {', '.join(available)} (default all)")
+    parser.add_argument("--agent", default="teddy", choices=("teddy", "teddy_lite"))
+    parser.add_argument("--out", default="bench_runs", help="directory holding one workdir per scenario")
+    parser.add_argument("--max-iterations", type=int, help="override the loop's max_iterations")
+    parser.add_argument("--baseline", help="an earlier bench.json to compare with")
+    args = parser.parse_args()
+    unknown = [name for name in args.scenarios if name not in available]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    module = importlib.import_module(args.agent)
+    if args.max_iterations:
+        module.system.max_iterations = args.max_iterations
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {result["scenario"]: result for result in json.load(f)}
+
+    out = os.path.abspath(args.out)
+    results = []
+    for name in args.scenarios or available:
+        # the transcript printed by call_agent_async goes to the log instead
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            results.append(asyncio.run(run_scenario(module, available[name](), out)))
+        print(f"{name}: {results[-1]['status']} in {results[-1]['wall time']} s")
+    with open(os.path.join(out, "bench.json"), "w") as f:
+        json.dump(results, f, indent=2)
+    print(table(results, baseline))
+
+
+if __name__ == "__main__":
+    main()
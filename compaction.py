@@ -0,0 +1,166 @@
+"""
+Rolling compaction of the conversation history each agent sends to the model.
+
+Use a Compactor as an agent's before_model_callback. It keeps the most recent contents verbatim,
+replaces older tool calls and tool results with short digests ("wrote stock.py, 120 lines, sha ...",
+"pytest: 14 passed ...") and, if the request is still over the agent's token budget, drops the oldest
+turns after the task message. Token counts before and after are logged.
+
+ADK hands every agent the tool calls of the other agents as text ("[coder] called tool `write_file`
+with parameters: {...}"), so both structured function parts and those text renderings are digested.
+"""
+
+import ast
+import hashlib
+import logging
+import re
+
+from google.genai import types
+
+
+CHARS_PER_TOKEN = 4
+MAX_ARG_CHARS = 200
+MAX_RESULT_CHARS = 300
+MAX_TEXT_CHARS = 1500
+CALL_TEXT_RE = re.compile(r"^\[(?P<author>[^\]]+)\] called tool `(?P<name>\w+)` with parameters: (?P<args>.*)$", re.S)
+RESULT_TEXT_RE = re.compile(r"^\[(?P<author>[^\]]+)\] `(?P<name>\w+)` tool returned result: (?P<result>.*)$", re.S)
+
+
+def estimate_tokens(contents: list) -> int:
+    """
+    A cheap token estimate (characters / 4) of text, function call and function response parts.
+    """
+    chars = 0
+    for content in contents:
+        for part in content.parts or []:
+            if part.text:
+                chars += len(part.text)
+            elif part.function_call:
+                chars += len(part.function_call.name or "") + len(str(part.function_call.args))
+            elif part.function_response:
+                chars += len(part.function_response.name or "") + len(str(part.function_response.response))
+    return chars // CHARS_PER_TOKEN
+
+
+def _fingerprint(text: str) -> str:
+    return f"{text.count(chr(10)) + 1} lines, sha {hashlib.sha256(text.encode()).hexdigest()[:8]}"
+
+
+def _truncate(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit] + f"... ({len(text) - limit} chars compacted)"
+
+
+def digest_args(name: str, args: dict) -> dict:
+    """
+    Replaces long arguments, e.g. the content of write_file, with a line count and hash.
+    """
+    digested = {}
+    for key, value in (args or {}).items():
+        if isinstance(value, str) and len(value) > MAX_ARG_CHARS:
+            value = f"<{_fingerprint(value)}>" if key == "content" else _truncate(value, MAX_ARG_CHARS)
+        digested[key] = value
+    return digested
+
+
+def digest_result(name: str, response) -> str:
+    """
+    Summarizes a tool result in one short line.
+    """
+    result = response.get("result", response) if isinstance(response, dict) else response
+    text = result if isinstance(result, str) else str(result)
+    if name == "run_pytest":
+        lines = text.splitlines()
+        summary = [line for line in lines if line.startswith(("pytest:", "pytest exited", "No tests affected"))]
+        failing = [line for line in lines if line.startswith("Failing (")]
+        return " ".join(summary[:1] + failing[:1]) or _truncate(text, MAX_RESULT_CHARS)
+    if name == "read_file" and not text.startswith("Error") and len(text) > MAX_RESULT_CHARS:
+        return f"<file contents, {_fingerprint(text)}>"
+    return _truncate(text, MAX_RESULT_CHARS)
+
+
+def _literal(text: str):
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return None
+
+
+def _digest_text(text: str) -> str:
+    call = CALL_TEXT_RE.match(text)
+    if call:
+        args = _literal(call["args"])
+        if isinstance(args, dict):
+            if call["name"] == "write_file" and "file_path" in args:
+                return f"[{call['author']}] wrote {args['file_path']}, {_fingerprint(str(args.get('content', '')))}"
+            return f"[{call['author']}] called tool `{call['name']}` with parameters: {digest_args(call['name'], args)}"
+        return _truncate(text, MAX_RESULT_CHARS)
+    result = RESULT_TEXT_RE.match(text)
+    if result:
+        response = _literal(result["result"])
+        digest = digest_result(result["name"], response if response is not None else result["result"])
+        return f"[{result['author']}] `{result['name']}` tool returned: {digest}"
+    return _truncate(text, MAX_TEXT_CHARS)
+
+
+def digest_content(content: types.Content):
+    """
+    Digests the parts of one (copied) request content in place.
+    """
+    for part in content.parts or []:
+        if part.text:
+            part.text = _digest_text(part.text)
+        elif part.function_call:
+            part.function_call.args = digest_args(part.function_call.name, part.function_call.args)
+        elif part.function_response:
+            response = part.function_response.response
+            part.function_response.response = {"result": digest_result(part.function_response.name, response)}
+
+
+def _is_function_response(content: types.Content) -> bool:
+    return any(part.function_response for part in content.parts or [])
+
+
+class Compactor:
+    """
+    A before_model_callback that compacts the request history. The last keep_recent contents are sent
+    verbatim unless they alone exceed the budget; budget_tokens is the default budget and budgets maps
+    agent names to their own budgets.
+    """
+
+    def __init__(self, budget_tokens: int = 16000, keep_recent: int = 12, budgets: dict = None):
+        self.budget_tokens = budget_tokens
+        self.keep_recent = keep_recent
+        self.budgets = budgets or {}
+
+    def __call__(self, callback_context, llm_request):
+        contents = llm_request.contents
+        agent = callback_context.agent_name
+        before = estimate_tokens(contents)
+        # the first content is the user's task and is never compacted
+        old = max(1, len(contents) - self.keep_recent)
+        for content in contents[1:old]:
+            digest_content(content)
+
+        budget = self.budgets.get(agent, self.budget_tokens)
+        cut = 1
+        while estimate_tokens(contents[:1] + contents[cut:]) > budget and cut < old:
+            cut += 1
+        # never start the kept history with a tool result whose call was dropped
+        while cut < len(contents) and _is_function_response(contents[cut]):
+            cut += 1
+        if cut > 1:
+            note = types.Content(
+                role="user", parts=[types.Part(text=f"[{cut - 1} earlier messages were dropped to fit the context budget]")]
+            )
+            contents[:] = contents[:1] + [note] + contents[cut:]
+
+        # the recent turns alone can exceed a small budget; then digest them too, except the latest
+        for content in contents[max(1, len(contents) - self.keep_recent) : -1]:
+            if estimate_tokens(contents) <= budget:
+                break
+            digest_content(content)
+
+        after = estimate_tokens(contents)
+        if after < before:
+            logging.info(f"[{agent}] context compacted from ~{before} to ~{after} tokens ({len(contents)} contents)")
+        return None
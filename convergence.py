@@ -0,0 +1,128 @@
+"""
+Ends the loop on objective criteria instead of on whoever says TASK_COMPLETE first.
+
+The task counts as done when the last run of the whole suite passed with at least min_tests tests (and
+min_coverage percent coverage, if set and measured) and no python or config file has changed since that
+run. ConvergenceController checks this once per iteration as a sub-agent of the loop; when it holds, it
+says TASK_COMPLETE and escalates, which ends a ResumableLoopAgent right away. It also ends the run when
+the tests have not improved for patience iterations, rather than letting the loop spin to max_iterations.
+
+call_agent_async accepts a TASK_COMPLETE from the other agents only if check() agrees, so a premature
+token no longer ends a run with failing or untested code.
+"""
+
+import logging
+from typing import AsyncGenerator, Optional
+
+from google.adk.agents import BaseAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+from google.genai import types
+
+import report
+from selection import TestMap
+from workspace import current
+
+
+STALLED = "STOPPING: the tests have not improved for {} iterations."
+
+
+def _failing(counts: dict) -> int:
+    return counts.get("failed", 0) + counts.get("errors", 0)
+
+
+class ConvergenceController(BaseAgent):
+    """
+    Checks the test state of the workspace once per loop iteration and ends the loop when the task is done
+    or stalled. Progress (the most tests passing, the fewest failing, the highest coverage) is kept in the
+    session state.
+    """
+
+    min_tests: int = 1
+    min_coverage: Optional[float] = None
+    patience: int = 5
+
+    @property
+    def progress_key(self) -> str:
+        return f"{self.name}:progress"
+
+    def check(self, root: str) -> tuple:
+        """
+        Returns (done, reason): whether the workspace at root meets the completion criteria, and why not.
+        """
+        full = report.last_full(root)
+        if not full or not full.get("counts"):
+            return False, "the whole test suite has not been run; run run_pytest with full=True"
+        counts = full["counts"]
+        if full["returncode"] != 0 or _failing(counts):
+            return False, f"the last full test run did not pass ({_failing(counts)} failing)"
+        if counts.get("passed", 0) < self.min_tests:
+            return False, f"only {counts.get('passed', 0)} tests passed, at least {self.min_tests} are required"
+        coverage = counts.get("coverage")
+        if self.min_coverage is not None and (coverage is None or coverage < self.min_coverage):
+            measured = "was not measured" if coverage is None else f"is {coverage:g}%"
+            hint = "run run_pytest with full=True and coverage=True and test the gaps it lists"
+            return False, f"coverage {measured}, at least {self.min_coverage:g}% is required; {hint}"
+        test_map = TestMap(root)
+        test_map.scan()
+        if test_map.fingerprint() != full.get("fingerprint"):
+            return False, "files changed since the last full test run; run run_pytest with full=True again"
+        return True, f"all {counts['passed']} tests pass on the current code"
+
+    def _progress(self, root: str, state: dict) -> dict:
+        counts = report.counts(root)
+        progress = dict(state or {"passed": -1, "failing": None, "stalled": 0})
+        if counts:
+            improved = (
+                counts.get("passed", 0) > progress["passed"]
+                or (progress["failing"] is not None and _failing(counts) < progress["failing"])
+                or counts.get("coverage", -1) > progress.get("coverage", -1)
+            )
+            progress["passed"] = max(progress["passed"], counts.get("passed", 0))
+            progress["coverage"] = max(progress.get("coverage", -1), counts.get("coverage", -1))
+            if progress["failing"] is None or _failing(counts) < progress["failing"]:
+                progress["failing"] = _failing(counts)
+        else:
+            # before the first test run, writing code counts as progress
+            test_map = TestMap(root)
+            test_map.scan()
+            improved = test_map.fingerprint() != progress.get("fingerprint")
+            progress["fingerprint"] = test_map.fingerprint()
+        progress["stalled"] = 0 if improved else progress["stalled"] + 1
+        return progress
+
+    def _event(self, ctx: InvocationContext, delta: dict, text: str = None, escalate: bool = False) -> Event:
+        return Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            content=types.Content(role="model", parts=[types.Part(text=text)]) if text else None,
+            actions=EventActions(state_delta=delta, escalate=escalate),
+        )
+
+    def _claimed(self, ctx: InvocationContext) -> bool:
+        # whether another agent said TASK_COMPLETE since this controller last ran
+        for event in reversed(ctx.session.events):
+            if event.author == self.name:
+                return False
+            parts = event.content.parts if event.content else None
+            if any(part.text and "TASK_COMPLETE" in part.text for part in parts or []):
+                return True
+        return False
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        root = current().root
+        done, reason = self.check(root)
+        if done:
+            logging.info(f"[{self.name}] Converged: {reason}")
+            yield self._event(ctx, {}, f"TASK_COMPLETE: {reason}.", escalate=True)
+            return
+        progress = self._progress(root, ctx.session.state.get(self.progress_key))
+        if self.patience and progress["stalled"] >= self.patience:
+            logging.info(f"[{self.name}] Stalled for {progress['stalled']} iterations: {reason}")
+            text = f"{STALLED.format(progress['stalled'])} Not done: {reason}."
+            yield self._event(ctx, {self.progress_key: progress}, text, escalate=True)
+            return
+        # a premature TASK_COMPLETE is answered with what is still missing
+        text = f"The task is not complete: {reason}." if self._claimed(ctx) else None
+        yield self._event(ctx, {self.progress_key: progress}, text)
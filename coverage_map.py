@@ -0,0 +1,215 @@
+"""
+Line and branch coverage for run_pytest(coverage=True), kept per file across runs.
+
+The test process measures coverage itself: the warm test worker starts coverage.py around pytest.main,
+and the `uv run` fallback runs pytest under `coverage run`. Both use the rc file written by prepare() and
+one data file per pytest process (a sharded run has several). update() combines them, turns them into
+the executed and missing lines and branches of every measured file, and merges that into
+.teddy/coverage.json. A file whose content is unchanged keeps what earlier runs executed in it, so a run
+of only the affected tests still adds up to the coverage of the whole suite; a changed file takes this
+run's data alone, which is complete because every test depending on it was selected.
+
+render() lists the gaps per module: functions no test enters and the remaining missing line ranges and
+branches, so the tester can write tests for exactly those.
+"""
+
+import ast
+import glob
+import hashlib
+import json
+import os
+
+from state import load_json, save_json, state_path
+
+
+COVERAGE_FILE = "coverage.json"
+DATA_DIR = "coverage"
+RC_FILE = "coveragerc"
+# modules and gaps listed by render()
+MAX_MODULES = 10
+MAX_GAPS = 8
+RC = """[run]
+branch = True
+source = {root}
+omit =
+    */test_*.py
+    */*_test.py
+    */conftest.py
+    */.teddy/*
+    */.venv/*
+
+[report]
+exclude_also =
+    if __name__ == .__main__.:
+"""
+
+
+def prepare(root: str) -> str:
+    """
+    Writes the rc file for root, removes data files left by an earlier run and returns the rc file path.
+    """
+    rcfile = state_path(root, os.path.join(DATA_DIR, RC_FILE))
+    os.makedirs(os.path.dirname(rcfile), exist_ok=True)
+    with open(rcfile, "w") as f:
+        f.write(RC.format(root=root))
+    for path in glob.glob(state_path(root, os.path.join(DATA_DIR, ".coverage*"))):
+        os.remove(path)
+    return rcfile
+
+
+def data_file(root: str, name: str) -> str:
+    """
+    Returns the data file for one pytest process of a run, e.g. a shard.
+    """
+    return state_path(root, os.path.join(DATA_DIR, f".coverage.{name}"))
+
+
+def _sha(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def _measure(root: str) -> dict:
+    """
+    Returns {path relative to root: {"lines", "missing", "branches", "missing_branches"}} from the data files
+    of the last run, or None if there are none.
+    """
+    import coverage
+
+    paths = glob.glob(state_path(root, os.path.join(DATA_DIR, ".coverage.*")))
+    if not paths:
+        return None
+    report_file = state_path(root, os.path.join(DATA_DIR, "report.json"))
+    cov = coverage.Coverage(
+        data_file=state_path(root, os.path.join(DATA_DIR, ".coverage")),
+        config_file=state_path(root, os.path.join(DATA_DIR, RC_FILE)),
+    )
+    cov.combine(paths)
+    cov.load()
+    try:
+        cov.json_report(outfile=report_file, ignore_errors=True)
+    except coverage.exceptions.NoDataError:
+        return {}
+    with open(report_file) as f:
+        files = json.load(f)["files"]
+    measured = {}
+    for filename, data in files.items():
+        rel = os.path.relpath(os.path.abspath(filename), root)
+        if rel.startswith(".."):
+            continue
+        measured[rel] = {
+            "lines": sorted(data["executed_lines"] + data["missing_lines"]),
+            "missing": data["missing_lines"],
+            "branches": sorted(data.get("executed_branches", []) + data.get("missing_branches", [])),
+            "missing_branches": data.get("missing_branches", []),
+        }
+    return measured
+
+
+def _merge(old: dict, new: dict) -> dict:
+    # the same content: whatever either run executed counts as covered
+    missing = set(old["missing"]) & set(new["missing"])
+    missing_branches = {tuple(arc) for arc in old["missing_branches"]} & {tuple(arc) for arc in new["missing_branches"]}
+    return {**new, "missing": sorted(missing), "missing_branches": sorted(list(arc) for arc in missing_branches)}
+
+
+def update(root: str):
+    """
+    Merges the data files of the last run into root's coverage map and returns the map, or None if the run
+    measured nothing (e.g. coverage.py is not installed in the workdir's environment).
+    """
+    measured = _measure(root)
+    if measured is None:
+        return None
+    stored = load_json(root, COVERAGE_FILE, {})
+    merged = {}
+    for rel, entry in stored.items():
+        path = os.path.join(root, rel)
+        if os.path.isfile(path) and _sha(path) == entry["sha"]:
+            merged[rel] = entry
+    for rel, entry in measured.items():
+        entry["sha"] = _sha(os.path.join(root, rel))
+        merged[rel] = _merge(merged[rel], entry) if rel in merged else entry
+    save_json(root, COVERAGE_FILE, merged)
+    return merged
+
+
+def percent(files: dict) -> float:
+    """
+    The coverage of all files the way `coverage report` computes it with branches: covered lines and
+    branches over all lines and branches.
+    """
+    total = sum(len(entry["lines"]) + len(entry["branches"]) for entry in files.values())
+    missing = sum(len(entry["missing"]) + len(entry["missing_branches"]) for entry in files.values())
+    return round(100.0 * (total - missing) / total, 1) if total else 100.0
+
+
+def _functions(path: str) -> list:
+    # (qualname, first line, last line) of every function and method
+    try:
+        with open(path) as f:
+            tree = ast.parse(f.read())
+    except (OSError, SyntaxError, ValueError, UnicodeDecodeError):
+        return []
+    functions = []
+
+    def visit(body, scope):
+        for node in body:
+            if isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+                qualname = f"{scope}.{node.name}" if scope else node.name
+                if not isinstance(node, ast.ClassDef):
+                    functions.append((qualname, node.lineno, node.end_lineno))
+                visit(node.body, qualname)
+
+    visit(tree.body, "")
+    return functions
+
+
+def _ranges(lines: list) -> str:
+    ranges = []
+    for line in sorted(lines):
+        if ranges and line == ranges[-1][1] + 1:
+            ranges[-1][1] = line
+        else:
+            ranges.append([line, line])
+    return ", ".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+
+def gaps(root: str, rel: str, entry: dict) -> list:
+    """
+    Returns the gaps of one file: untested functions, then missing line ranges and branches outside them.
+    """
+    missing = set(entry["missing"])
+    lines = set(entry["lines"])
+    found, untested = [], set()
+    for qualname, first, last in _functions(os.path.join(root, rel)):
+        body = {line for line in lines if first < line <= last}
+        if body and body <= missing and not any(first <= line <= last for line in untested):
+            found.append(f"untested {qualname} ({first}-{last})")
+            untested.update(range(first, last + 1))
+    rest = sorted(missing - untested)
+    if rest:
+        found.append(f"lines {_ranges(rest)}")
+    branches = [arc for arc in entry["missing_branches"] if arc[0] not in untested]
+    if branches:
+        arcs = ", ".join(f"{a}->{b if b > 0 else 'exit'}" for a, b in branches[:MAX_GAPS])
+        found.append(f"branches {arcs}" + (" ..." if len(branches) > MAX_GAPS else ""))
+    return found
+
+
+def render(root: str, files: dict) -> str:
+    """
+    Returns the coverage summary and the gaps of the least covered modules.
+    """
+    count = f"{len(files)} file" if len(files) == 1 else f"{len(files)} files"
+    lines = [f"Coverage: {percent(files):g}% of lines and branches in {count}."]
+    ranked = sorted(files.items(), key=lambda item: -(len(item[1]["missing"]) + len(item[1]["missing_branches"])))
+    for rel, entry in ranked[:MAX_MODULES]:
+        found = gaps(root, rel, entry)
+        if found:
+            lines.append(f"{rel} ({percent({rel: entry}):g}%): " + "; ".join(found))
+    if len(lines) == 1:
+        lines.append("No gaps.")
+    elif len(ranked) > MAX_MODULES and any(gaps(root, rel, entry) for rel, entry in ranked[MAX_MODULES:]):
+        lines.append("More modules have gaps; run again after closing these.")
+    return "\n".join(lines)
@@ -0,0 +1,155 @@
+"""
+Dependency management for the generated code.
+
+Instead of one `uv add` per package, discovered after a failing run, the imports of the workdir's code
+are scanned before each program or test run; whatever is not importable in the workdir's environment is
+installed in a single `uv add`, i.e. one resolution and one lock update. All workdirs share one uv
+cache (see subprocs.uv_env), so a wheel is downloaded and built once and then linked into every
+environment that needs it.
+
+Set TEDDY_FIND_LINKS to a directory of wheels to install fully offline from it instead of from PyPI.
+"""
+
+import json
+import logging
+import os
+import sys
+import sysconfig
+
+import worker
+from state import load_json, save_json
+from subprocs import LimitExceeded, log_output, run_process, uv_env
+
+
+DEPS_FILE = "deps.json"
+# import names that differ from the name of the distribution providing them
+ALIASES = {
+    "bs4": "beautifulsoup4",
+    "cv2": "opencv-python",
+    "dateutil": "python-dateutil",
+    "dotenv": "python-dotenv",
+    "fitz": "pymupdf",
+    "jwt": "pyjwt",
+    "magic": "python-magic",
+    "PIL": "pillow",
+    "serial": "pyserial",
+    "skimage": "scikit-image",
+    "sklearn": "scikit-learn",
+    "telegram": "python-telegram-bot",
+    "yaml": "pyyaml",
+    "zmq": "pyzmq",
+}
+FIND_SPEC = (
+    "import importlib.util, json, sys\n"
+    "print(json.dumps([name for name in sys.argv[1:] if importlib.util.find_spec(name) is None]))"
+)
+
+
+def _stdlib() -> set:
+    names = set(getattr(sys, "stdlib_module_names", ())) | set(sys.builtin_module_names)
+    if not getattr(sys, "stdlib_module_names", None):
+        # before Python 3.10: everything directly in the standard library directory
+        stdlib = sysconfig.get_paths()["stdlib"]
+        for entry in os.listdir(stdlib):
+            name, ext = os.path.splitext(entry)
+            if ext == ".py" or (not ext and os.path.isdir(os.path.join(stdlib, entry))):
+                names.add(name)
+    return names
+
+
+STDLIB = _stdlib()
+
+
+def distribution(name: str) -> str:
+    """
+    Returns the distribution to install for an import name.
+    """
+    return ALIASES.get(name, name)
+
+
+def index_args() -> list:
+    find_links = os.environ.get("TEDDY_FIND_LINKS")
+    if find_links:
+        return ["--offline", "--no-index", "--find-links", os.path.abspath(find_links)]
+    return []
+
+
+def imported_packages(root: str) -> list:
+    """
+    Returns the third-party top-level names imported by the code under root.
+    """
+    return sorted(name for name in worker.third_party_imports(root) if name not in STDLIB)
+
+
+async def missing(root: str, names: list, limits) -> list:
+    """
+    Returns the names that cannot be imported in root's environment.
+    """
+    if not names:
+        return []
+    command = ["uv", "run", "python", "-c", FIND_SPEC, *names]
+    returncode, stdout, stderr = await run_process(command, root, timeout=limits.install_timeout, env=uv_env())
+    if returncode != 0:
+        raise RuntimeError(stderr.strip() or stdout.strip())
+    return json.loads(stdout.strip().splitlines()[-1])
+
+
+async def install(root: str, packages: list, limits) -> tuple:
+    """
+    Adds packages to root's project in one resolution and returns (installed, {package: error}). If the
+    batch fails, the packages are retried one by one so that one bad name does not block the others.
+    """
+    packages = sorted(set(packages))
+    if not packages:
+        return [], {}
+
+    async def add(batch):
+        command = ["uv", "add", *index_args(), *batch]
+        return await run_process(command, root, log_output("uv add"), limits.install_timeout, env=uv_env())
+
+    installed, failed = [], {}
+    returncode, _, stderr = await add(packages)
+    if returncode == 0:
+        installed = packages
+    elif len(packages) == 1:
+        failed[packages[0]] = stderr.strip()
+    else:
+        for package in packages:
+            returncode, _, stderr = await add([package])
+            if returncode == 0:
+                installed.append(package)
+            else:
+                failed[package] = stderr.strip()
+    if installed:
+        # the warm test worker has the old environment imported, start a fresh one next time
+        worker.stop(root)
+        logging.info(f"Installed {', '.join(installed)} in {root}")
+    return installed, failed
+
+
+async def ensure(root: str, limits, extra: tuple = ()) -> str:
+    """
+    Installs the packages imported by the code under root, and the extra ones (e.g. coverage for a run
+    measuring it), that are missing from its environment and returns a note for the agent, or "" if there
+    was nothing to do. The import set that was last checked is kept in .teddy/deps.json, so unchanged code
+    costs nothing.
+    """
+    state = load_json(root, DEPS_FILE, {})
+    names = sorted(set(imported_packages(root)) | set(extra))
+    if names == state.get("checked"):
+        return ""
+    try:
+        absent = await missing(root, names, limits)
+        # names that could not be installed before are not retried on every run
+        packages = [distribution(name) for name in absent if distribution(name) not in state.get("failed", {})]
+        installed, failed = await install(root, packages, limits)
+    except (LimitExceeded, RuntimeError, ValueError, IndexError) as e:
+        logging.warning(f"Dependency check failed in {root}. {e}")
+        return ""
+    save_json(root, DEPS_FILE, {"checked": names, "failed": {**state.get("failed", {}), **failed}})
+    notes = []
+    if installed:
+        notes.append(f"Installed missing packages: {', '.join(installed)}.")
+    if failed:
+        notes.append(f"Could not install imported packages: {', '.join(failed)}.")
+    return " ".join(notes)
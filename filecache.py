@@ -0,0 +1,248 @@
+"""
+In-process cache of the files the tools read and write, with a journal of the changes they made.
+
+Each workspace has a FileCache. Reads are served from memory while a file's mtime and size are unchanged,
+so agents re-reading the same file cost a stat instead of a read. Writes replace the file atomically, and
+writes whose content matches the file are skipped, which keeps its mtime and therefore the test selection
+(selection.TestMap) untouched. Every write, move, new directory and new file is recorded in the journal
+with the loop iteration it happened in, so the planner can ask what changed since iteration N instead of
+listing and reading everything.
+
+Files changed by the generated code itself (e.g. output of a program) are not journaled, but the cache
+notices them by their mtime and size.
+
+page() returns a range of lines. Files too large to cache are memory-mapped and scanned for line breaks,
+so a page of a huge log costs the lines up to it rather than the whole file.
+"""
+
+import hashlib
+import mmap
+import os
+import shutil
+
+
+# larger files are read from disk every time instead of being kept in memory
+MAX_CACHED_BYTES = 1024 * 1024
+# a file with a NUL byte in its first BINARY_SNIFF bytes is treated as binary
+BINARY_SNIFF = 8192
+COUNT_CHUNK = 16 * 1024 * 1024
+
+
+def is_binary(path: str) -> bool:
+    with open(path, "rb") as file:
+        return b"\0" in file.read(BINARY_SNIFF)
+
+
+class Page:
+    """
+    Lines offset to offset + len(lines) of a file with total lines in all; truncated when lines were
+    left out of the range asked for, or cut when the last line itself was too long and was cut short.
+    """
+
+    def __init__(self, lines: list, offset: int, total: int, truncated: bool, cut: bool = False):
+        self.lines = lines
+        self.offset = offset
+        self.total = total
+        self.truncated = truncated or cut
+        self.cut = cut
+
+    @property
+    def text(self) -> str:
+        return "".join(self.lines)
+
+    @property
+    def end(self) -> int:
+        return self.offset + len(self.lines)
+
+
+def digest(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8", errors="surrogateescape")).hexdigest()[:12]
+
+
+class Change:
+    """
+    One journal entry: action is "created", "modified", "deleted", "moved" or "mkdir"; moves also hold the
+    source.
+    """
+
+    def __init__(self, iteration: int, action: str, path: str, sha: str = None, source: str = None):
+        self.iteration = iteration
+        self.action = action
+        self.path = path
+        self.sha = sha
+        self.source = source
+
+    def __str__(self):
+        if self.action == "moved":
+            return f"moved {self.source} -> {self.path}"
+        if self.action == "mkdir":
+            return f"created directory {self.path}"
+        if self.action == "deleted":
+            return f"deleted {self.path}"
+        return f"{self.action} {self.path} (sha {self.sha})"
+
+
+class FileCache:
+    """
+    Content cache and change journal for the files under root. Paths are absolute, as returned by
+    Workspace.resolve; the journal holds them relative to root. iteration is the loop iteration that
+    changes are recorded under, kept up to date by call_agent_async.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.iteration = 0
+        self.journal = []
+        self._entries = {}  # path -> (mtime_ns, size, sha, text)
+        self._written = {}  # path -> (mtime_ns, size) after its last write()
+
+    def _stat(self, path: str):
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+
+    def _entry(self, path: str):
+        entry = self._entries.get(path)
+        if entry is not None:
+            try:
+                if self._stat(path) == entry[:2]:
+                    return entry
+            except OSError:
+                pass
+            del self._entries[path]
+        return None
+
+    def _store(self, path: str, text: str) -> str:
+        sha = digest(text)
+        stat = self._stat(path)
+        if stat[1] <= MAX_CACHED_BYTES:
+            self._entries[path] = (*stat, sha, text)
+        return sha
+
+    def read(self, path: str) -> str:
+        """
+        Returns the text of path, from memory if it has not changed since it was last read or written.
+        """
+        entry = self._entry(path)
+        if entry is not None:
+            return entry[3]
+        with open(path, "r") as file:
+            text = file.read()
+        self._store(path, text)
+        return text
+
+    def page(self, path: str, offset: int, limit: int, max_chars: int) -> Page:
+        """
+        Returns at most limit lines of path (all if 0), starting after the first offset lines and cut
+        short once they hold max_chars characters. A first line longer than that is cut at max_chars.
+        """
+        if os.path.getsize(path) <= MAX_CACHED_BYTES:
+            lines = self.read(path).splitlines(keepends=True)
+            total = len(lines)
+            wanted = lines[offset : offset + limit if limit else None]
+            cut = bool(wanted) and len(wanted[0]) > max_chars
+            if cut:
+                wanted = [wanted[0][:max_chars]]
+        else:
+            wanted, total, cut = self._scan(path, offset, limit, max_chars)
+        taken, chars = [], 0
+        for line in wanted:
+            if taken and chars + len(line) > max_chars:
+                break
+            taken.append(line)
+            chars += len(line)
+        end = min(total, offset + limit) if limit else total
+        return Page(taken, offset, total, offset + len(taken) < end, cut and len(taken) == 1)
+
+    def _scan(self, path: str, offset: int, limit: int, max_chars: int) -> tuple:
+        # returns (up to limit lines after offset, limited to about max_chars, total line count, whether
+        # the first line was cut)
+        with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            position, skipped = 0, 0
+            # whole chunks before the page are only counted
+            while position < len(data):
+                count = data[position : position + COUNT_CHUNK].count(b"\n")
+                if skipped + count >= offset:
+                    break
+                skipped += count
+                position += COUNT_CHUNK
+            position = min(position, len(data))
+            while skipped < offset and position < len(data):
+                newline = data.find(b"\n", position)
+                position = len(data) if newline < 0 else newline + 1
+                skipped += 1
+            lines, size, cut = [], 0, False
+            while position < len(data) and (not limit or len(lines) < limit) and size <= max_chars:
+                newline = data.find(b"\n", position)
+                end = len(data) if newline < 0 else newline + 1
+                # a single huge line, e.g. minified data, is cut at max_chars
+                cut = cut or (not lines and end - position > max_chars)
+                lines.append(data[position : min(end, position + max_chars)].decode("utf-8", errors="replace"))
+                size += len(lines[-1])
+                position = end
+            rest = sum(data[i : i + COUNT_CHUNK].count(b"\n") for i in range(position, len(data), COUNT_CHUNK))
+            # a last line without a newline counts too
+            last = len(data) > position and data[-1:] != b"\n"
+            return lines, skipped + len(lines) + rest + last, cut
+
+    def sha(self, path: str) -> str:
+        """
+        Returns the content hash of path.
+        """
+        entry = self._entry(path)
+        if entry is not None:
+            return entry[2]
+        return digest(self.read(path))
+
+    def write(self, path: str, text: str) -> bool:
+        """
+        Writes text to path unless the file already holds exactly that text. Returns whether it wrote.
+        """
+        existed = os.path.isfile(path)
+        if existed:
+            try:
+                if self.read(path) == text:
+                    return False
+            except (OSError, UnicodeDecodeError):
+                pass
+        # written next to it and renamed over it, so a file hardlinked into a fork (see speculate.py) is
+        # replaced rather than changed in place, and readers never see half a file
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as file:
+            file.write(text)
+        if existed:
+            shutil.copymode(path, tmp)
+        os.replace(tmp, path)
+        self._written[path] = self._stat(path)
+        sha = self._store(path, text)
+        self.record("modified" if existed else "created", path, sha)
+        return True
+
+    def wrote(self, path: str) -> bool:
+        """
+        Returns whether path still holds what write() last put there, i.e. a file replaced rather than
+        changed in place.
+        """
+        try:
+            return self._written.get(path) == self._stat(path)
+        except OSError:
+            return False
+
+    def record(self, action: str, path: str, sha: str = None, source: str = None):
+        """
+        Adds a change made by a tool to the journal, e.g. a move or a new directory.
+        """
+        if source is not None:
+            self._forget(source)
+            source = os.path.relpath(source, self.root)
+        self.journal.append(Change(self.iteration, action, os.path.relpath(path, self.root), sha, source))
+
+    def _forget(self, path: str):
+        prefix = path + os.sep
+        for cached in [cached for cached in self._entries if cached == path or cached.startswith(prefix)]:
+            del self._entries[cached]
+
+    def changes(self, since_iteration: int = 0) -> list:
+        """
+        Returns the journal entries recorded in iteration since_iteration or later.
+        """
+        return [change for change in self.journal if change.iteration >= since_iteration]
@@ -0,0 +1,151 @@
+"""
+A content-addressed, disk-backed cache of LiteLLM responses.
+
+Responses are keyed on the model, the messages, the tool schema and the sampling parameters of the
+request, and stored as JSON files under .teddy_cache/llm next to this module. The least recently used
+entries are evicted once the cache grows past its size limit.
+
+Modes:
+    record       serve cached responses and store every new one (the default)
+    replay       serve cached responses only; a miss raises CacheMiss, so runs are fully offline
+    passthrough  always call the model and never touch the cache
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from google.adk.models.lite_llm import LiteLLMClient
+from litellm import ModelResponse
+
+import telemetry
+
+
+MODES = ("record", "replay", "passthrough")
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".teddy_cache", "llm")
+MAX_BYTES = 512 * 1024 * 1024
+
+
+class CacheMiss(Exception):
+    """
+    Raised in replay mode when a request has no recorded response.
+    """
+
+
+def _jsonable(value):
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    if hasattr(value, "__dict__"):
+        return vars(value)
+    return str(value)
+
+
+def request_key(model: str, messages: list, tools, **kwargs) -> str:
+    """
+    Returns the cache key of a completion request.
+    """
+    request = {"model": model, "messages": messages, "tools": tools, "params": kwargs}
+    canonical = json.dumps(request, sort_keys=True, default=_jsonable, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LlmCache:
+    """
+    JSON files named by request key, sharded by the first two hex digits, with size-based LRU eviction.
+    File mtimes record last use.
+    """
+
+    def __init__(self, path: str = CACHE_DIR, max_bytes: int = MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], f"{key}.json")
+
+    def get(self, key: str):
+        path = self._file(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            os.utime(path)
+            return data
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key: str, data: dict):
+        path = self._file(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, default=_jsonable)
+        os.replace(tmp, path)
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += os.path.getsize(path)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        for shard in os.scandir(self.path):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".json"):
+                    st = entry.stat()
+                    yield entry.path, st.st_size, st.st_mtime
+
+    def _evict(self):
+        # drop the least recently used entries until the cache is at 90% of its limit
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        self._size = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self._size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                self._size -= size
+            except OSError:
+                pass
+
+
+class CachingLiteLLMClient(LiteLLMClient):
+    """
+    A LiteLLMClient that serves and records completions through an LlmCache. Pass it to LiteLlm as
+    llm_client. Streaming calls are never cached.
+    """
+
+    def __init__(self, mode: str = "record", cache: LlmCache = None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown LLM cache mode {mode!r}, expected one of {', '.join(MODES)}.")
+        self.mode = mode
+        self.cache = cache or LlmCache()
+        self.hits = 0
+        self.misses = 0
+
+    async def acompletion(self, model, messages, tools, **kwargs):
+        if self.mode == "passthrough" or kwargs.get("stream"):
+            response = await super().acompletion(model, messages, tools, **kwargs)
+            if not kwargs.get("stream"):
+                telemetry.record_usage(response, cached=False)
+            return response
+        key = request_key(model, messages, tools, **kwargs)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.hits += 1
+            logging.info(f"LLM cache hit {key[:12]} ({model})")
+            response = ModelResponse(**cached)
+            telemetry.record_usage(response, cached=True)
+            return response
+        self.misses += 1
+        if self.mode == "replay":
+            raise CacheMiss(f"No recorded response for request {key[:12]} ({model}) in {self.cache.path}.")
+        response = await super().acompletion(model, messages, tools, **kwargs)
+        telemetry.record_usage(response, cached=False)
+        self.cache.put(key, response.model_dump())
+        return response
@@ -0,0 +1,59 @@
+"""
+A LoopAgent that can be resumed where it stopped.
+"""
+
+import logging
+from typing import AsyncGenerator
+
+from google.adk.agents import LoopAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+
+
+class ResumableLoopAgent(LoopAgent):
+    """
+    A LoopAgent that records its position (iteration and next sub-agent) in the session state after
+    every sub-agent turn. When it is run again on a persisted session that still holds a position, e.g.
+    after a crash, it continues from that agent and iteration instead of starting over. The number of
+    iterations started is kept under "<name>:iterations".
+    """
+
+    @property
+    def position_key(self) -> str:
+        return f"{self.name}:position"
+
+    @property
+    def iterations_key(self) -> str:
+        return f"{self.name}:iterations"
+
+    def _state_event(self, ctx: InvocationContext, delta: dict) -> Event:
+        return Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            actions=EventActions(state_delta=delta),
+        )
+
+    def _position_event(self, ctx: InvocationContext, position) -> Event:
+        return self._state_event(ctx, {self.position_key: position})
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        position = ctx.session.state.get(self.position_key) or {}
+        iteration = position.get("iteration", 0)
+        start = position.get("next", 0)
+        if position:
+            logging.info(f"Resuming {self.name} at iteration {iteration + 1}, agent {self.sub_agents[start].name}")
+        while not self.max_iterations or iteration < self.max_iterations:
+            if start == 0:
+                yield self._state_event(ctx, {self.iterations_key: iteration + 1})
+            for index in range(start, len(self.sub_agents)):
+                async for event in self.sub_agents[index].run_async(ctx):
+                    yield event
+                    if event.actions.escalate:
+                        yield self._position_event(ctx, None)
+                        return
+                following = (index + 1) % len(self.sub_agents)
+                yield self._position_event(ctx, {"iteration": iteration + (following == 0), "next": following})
+            start = 0
+            iteration += 1
+        yield self._position_event(ctx, None)
@@ -0,0 +1,171 @@
+"""
+Small edits for the coder: unified diffs, search-and-replace blocks and line ranges.
+
+An edit is validated completely before anything is written: every hunk or block must match the file,
+otherwise PatchError says which one did not and nothing changes. Hunks are looked for at the line their
+header names first and then anywhere in the file, and lines are compared exactly and then ignoring
+trailing whitespace, since models often get line numbers and blank-line whitespace slightly wrong.
+The edit functions return the new text and the changed line ranges, for excerpt().
+"""
+
+import re
+
+
+HUNK_RE = re.compile(r"^@@ -(\d+)(?:,\d+)? \+\d+(?:,\d+)? @@")
+SEARCH = re.compile(r"^<{5,} ?SEARCH\s*$")
+DIVIDER = re.compile(r"^={5,}\s*$")
+REPLACE = re.compile(r"^>{5,} ?REPLACE\s*$")
+EXCERPT_CONTEXT = 2
+EXCERPT_LINES = 40
+
+
+class PatchError(Exception):
+    """
+    Raised when an edit does not apply cleanly; the file is left unchanged.
+    """
+
+
+def is_search_replace(patch: str) -> bool:
+    return any(SEARCH.match(line) for line in patch.splitlines())
+
+
+def _split(text: str) -> tuple:
+    return text.splitlines(), text.endswith("\n") or not text
+
+
+def _join(lines: list, newline: bool) -> str:
+    return "\n".join(lines) + ("\n" if newline and lines else "")
+
+
+def _find(lines: list, block: list, hint: int = None) -> int:
+    """
+    Returns the index of the one place block occurs in lines, preferring hint, or raises PatchError.
+    """
+    for same in (lambda a, b: a == b, lambda a, b: a.rstrip() == b.rstrip()):
+        def at(i):
+            return all(same(lines[i + j], line) for j, line in enumerate(block))
+
+        if hint is not None and 0 <= hint <= len(lines) - len(block) and at(hint):
+            return hint
+        found = [i for i in range(len(lines) - len(block) + 1) if at(i)]
+        if len(found) == 1:
+            return found[0]
+        if len(found) > 1:
+            raise PatchError(f"it matches {len(found)} places (lines {', '.join(str(i + 1) for i in found[:5])})")
+    raise PatchError("it does not match the file")
+
+
+def parse_hunks(patch: str) -> list:
+    """
+    Returns [(start line or None, old lines, new lines)] for the hunks of a unified diff of one file.
+    """
+    hunks = []
+    for line in patch.splitlines():
+        if line.startswith("@@"):
+            match = HUNK_RE.match(line)
+            hunks.append((int(match.group(1)) if match else None, [], []))
+        elif not hunks or line.startswith("\\"):
+            # file headers and "\ No newline at end of file"
+            continue
+        elif line.startswith("-"):
+            hunks[-1][1].append(line[1:])
+        elif line.startswith("+"):
+            hunks[-1][2].append(line[1:])
+        else:
+            # context, also when the leading space was stripped, e.g. from a blank line
+            context = line[1:] if line.startswith(" ") else line
+            hunks[-1][1].append(context)
+            hunks[-1][2].append(context)
+    if not hunks:
+        raise PatchError("No hunks found. A unified diff needs @@ hunk headers.")
+    return hunks
+
+
+def parse_blocks(patch: str) -> list:
+    """
+    Returns [(search lines, replace lines)] for the SEARCH/REPLACE blocks in patch.
+    """
+    blocks, state = [], None
+    for line in patch.splitlines():
+        if SEARCH.match(line):
+            blocks.append(([], []))
+            state = 0
+        elif state == 0 and DIVIDER.match(line):
+            state = 1
+        elif state == 1 and REPLACE.match(line):
+            state = None
+        elif state is not None:
+            blocks[-1][state].append(line)
+    if state is not None:
+        raise PatchError("The last SEARCH/REPLACE block is not closed with >>>>>>> REPLACE.")
+    return blocks
+
+
+def _apply(text: str, edits: list, kind: str) -> tuple:
+    # edits: [(hint or None, old lines, new lines)], applied in order to the evolving text
+    lines, newline = _split(text)
+    regions, offset = [], 0
+    for number, (hint, old, new) in enumerate(edits, 1):
+        if not old:
+            raise PatchError(f"{kind} {number} has no lines to match; use write_file to create a file.")
+        try:
+            start = _find(lines, old, None if hint is None else hint + offset)
+        except PatchError as e:
+            raise PatchError(f"{kind} {number} does not apply: {e}. Its first line is {old[0]!r}.") from None
+        lines[start : start + len(old)] = new
+        shift = len(new) - len(old)
+        offset += shift
+        regions = [(a + shift, b + shift) if a > start else (a, b) for a, b in regions]
+        # the region is the changed lines, without the hunk's unchanged context
+        same = 0
+        while same < min(len(old), len(new)) and old[same] == new[same]:
+            same += 1
+        tail = 0
+        while tail < min(len(old), len(new)) - same and old[-1 - tail] == new[-1 - tail]:
+            tail += 1
+        regions.append((start + same, start + len(new) - tail))
+    return _join(lines, newline), sorted(regions)
+
+
+def apply_patch(text: str, patch: str) -> tuple:
+    """
+    Applies a unified diff or SEARCH/REPLACE blocks to text. Returns (new text, changed line ranges).
+    """
+    if is_search_replace(patch):
+        edits = [(None, search, replace) for search, replace in parse_blocks(patch)]
+        return _apply(text, edits, "Block")
+    edits = [(start - 1 if start else None, old, new) for start, old, new in parse_hunks(patch)]
+    return _apply(text, edits, "Hunk")
+
+
+def replace_lines(text: str, start_line: int, end_line: int, content: str) -> tuple:
+    """
+    Replaces lines start_line to end_line (1-based, inclusive) of text with content; end_line =
+    start_line - 1 inserts before start_line. Returns (new text, changed line ranges).
+    """
+    lines, newline = _split(text)
+    if not 1 <= start_line <= len(lines) + 1 or not start_line - 1 <= end_line <= len(lines):
+        raise PatchError(f"Lines {start_line}-{end_line} are outside the file, which has {len(lines)} lines.")
+    new = content.splitlines()
+    lines[start_line - 1 : end_line] = new
+    return _join(lines, newline), [(start_line - 1, start_line - 1 + len(new))]
+
+
+def excerpt(text: str, regions: list) -> str:
+    """
+    Returns the changed regions of text with line numbers and a little context.
+    """
+    lines = text.splitlines()
+    shown, parts = [], []
+    for start, end in regions:
+        first, last = max(0, start - EXCERPT_CONTEXT), min(len(lines), end + EXCERPT_CONTEXT)
+        if shown and first <= shown[-1][1]:
+            shown[-1] = (shown[-1][0], max(shown[-1][1], last))
+        else:
+            shown.append((first, last))
+    for first, last in shown:
+        numbered = [f"{i + 1:>4}: {lines[i]}" for i in range(first, min(last, first + EXCERPT_LINES))]
+        if last - first > EXCERPT_LINES:
+            numbered.append(f"      ... {last - first - EXCERPT_LINES} more lines")
+        parts.append("\n".join(numbered))
+    return "\n...\n".join(parts)
@@ -0,0 +1,220 @@
+"""
+Compact, structured pytest results built from the JUnit XML reports of a run.
+
+Instead of the raw transcript, agents get the counts, the failing test ids and one minimal traceback
+per distinct failure. Reports longer than the size cap are split into pages; the first page is returned
+by run_pytest and the rest are kept in .teddy/report.json for the pytest_report tool.
+"""
+
+import os
+import re
+import xml.etree.ElementTree as ET
+
+from state import load_json, save_json
+from subprocs import describe_exit
+
+
+REPORT_FILE = "report.json"
+HISTORY_FILE = "runs.json"
+HISTORY_LENGTH = 20
+PAGE_CHARS = 2000
+LOCATION_RE = re.compile(r"^(\S+?):(\d+):( in \S+| \w+)")
+NUMBER_RE = re.compile(r"0x[0-9a-f]+|\d+")
+MAX_ERROR_LINES = 6
+MAX_FAILING_IDS = 20
+
+
+def _nodeid(root: str, classname: str, name: str) -> str:
+    """
+    Turns a JUnit "classname" and "name" back into a pytest node id by finding the module file.
+    """
+    parts = classname.split(".") if classname else []
+    for i in range(len(parts), 0, -1):
+        path = "/".join(parts[:i]) + ".py"
+        if os.path.isfile(os.path.join(root, path)):
+            return "::".join([path, *parts[i:], name])
+    if not parts and os.path.isfile(os.path.join(root, name.replace(".", "/") + ".py")):
+        # collection errors are reported with the module as the name
+        return name.replace(".", "/") + ".py"
+    return "::".join([*parts, name])
+
+
+def minimal_traceback(text: str) -> list:
+    """
+    Keeps only the failing source line, the "E" lines and the innermost locations of a pytest traceback.
+    """
+    lines = text.splitlines()
+    source = [line for line in lines if line.startswith(">")][-1:]
+    errors = [line for line in lines if line.startswith("E ") and line[1:].strip() and "use -v" not in line.lower()]
+    if len(errors) > MAX_ERROR_LINES:
+        errors = errors[: MAX_ERROR_LINES - 1] + [f"E   ... ({len(errors) - MAX_ERROR_LINES + 1} more lines)"]
+    locations = [line for line in lines if LOCATION_RE.match(line)]
+    # frames in the workdir (relative paths) say more than library internals
+    local = [line for line in locations if not os.path.isabs(LOCATION_RE.match(line).group(1))]
+    locations = local[-2:] if local else locations[-1:]
+    if not (source or errors or locations):
+        return [line for line in lines if line.strip()][-MAX_ERROR_LINES:]
+    return source + errors + locations
+
+
+def _signature(tb: list) -> str:
+    # failures that differ only in numbers (ids, addresses, values) are grouped together
+    return NUMBER_RE.sub("#", "\n".join(line for line in tb if not line.startswith(">")))
+
+
+def parse_junit(root: str, junit_paths: list):
+    """
+    Returns {"counts": {...}, "failures": [{"id", "kind", "message", "traceback"}]} for the test cases in
+    the given reports, or None if none of them could be read.
+    """
+    counts = {"passed": 0, "failed": 0, "errors": 0, "skipped": 0}
+    failures = []
+    parsed = False
+    for path in junit_paths:
+        try:
+            tree = ET.parse(path)
+        except (OSError, ET.ParseError):
+            continue
+        parsed = True
+        for case in tree.iter("testcase"):
+            nodeid = _nodeid(root, case.get("classname", ""), case.get("name", ""))
+            outcome = None
+            for child in case:
+                if child.tag in ("failure", "error"):
+                    outcome = child
+                    break
+                if child.tag == "skipped":
+                    outcome = child
+            if outcome is None:
+                counts["passed"] += 1
+            elif outcome.tag == "skipped":
+                counts["skipped"] += 1
+            else:
+                kind = "failed" if outcome.tag == "failure" else "errors"
+                counts[kind] += 1
+                message = (outcome.get("message") or "").splitlines()
+                failures.append(
+                    {
+                        "id": nodeid,
+                        "kind": kind,
+                        "message": message[0][:200] if message else "",
+                        "traceback": minimal_traceback(outcome.text or ""),
+                    }
+                )
+    return {"counts": counts, "failures": failures} if parsed else None
+
+
+def render_raw(returncode: int, stdout: str, stderr: str, note: str = "") -> list:
+    """
+    Renders the tail of a transcript for runs that produced no JUnit report, e.g. pytest usage errors.
+    """
+    head = [f"pytest {describe_exit(returncode)} without a test report."]
+    if note:
+        head.insert(0, note.strip())
+    tail = [line for line in stdout.strip().splitlines() if line.strip()][-30:]
+    blocks = ["\n".join(head), "Output:\n" + "\n".join(tail)]
+    if stderr.strip():
+        blocks.append("Errors:\n" + "\n".join(stderr.strip().splitlines()[-30:]))
+    return blocks
+
+
+def render(result: dict, returncode: int, elapsed: float, note: str = "", stderr: str = "") -> list:
+    """
+    Renders a parsed result into text blocks: a summary block, then one block per distinct failure.
+    """
+    counts = result["counts"]
+    summary = ", ".join(f"{n} {kind}" for kind, n in counts.items() if n) or "no tests ran"
+    head = [f"pytest: {summary} in {elapsed:.2f}s (exit code {returncode})"]
+    if note:
+        head.insert(0, note.strip())
+    failing = [f["id"] for f in result["failures"]]
+    if failing:
+        shown = ", ".join(failing[:MAX_FAILING_IDS])
+        if len(failing) > MAX_FAILING_IDS:
+            shown += f" and {len(failing) - MAX_FAILING_IDS} more"
+        head.append(f"Failing ({len(failing)}): {shown}")
+    if stderr.strip():
+        head.append("Errors:\n" + "\n".join(stderr.strip().splitlines()[-MAX_ERROR_LINES:]))
+
+    groups = {}
+    for failure in result["failures"]:
+        groups.setdefault(_signature(failure["traceback"]), []).append(failure)
+    blocks = ["\n".join(head)]
+    for i, group in enumerate(groups.values(), 1):
+        first = group[0]
+        title = f"[{i}] {first['id']}"
+        if len(group) > 1:
+            title += f" (+{len(group) - 1} more with the same error: {', '.join(f['id'] for f in group[1:])})"
+        blocks.append("\n".join([title, *("    " + line for line in first["traceback"])]))
+    return blocks
+
+
+def paginate(blocks: list, limit: int = PAGE_CHARS) -> list:
+    """
+    Packs blocks into pages of at most limit characters; a single oversized block is cut.
+    """
+    pages = []
+    current = ""
+    for block in blocks:
+        if len(block) > limit:
+            block = block[: limit - 20] + "\n    ... (truncated)"
+        if current and len(current) + len(block) + 1 > limit:
+            pages.append(current)
+            current = ""
+        current = f"{current}\n{block}" if current else block
+    pages.append(current)
+    return pages
+
+
+def store(root: str, pages: list, counts: dict = None, full: dict = None) -> str:
+    """
+    Saves the pages and counts of the latest report and returns the first page with a paging hint. For a
+    run of the whole suite, full holds the returncode and the workdir fingerprint (selection.TestMap) it
+    ran on, and is kept as the last full run until the next one.
+    """
+    last_full = {**full, "counts": counts} if full else load_json(root, REPORT_FILE, {}).get("last_full")
+    save_json(root, REPORT_FILE, {"pages": pages, "counts": counts, "last_full": last_full})
+    return page(root, 1)
+
+
+def page(root: str, number: int) -> str:
+    pages = load_json(root, REPORT_FILE, {}).get("pages", [])
+    if not pages:
+        return "Error: No test report available. Run run_pytest first."
+    if number < 1 or number > len(pages):
+        return f"Error: The latest test report has {len(pages)} pages."
+    text = pages[number - 1]
+    if number < len(pages):
+        text += f"\n(page {number} of {len(pages)}; more available: call pytest_report with page={number + 1})"
+    return text
+
+
+def counts(root: str):
+    """
+    Returns the counts of the latest run, or None if there is none.
+    """
+    return load_json(root, REPORT_FILE, {}).get("counts")
+
+
+def last_full(root: str):
+    """
+    Returns {"counts", "returncode", "fingerprint"} of the latest run of the whole suite, or None.
+    """
+    return load_json(root, REPORT_FILE, {}).get("last_full")
+
+
+def record_run(root: str, passed: bool, failing: list, fingerprint: str = None):
+    """
+    Appends a run to the recent run history: whether it passed, the ids of its failing tests and the
+    fingerprint of the code it ran on.
+    """
+    runs = load_json(root, HISTORY_FILE, [])[-(HISTORY_LENGTH - 1) :]
+    run = {"passed": passed, "failing": sorted(failing), "fingerprint": fingerprint}
+    save_json(root, HISTORY_FILE, runs + [run])
+
+
+def history(root: str) -> list:
+    """
+    Returns the recent runs, oldest first.
+    """
+    return load_json(root, HISTORY_FILE, [])
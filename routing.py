@@ -0,0 +1,99 @@
+"""
+Tiered model routing: each agent gets a cheap model by default and a stronger one when it is stuck.
+
+A Router holds the model tiers, cheapest first, and a base and maximum tier per agent. Router.llm(agent)
+returns a RoutedLlm to pass to the agent as its model; it picks the tier for every call. An agent starts
+on its base tier and moves up one tier for every escalate_after consecutive failed test runs on the same
+unit (failing runs that share failing tests with the latest one, see report.history), up to its maximum.
+Once a run passes, the streak is over and the agent is back on its base tier. The history lives in the
+workdir, so a resumed run routes the same way.
+
+Every call is logged with the tier and model that served it, and the tier is added to the model call's
+telemetry span.
+"""
+
+import logging
+import os
+from typing import Any, AsyncGenerator
+
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+from google.adk.models.lite_llm import LiteLlm
+
+import report
+import telemetry
+from workspace import current
+
+
+# cheapest first; TEDDY_MODEL_TIERS overrides them with a comma separated list
+TIERS = ("openai/gpt-4.1-nano", "openai/gpt-4.1-mini", "openai/gpt-4.1")
+
+
+def tiers_from_env() -> tuple:
+    value = os.environ.get("TEDDY_MODEL_TIERS")
+    return tuple(model.strip() for model in value.split(",") if model.strip()) if value else TIERS
+
+
+def failing_streak(runs: list) -> int:
+    """
+    Returns the number of consecutive failed runs at the end of runs that fail on the same unit as the
+    latest one, i.e. share a failing test with it (or all failed without naming any test).
+    """
+    if not runs or runs[-1]["passed"]:
+        return 0
+    latest = set(runs[-1]["failing"])
+    streak = 0
+    for run in reversed(runs):
+        failing = set(run["failing"])
+        if run["passed"] or (latest or failing) and not latest & failing:
+            break
+        streak += 1
+    return streak
+
+
+class Router:
+    """
+    Picks a tier per agent and call. agents maps an agent name to (base tier, max tier); agents not listed
+    stay on tier 0.
+    """
+
+    def __init__(self, tiers=None, agents: dict = None, escalate_after: int = 2, llm_client=None):
+        self.tiers = tuple(tiers or tiers_from_env())
+        self.agents = agents or {}
+        self.escalate_after = escalate_after
+        client = {"llm_client": llm_client} if llm_client else {}
+        self.models = [LiteLlm(model=model, **client) for model in self.tiers]
+
+    def tier(self, agent: str, root: str) -> tuple:
+        """
+        Returns (tier, streak) for the next call of agent, with the failing streak that led to the tier.
+        """
+        base, top = self.agents.get(agent, (0, 0))
+        top = min(top, len(self.tiers) - 1)
+        streak = failing_streak(report.history(root))
+        return min(base + streak // self.escalate_after, max(base, top)), streak
+
+    def llm(self, agent: str) -> "RoutedLlm":
+        return RoutedLlm(model=f"routed/{agent}", agent=agent, router=self)
+
+
+class RoutedLlm(BaseLlm):
+    """
+    The model of one agent: forwards every call to the tier its Router picks.
+    """
+
+    agent: str
+    router: Any
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        # a speculative candidate escalates with the failures of the workdir it was forked from
+        tier, streak = self.router.tier(self.agent, current().state_root())
+        model = self.router.models[tier]
+        escalated = tier > self.router.agents.get(self.agent, (0, 0))[0]
+        reason = f", escalated after {streak} failed test runs" if escalated else ""
+        logging.info(f"[{self.agent}] Model tier {tier} ({model.model}){reason}")
+        telemetry.annotate(name=model.model, tier=tier)
+        llm_request.model = model.model
+        async for response in model.generate_content_async(llm_request, stream):
+            yield response
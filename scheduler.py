@@ -0,0 +1,174 @@
+"""
+An event-driven replacement for the fixed planner → specifier → coder → tester → reviewer cycle.
+
+The Scheduler runs in rounds, like the loop it replaces, but picks each next agent from the state of the
+workspace instead of taking them in order:
+
+    a monitor addressed an agent, e.g. "PLANNER, ..."    → that agent (only to open a round)
+    no code yet, or green and reviewed                   → planner (only to open a round)
+    after the planner                                    → specifier, or coder if there is none
+    after the specifier                                  → coder
+    code or tests changed since the last test run        → tester
+    the last test run failed on the current code         → coder
+    the last test run passed and nobody reviewed it      → reviewer
+
+Agents with nothing to do are skipped, and every agent runs at most once per round: when the state asks
+for one that already ran, or for nobody, the round ends with the monitors (the convergence controller
+and the aligner), which run once per round, the way they did once per iteration of the loop. A failing
+test run thus costs a coder and a tester turn per round instead of all five agents. max_turns caps the
+number of agent turns across rounds, max_iterations the number of rounds. With a speculator (see
+speculate.py), a coder turn on tests that keep failing writes several candidate fixes at once.
+
+The test state comes from the run history that run_pytest keeps (see report.record_run), so the
+scheduler needs no model call to decide. Like ResumableLoopAgent it records its position after every
+turn and continues a persisted session where it stopped.
+"""
+
+import logging
+import re
+from typing import Any, AsyncGenerator
+
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event
+
+import report
+from loop import ResumableLoopAgent
+from selection import TestMap, is_test_file
+from workspace import current
+
+
+class Scheduler(ResumableLoopAgent):
+    """
+    Runs the sub-agents named in monitors at the end of every round and picks the others by role, which is
+    their name: planner, specifier, coder, tester and reviewer. Missing roles are skipped.
+    """
+
+    monitors: list = []
+    max_turns: int = 0
+    speculator: Any = None
+
+    @property
+    def turns_key(self) -> str:
+        return f"{self.name}:turns"
+
+    @property
+    def reviewed_key(self) -> str:
+        return f"{self.name}:reviewed"
+
+    def _agent(self, role: str):
+        return next((agent for agent in self.sub_agents if agent.name == role and role not in self.monitors), None)
+
+    def observe(self, root: str) -> dict:
+        """
+        Returns the state the next agent is picked from: whether there is any code, the fingerprint of the
+        code and whether it changed since the last test run, and whether that run passed.
+        """
+        test_map = TestMap(root)
+        test_map.scan()
+        fingerprint = test_map.fingerprint()
+        runs = report.history(root)
+        last = runs[-1] if runs else None
+        python = [rel for rel in test_map.files if rel.endswith(".py")]
+        return {
+            "code": any(not is_test_file(rel.rsplit("/", 1)[-1]) for rel in python),
+            "fingerprint": fingerprint,
+            "changed": bool(python) and (last is None or last.get("fingerprint") != fingerprint),
+            "passed": bool(last and last["passed"]),
+            "failed": bool(last and not last["passed"]),
+        }
+
+    def addressed(self, text: str):
+        """
+        Returns the role of the first agent named in text, e.g. the planner in the aligner's "GUYS, YOU ARE
+        STUCK IN A LOOP. PLANNER, ISSUE A NEW TASK", or None.
+        """
+        roles = [agent.name for agent in self.sub_agents if agent.name not in self.monitors]
+        match = re.search(r"\b(" + "|".join(map(re.escape, roles)) + r")\b", text, re.I) if roles else None
+        return match.group(1).lower() if match else None
+
+    def pick(self, observed: dict, ran: list, addressed: str, reviewed: str):
+        """
+        Returns the role of the next agent of the round given what it observed, the roles that already ran
+        and the agent the monitors addressed at the end of the previous round, or None to end the round.
+        """
+        previous = ran[-1] if ran else None
+        reviewer = self._agent("reviewer")
+        green = observed["passed"] and not observed["changed"]
+        needs_review = green and reviewer is not None and reviewed != observed["fingerprint"]
+        if not ran and addressed:
+            role = addressed
+        elif not ran and (not observed["code"] or green and not needs_review):
+            role = "planner"
+        elif previous == "planner":
+            role = "specifier" if self._agent("specifier") else "coder"
+        elif previous == "specifier":
+            role = "coder"
+        elif observed["changed"]:
+            role = "tester"
+        elif observed["failed"]:
+            role = "coder"
+        elif needs_review:
+            role = "reviewer"
+        else:
+            role = None
+        if role is None or role in ran or not self._agent(role):
+            return None
+        return role
+
+    def _position_event(self, ctx: InvocationContext, position, **state) -> Event:
+        return self._state_event(ctx, {self.position_key: position, **state})
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        position = ctx.session.state.get(self.position_key) or {}
+        iteration = position.get("iteration", 0)
+        ran = list(position.get("ran", []))
+        addressed = position.get("addressed")
+        turns = ctx.session.state.get(self.turns_key) or 0
+        if position:
+            logging.info(f"Resuming {self.name} at iteration {iteration + 1} after {', '.join(ran) or 'no agent'}")
+        monitors = [agent for agent in self.sub_agents if agent.name in self.monitors]
+        root = current().root
+        while not self.max_iterations or iteration < self.max_iterations:
+            if not ran:
+                yield self._state_event(ctx, {self.iterations_key: iteration + 1})
+            while not self.max_turns or turns < self.max_turns:
+                observed = self.observe(root)
+                role = self.pick(observed, ran, addressed, ctx.session.state.get(self.reviewed_key))
+                if role is None:
+                    break
+                logging.info(f"[{self.name}] Iteration {iteration + 1}: {role}")
+                agent = self._agent(role)
+                if role == "coder" and self.speculator and self.speculator.wanted(root):
+                    turn = self.speculator.run(ctx, agent)
+                else:
+                    turn = agent.run_async(ctx)
+                async for event in turn:
+                    yield event
+                    if event.actions.escalate:
+                        yield self._position_event(ctx, None)
+                        return
+                ran.append(role)
+                turns += 1
+                state = {self.turns_key: turns}
+                if role == "reviewer":
+                    state[self.reviewed_key] = observed["fingerprint"]
+                position = {"iteration": iteration, "ran": list(ran), "addressed": addressed}
+                yield self._position_event(ctx, position, **state)
+            else:
+                logging.info(f"[{self.name}] Stopping after {turns} agent turns")
+                yield self._position_event(ctx, None)
+                return
+            # the agent a monitor speaks to, e.g. the aligner telling the coder to code, opens the next round
+            addressed = None
+            for monitor in monitors:
+                async for event in monitor.run_async(ctx):
+                    yield event
+                    for part in (event.content.parts if event.content else None) or []:
+                        addressed = addressed or (part.text and self.addressed(part.text))
+                    if event.actions.escalate:
+                        yield self._position_event(ctx, None)
+                        return
+            ran = []
+            iteration += 1
+            yield self._position_event(ctx, {"iteration": iteration, "ran": [], "addressed": addressed})
+        yield self._position_event(ctx, None)
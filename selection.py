@@ -0,0 +1,201 @@
+"""
+Change-aware test selection for run_pytest.
+
+Keeps an on-disk map (.teddy/testmap.json) of file content hashes, the local imports of every python
+file and the local files each test file depends on. A test file is selected when it, any module it
+imports (transitively), a conftest.py above it or the pytest configuration changed since the last
+green run.
+"""
+
+import ast
+import hashlib
+import os
+
+from state import load_json, save_json
+from worker import SKIP_DIRS, resolve
+
+
+MAP_FILE = "testmap.json"
+CONFIG_FILES = {"pytest.ini", "pyproject.toml", "setup.cfg", "tox.ini"}
+# files that uv and other tools outside FileCache rewrite in place, so they must never share an inode with a
+# fork or a snapshot
+REWRITTEN_IN_PLACE = CONFIG_FILES | {"uv.lock"}
+
+
+def is_test_file(filename: str) -> bool:
+    return filename.endswith(".py") and (filename.startswith("test_") or filename.endswith("_test.py"))
+
+
+def walk(top: str):
+    """
+    Yields the files under top, skipping environments, caches and hidden directories.
+    """
+    for dirpath, dirnames, filenames in os.walk(top):
+        dirnames[:] = sorted(d for d in dirnames if d not in SKIP_DIRS and not d.startswith("."))
+        for filename in sorted(filenames):
+            yield os.path.join(dirpath, filename)
+
+
+class TestMap:
+    """
+    The on-disk test map of one workdir. Paths are stored relative to the workdir root.
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.realpath(root)
+        data = load_json(self.root, MAP_FILE, {})
+        self.files = data.get("files", {})
+        self.green = data.get("green", {})
+        self.deps = data.get("deps", {})
+        self.green_deps = data.get("green_deps", {})
+
+    def save(self):
+        save_json(
+            self.root,
+            MAP_FILE,
+            {"files": self.files, "green": self.green, "deps": self.deps, "green_deps": self.green_deps},
+        )
+
+    def _rel(self, path: str) -> str:
+        # relative paths are relative to the root, not to the process cwd
+        return os.path.relpath(os.path.realpath(os.path.join(self.root, path)), self.root).replace(os.sep, "/")
+
+    def abspath(self, rel: str) -> str:
+        return os.path.join(self.root, *rel.split("/"))
+
+    def scan(self):
+        """
+        Refreshes hashes and direct imports of every python and config file, re-reading only files whose
+        size or mtime changed.
+        """
+        seen = {}
+        for path in walk(self.root):
+            name = os.path.basename(path)
+            if not name.endswith(".py") and name not in CONFIG_FILES:
+                continue
+            rel = self._rel(path)
+            st = os.stat(path)
+            entry = self.files.get(rel)
+            if entry is None or entry["mtime_ns"] != st.st_mtime_ns or entry["size"] != st.st_size:
+                with open(path, "rb") as f:
+                    data = f.read()
+                entry = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "sha": hashlib.sha256(data).hexdigest()[:16]}
+                if name.endswith(".py"):
+                    entry["imports"] = self._imports(path, data)
+            seen[rel] = entry
+        self.files = seen
+
+    def _imports(self, path: str, data: bytes) -> list:
+        """
+        Resolves the imports of one file to local files, searching the workdir root and the file's own
+        package base directory the way pytest's default import mode does.
+        """
+        try:
+            tree = ast.parse(data)
+        except (SyntaxError, ValueError):
+            return []
+        here = os.path.dirname(path)
+        base = here
+        while os.path.isfile(os.path.join(base, "__init__.py")) and base != self.root:
+            base = os.path.dirname(base)
+        search = [self.root] if base == self.root else [self.root, base]
+
+        found = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    found.update(self._resolve(alias.name.split("."), search))
+            elif isinstance(node, ast.ImportFrom):
+                if node.level:
+                    pkg = here
+                    for _ in range(node.level - 1):
+                        pkg = os.path.dirname(pkg)
+                    parts = node.module.split(".") if node.module else []
+                    bases = [pkg]
+                else:
+                    parts = node.module.split(".")
+                    bases = search
+                found.update(self._resolve(parts, bases))
+                for alias in node.names:
+                    found.update(self._resolve(parts + [alias.name], bases))
+        found.discard(self._rel(path))
+        return sorted(found)
+
+    def _resolve(self, parts: list, bases: list) -> list:
+        """
+        Returns the local files executed by importing the dotted name parts from the first base that has it.
+        """
+        return [self._rel(f) for f in resolve(parts, bases)]
+
+    def dependencies(self, test: str) -> list:
+        """
+        Returns the local files a test file depends on: its transitive imports and the conftest.py files
+        in its directory and above.
+        """
+        deps = set()
+        stack = [test]
+        while stack:
+            rel = stack.pop()
+            for dep in self.files.get(rel, {}).get("imports", []):
+                if dep not in deps and dep != test:
+                    deps.add(dep)
+                    stack.append(dep)
+        parts = test.split("/")[:-1]
+        for i in range(len(parts) + 1):
+            conftest = "/".join(parts[:i] + ["conftest.py"])
+            if conftest in self.files:
+                deps.add(conftest)
+        return sorted(deps)
+
+    def tests(self, tests_dir: str) -> list:
+        top = self._rel(tests_dir)
+        return [
+            rel
+            for rel in self.files
+            if is_test_file(rel.split("/")[-1]) and (top == "." or rel == top or rel.startswith(top + "/"))
+        ]
+
+    def _changed(self, rel: str) -> bool:
+        entry = self.files.get(rel)
+        return entry is None or self.green.get(rel) != entry["sha"]
+
+    def select(self, tests_dir: str):
+        """
+        Scans the workdir and returns (affected, all) test files under tests_dir, relative to the root.
+        """
+        self.scan()
+        tests = self.tests(tests_dir)
+        self.deps = {test: deps for test, deps in self.deps.items() if test in self.files}
+        self.deps.update((test, self.dependencies(test)) for test in tests)
+        self.save()
+        if any(self._changed(rel) for rel in self.files if rel in CONFIG_FILES):
+            return tests, tests
+
+        def affected(test):
+            # a dependency added or removed since the last green run counts as a change too
+            if self.green_deps.get(test) != self.deps[test]:
+                return True
+            return self._changed(test) or any(map(self._changed, self.deps[test]))
+
+        return [test for test in tests if affected(test)], tests
+
+    def fingerprint(self) -> str:
+        """
+        A hash of every scanned python and config file; it changes whenever any of them does.
+        """
+        entries = "\n".join(f"{rel} {entry['sha']}" for rel, entry in sorted(self.files.items()))
+        return hashlib.sha256(entries.encode()).hexdigest()[:16]
+
+    def record_green(self, tests: list):
+        """
+        Marks the given test files and everything they depend on as green at their current hashes.
+        """
+        for test in tests:
+            self.green_deps[test] = self.deps.get(test, [])
+            for rel in [test, *self.deps.get(test, [])]:
+                if rel in self.files:
+                    self.green[rel] = self.files[rel]["sha"]
+        for rel in CONFIG_FILES:
+            if rel in self.files:
+                self.green[rel] = self.files[rel]["sha"]
+        self.save()
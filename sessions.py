@@ -0,0 +1,190 @@
+"""
+A durable ADK session service backed by SQLite.
+
+Events are only ever appended: each one is stored as a JSON row, and the session state is rebuilt on
+load by replaying the state deltas of the events over the initial state. The database runs in WAL mode
+and commits in batches, so writing an event costs an insert rather than an fsync; close_session (called
+by call_agent_async when a run ends or fails) commits whatever is still pending.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Optional
+
+from google.adk.events import Event
+from google.adk.sessions import BaseSessionService, Session, State
+from google.adk.sessions.base_session_service import GetSessionConfig, ListEventsResponse, ListSessionsResponse
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    app_name TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    create_time REAL NOT NULL,
+    PRIMARY KEY (app_name, user_id, id)
+);
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    app_name TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    event TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_by_session ON events (app_name, user_id, session_id, seq);
+"""
+
+
+class SqliteSessionService(BaseSessionService):
+    """
+    Stores sessions and their events in a SQLite database at db_path. Pending event writes are committed
+    once batch_size events are queued or batch_seconds have passed since the last commit.
+    """
+
+    def __init__(self, db_path: str, batch_size: int = 20, batch_seconds: float = 2.0):
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.batch_seconds = batch_seconds
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._last_commit = time.monotonic()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def create_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        state: Optional[dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+    ) -> Session:
+        session_id = session_id.strip() if session_id and session_id.strip() else str(uuid.uuid4())
+        state = dict(state or {})
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO sessions (app_name, user_id, id, state, create_time) VALUES (?, ?, ?, ?, ?)",
+                (app_name, user_id, session_id, json.dumps(state), now),
+            )
+            self._commit()
+        return Session(id=session_id, app_name=app_name, user_id=user_id, state=state, last_update_time=now)
+
+    def get_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: Optional[GetSessionConfig] = None,
+    ) -> Optional[Session]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state, create_time FROM sessions WHERE app_name = ? AND user_id = ? AND id = ?",
+                (app_name, user_id, session_id),
+            ).fetchone()
+            if row is None:
+                return None
+            rows = self._conn.execute(
+                "SELECT event FROM events WHERE app_name = ? AND user_id = ? AND session_id = ? ORDER BY seq",
+                (app_name, user_id, session_id),
+            ).fetchall()
+        state = json.loads(row[0])
+        events = [Event.model_validate_json(data) for (data,) in rows]
+        for event in events:
+            if event.actions and event.actions.state_delta:
+                for key, value in event.actions.state_delta.items():
+                    if not key.startswith(State.TEMP_PREFIX):
+                        state[key] = value
+        last_update_time = events[-1].timestamp if events else row[1]
+        if config:
+            if config.after_timestamp:
+                events = [event for event in events if event.timestamp > config.after_timestamp]
+            if config.num_recent_events:
+                events = events[-config.num_recent_events :]
+        return Session(
+            id=session_id,
+            app_name=app_name,
+            user_id=user_id,
+            state=state,
+            events=events,
+            last_update_time=last_update_time,
+        )
+
+    def list_sessions(self, *, app_name: str, user_id: str) -> ListSessionsResponse:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT s.id, COALESCE(MAX(e.timestamp), s.create_time) FROM sessions s "
+                "LEFT JOIN events e ON e.app_name = s.app_name AND e.user_id = s.user_id AND e.session_id = s.id "
+                "WHERE s.app_name = ? AND s.user_id = ? GROUP BY s.id",
+                (app_name, user_id),
+            ).fetchall()
+        return ListSessionsResponse(
+            sessions=[
+                Session(id=session_id, app_name=app_name, user_id=user_id, last_update_time=updated)
+                for session_id, updated in rows
+            ]
+        )
+
+    def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM events WHERE app_name = ? AND user_id = ? AND session_id = ?",
+                (app_name, user_id, session_id),
+            )
+            self._conn.execute(
+                "DELETE FROM sessions WHERE app_name = ? AND user_id = ? AND id = ?", (app_name, user_id, session_id)
+            )
+            self._commit()
+
+    def list_events(self, *, app_name: str, user_id: str, session_id: str) -> ListEventsResponse:
+        session = self.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
+        return ListEventsResponse(events=session.events if session else [])
+
+    def append_event(self, session: Session, event: Event) -> Event:
+        event = super().append_event(session=session, event=event)
+        if event.partial:
+            return event
+        session.last_update_time = event.timestamp
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO events (app_name, user_id, session_id, timestamp, event) VALUES (?, ?, ?, ?, ?)",
+                (session.app_name, session.user_id, session.id, event.timestamp, event.model_dump_json(exclude_none=True)),
+            )
+            self._pending += 1
+            if self._pending >= self.batch_size or time.monotonic() - self._last_commit >= self.batch_seconds:
+                self._commit()
+        return event
+
+    def close_session(self, *, session: Session):
+        self.flush()
+
+    def flush(self):
+        """
+        Commits any batched event writes.
+        """
+        with self._lock:
+            self._commit()
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+    def _commit(self):
+        if self._pending:
+            logging.debug(f"Committing {self._pending} session events to {self.db_path}")
+        self._conn.commit()
+        self._pending = 0
+        self._last_commit = time.monotonic()
@@ -0,0 +1,205 @@
+"""
+Parallel, sharded pytest runs balanced on the per-test durations of previous runs.
+
+Every run writes a JUnit XML report; the test durations in it are kept in .teddy/durations.json and
+used to split the next sharded run into shards of roughly equal expected time (longest tests first).
+"""
+
+import asyncio
+import heapq
+import os
+import re
+import time
+import xml.etree.ElementTree as ET
+
+from coverage_map import data_file
+from state import load_json, save_json, state_path
+
+
+DURATIONS_FILE = "durations.json"
+DEFAULT_DURATION = 0.1
+SUMMARY_RE = re.compile(r"(\d+) (passed|failed|errors?|skipped|xfailed|xpassed|warnings?|deselected)")
+SECTION_RE = re.compile(r"^=+ (.*?) =+$")
+PROGRESS_RE = re.compile(r"^(\S+) ([.FEsxX]+)\s*(\[\s*\d+%\])?$")
+HEADER_LINES = ("platform ", "rootdir:", "configfile:", "plugins:", "collected ", "cachedir:")
+
+
+def junit_key(nodeid: str) -> str:
+    """
+    Returns the "classname::name" key pytest's junitxml plugin writes for a node id.
+    """
+    path, bracket, params = nodeid.partition("[")
+    names = path.split("::")
+    names[0] = re.sub(r"\.py$", "", names[0].replace("/", "."))
+    names[-1] += bracket + params
+    return ".".join(names[:-1]) + "::" + names[-1]
+
+
+def read_durations(junit_path: str) -> dict:
+    """
+    Returns {junit key: seconds} for every test case in a JUnit XML report.
+    """
+    try:
+        tree = ET.parse(junit_path)
+    except (OSError, ET.ParseError):
+        return {}
+    durations = {}
+    for case in tree.iter("testcase"):
+        key = f"{case.get('classname', '')}::{case.get('name', '')}"
+        durations[key] = float(case.get("time") or 0)
+    return durations
+
+
+def record_durations(root: str, junit_paths: list):
+    durations = load_json(root, DURATIONS_FILE, {})
+    for path in junit_paths:
+        durations.update(read_durations(path))
+    save_json(root, DURATIONS_FILE, durations)
+
+
+def balance(nodeids: list, durations: dict, shards: int) -> list:
+    """
+    Splits node ids into shards with the longest-processing-time-first heuristic. Tests without a
+    recorded duration get the mean of the known ones.
+    """
+    known = [durations[junit_key(n)] for n in nodeids if junit_key(n) in durations]
+    default = sum(known) / len(known) if known else DEFAULT_DURATION
+    cost = {n: durations.get(junit_key(n), default) for n in nodeids}
+    heap = [(0.0, i) for i in range(shards)]
+    buckets = [[] for _ in range(shards)]
+    for nodeid in sorted(nodeids, key=lambda n: cost[n], reverse=True):
+        load, i = heapq.heappop(heap)
+        buckets[i].append(nodeid)
+        heapq.heappush(heap, (load + cost[nodeid], i))
+    # keep each shard in collection order so output reads naturally
+    order = {n: i for i, n in enumerate(nodeids)}
+    return [sorted(bucket, key=order.get) for bucket in buckets if bucket]
+
+
+async def collect(run, args: list) -> list:
+    """
+    Returns the node ids pytest collects for args, or None if collection failed.
+    """
+    returncode, stdout, _ = await run("pytest", ["--collect-only", "-q", "-p", "no:cacheprovider", *args])
+    if returncode != 0:
+        return None
+    return [line.strip() for line in stdout.splitlines() if "::" in line and not line.startswith(" ")]
+
+
+def _sections(stdout: str) -> dict:
+    """
+    Splits a pytest transcript into its "=== title ===" sections; progress lines go under "progress".
+    """
+    sections = {"progress": []}
+    current = None
+    for line in stdout.splitlines():
+        if line.startswith(HEADER_LINES) or "generated xml file" in line:
+            continue
+        match = SECTION_RE.match(line)
+        if match:
+            title = match.group(1)
+            if title == "test session starts":
+                current = None
+                continue
+            current = "summary" if SUMMARY_RE.search(title) and " in " in title else title
+            sections.setdefault(current, [])
+            if current == "summary":
+                sections[current].append(title)
+            continue
+        if current is None:
+            if line.strip():
+                sections["progress"].append(line)
+            continue
+        sections[current].append(line)
+    return sections
+
+
+def merge(results: list, elapsed: float, total: int) -> tuple:
+    """
+    Merges the (returncode, stdout, stderr) results of the shards into one pytest-like transcript.
+    """
+    counts = {}
+    merged = {}
+    errors = []
+    for _, stdout, stderr in results:
+        sections = _sections(stdout)
+        for title, lines in sections.items():
+            if title == "summary":
+                for number, kind in SUMMARY_RE.findall(" ".join(lines)):
+                    kind = {"error": "errors", "warning": "warnings"}.get(kind, kind)
+                    counts[kind] = counts.get(kind, 0) + int(number)
+            else:
+                merged.setdefault(title, []).extend(lines)
+        if stderr.strip():
+            errors.append(stderr.strip())
+
+    def header(title):
+        return f" {title} ".center(80, "=")
+
+    lines = [header("test session starts"), f"collected {total} items in {len(results)} parallel shards", ""]
+    progress = {}
+    for line in merged.pop("progress", []):
+        match = PROGRESS_RE.match(line)
+        if match:
+            progress[match.group(1)] = progress.get(match.group(1), "") + match.group(2)
+        else:
+            lines.append(line)
+    lines += [f"{path} {marks}" for path, marks in sorted(progress.items())]
+    for title, body in merged.items():
+        lines += ["", header(title), *body]
+    order = ["failed", "passed", "skipped", "deselected", "xfailed", "xpassed", "errors", "warnings"]
+    summary = ", ".join(f"{counts[kind]} {kind}" for kind in order if counts.get(kind))
+    lines.append(header(f"{summary or 'no tests ran'} in {elapsed:.2f}s"))
+
+    codes = [returncode for returncode, _, _ in results]
+    # a shard killed by a signal has a negative code, which must not hide behind a passing shard
+    returncode = 0 if all(code == 0 for code in codes) else max(codes, key=abs)
+    return returncode, "\n".join(lines), "\n".join(errors)
+
+
+def _remove(path: str):
+    # a stale report from an earlier run must not be mistaken for this run's results
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _coverage(root: str, rcfile: str, name: str) -> dict:
+    # the keyword arguments that make run measure coverage into its own data file, see coverage_map.py
+    return {"coverage": {"rcfile": rcfile, "data_file": data_file(root, name)}} if rcfile else {}
+
+
+async def run_serial(run, root: str, args: list, rcfile: str = None) -> tuple:
+    """
+    Runs pytest once in a single process, recording the test durations for later sharded runs. With
+    rcfile, the run measures coverage. Returns (returncode, stdout, stderr, junit report paths).
+    """
+    junit = state_path(root, "junit.xml")
+    _remove(junit)
+    returncode, stdout, stderr = await run("pytest", ["--junitxml", junit, *args], **_coverage(root, rcfile, "0"))
+    record_durations(root, [junit])
+    return returncode, stdout, stderr, [junit]
+
+
+async def run_sharded(run, root: str, args: list, workers: int = 0, rcfile: str = None) -> tuple:
+    """
+    Runs the tests selected by args across parallel pytest processes and returns the merged
+    (returncode, stdout, stderr, junit report paths). run is the tools job runner,
+    await run(kind, args) -> (returncode, stdout, stderr). With rcfile, every shard measures coverage.
+    """
+    start = time.perf_counter()
+    nodeids = await collect(run, args)
+    workers = min(workers or os.cpu_count() or 1, len(nodeids or []))
+    if workers < 2:
+        return await run_serial(run, root, args, rcfile)
+
+    shards = balance(nodeids, load_json(root, DURATIONS_FILE, {}), workers)
+    junits = [state_path(root, f"junit-shard{i}.xml") for i in range(len(shards))]
+    for junit in junits:
+        _remove(junit)
+    jobs = [["-p", "no:cacheprovider", "--junitxml", junit, *shard] for junit, shard in zip(junits, shards)]
+    runs = [run("pytest", job, **_coverage(root, rcfile, str(i))) for i, job in enumerate(jobs)]
+    results = await asyncio.gather(*runs)
+    record_durations(root, junits)
+    return (*merge(results, time.perf_counter() - start, len(nodeids)), junits)
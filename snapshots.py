@@ -0,0 +1,233 @@
+"""
+Snapshots of the workdir at every green test run, for the rollback and diff_snapshot tools.
+
+A snapshot is a manifest, {path: content hash} of every file the tools see (selection.walk), in
+.teddy/snapshots/manifests/<id>.json. The contents live once each in a content-addressed store,
+.teddy/snapshots/objects/<hash>, as hardlinks to the workdir files rather than copies: a file that did not
+change since the last snapshot is already in the store, and one that did is linked in, so taking a
+snapshot costs a walk, a stat per file and a hash of the files whose mtime or size changed (remembered in
+.teddy/snapshots/index.json). A run whose files match the latest snapshot adds none.
+
+Sharing inodes with the workdir is safe because the file tools replace files instead of writing into them
+(see FileCache.write). Only files that still hold what the file tools wrote are linked; everything else
+(files the generated code writes, the ones uv rewrites in place) is copied, and restored as a copy. Log
+files, e.g. the run log that setup() keeps appending to in the workdir, are left out altogether. A store
+object that was changed in place anyway no longer matches its hash, and restore() leaves that file alone
+and says so.
+
+restore() relinks the files that differ from a snapshot and removes the ones created since, so a rollback
+costs about as much as taking a snapshot. The last KEEP snapshots are kept, with the objects they use.
+"""
+
+import difflib
+import glob
+import hashlib
+import os
+import shutil
+import time
+
+from selection import REWRITTEN_IN_PLACE, walk
+from state import load_json, save_json, state_path
+
+
+STORE_DIR = "snapshots"
+INDEX_FILE = os.path.join(STORE_DIR, "index.json")
+KEEP = 20
+# files that grow while the run goes on; they are neither snapshotted nor rolled back
+EXCLUDED_SUFFIXES = (".log",)
+# diff_snapshot replies are cut off after this many characters
+DIFF_MAX_CHARS = 20000
+
+
+def _hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+
+def _object(root: str, sha: str) -> str:
+    return state_path(root, os.path.join(STORE_DIR, "objects", sha[:2], sha))
+
+
+def _manifest_path(snapshot_id: int) -> str:
+    return os.path.join(STORE_DIR, "manifests", f"{snapshot_id}.json")
+
+
+def _link(source: str, target: str, copy: bool = False):
+    # atomically puts source's content at target, sharing its inode where possible
+    tmp = f"{target}.{os.getpid()}.tmp"
+    try:
+        if copy:
+            raise OSError
+        os.link(source, tmp)
+    except OSError:
+        shutil.copy2(source, tmp)
+    os.replace(tmp, target)
+
+
+def ids(root: str) -> list:
+    """
+    Returns the ids of the stored snapshots, oldest first.
+    """
+    pattern = state_path(root, os.path.join(STORE_DIR, "manifests", "*.json"))
+    return sorted(int(os.path.basename(path)[:-5]) for path in glob.glob(pattern))
+
+
+def load(root: str, snapshot_id: int = 0):
+    """
+    Returns the manifest of a snapshot, the latest one for 0, or None.
+    """
+    if not snapshot_id:
+        stored = ids(root)
+        if not stored:
+            return None
+        snapshot_id = stored[-1]
+    return load_json(root, _manifest_path(snapshot_id), None)
+
+
+def scan(root: str) -> dict:
+    """
+    Returns {path relative to root: content hash} of the workdir, hashing only files whose mtime or size
+    changed since the last scan.
+    """
+    index = load_json(root, INDEX_FILE, {})
+    files, seen = {}, {}
+    for path in walk(root):
+        if os.path.islink(path) or path.endswith(EXCLUDED_SUFFIXES):
+            continue
+        rel = os.path.relpath(path, root).replace(os.sep, "/")
+        st = os.stat(path)
+        cached = index.get(rel)
+        sha = cached[2] if cached and cached[:2] == [st.st_mtime_ns, st.st_size] else _hash(path)
+        files[rel] = sha
+        seen[rel] = [st.st_mtime_ns, st.st_size, sha]
+    save_json(root, INDEX_FILE, seen)
+    return files
+
+
+def _copied(path: str, files) -> bool:
+    # a file not (or no longer) as the file tools wrote it may be changed in place, so it shares no inode
+    return os.path.basename(path) in REWRITTEN_IN_PLACE or not files.wrote(path)
+
+
+def take(root: str, files, fingerprint: str = None) -> dict:
+    """
+    Snapshots the workdir at root and returns the manifest, or the latest one if nothing changed since.
+    files is the workspace's FileCache, which tells the files the tools wrote from the others and the
+    iteration the snapshot is taken in.
+    """
+    current = scan(root)
+    latest = load(root)
+    if latest and latest["files"] == current:
+        return latest
+    copied = []
+    for rel, sha in current.items():
+        path = os.path.join(root, *rel.split("/"))
+        copy = _copied(path, files)
+        if copy:
+            copied.append(rel)
+        target = _object(root, sha)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            _link(path, target, copy)
+    manifest = {
+        "id": latest["id"] + 1 if latest else 1,
+        "iteration": files.iteration,
+        "fingerprint": fingerprint,
+        "time": time.time(),
+        "files": current,
+        "copied": copied,
+    }
+    save_json(root, _manifest_path(manifest["id"]), manifest)
+    _prune(root)
+    return manifest
+
+
+def _prune(root: str):
+    stored = ids(root)
+    if len(stored) <= KEEP:
+        return
+    for snapshot_id in stored[:-KEEP]:
+        os.remove(state_path(root, _manifest_path(snapshot_id)))
+    used = set()
+    for snapshot_id in stored[-KEEP:]:
+        used.update(load(root, snapshot_id)["files"].values())
+    for path in glob.glob(state_path(root, os.path.join(STORE_DIR, "objects", "*", "*"))):
+        if os.path.basename(path) not in used:
+            os.remove(path)
+
+
+def restore(root: str, files, snapshot_id: int = 0):
+    """
+    Makes the workdir at root match a snapshot (the latest for 0), journaling the changes in the
+    workspace's FileCache files. Returns (manifest, changed paths, removed paths, damaged paths), or None
+    if there is no such snapshot. Damaged paths are the ones whose stored copy was changed in place and
+    were left as they are.
+    """
+    manifest = load(root, snapshot_id)
+    if manifest is None:
+        return None
+    current = scan(root)
+    copied = set(manifest.get("copied", ()))
+    changed, removed, damaged = [], [], []
+    for rel, sha in manifest["files"].items():
+        if current.get(rel) == sha:
+            continue
+        source = _object(root, sha)
+        if not os.path.exists(source) or _hash(source) != sha:
+            damaged.append(rel)
+            continue
+        path = os.path.join(root, *rel.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _link(source, path, copy=rel in copied or os.path.basename(path) in REWRITTEN_IN_PLACE)
+        try:
+            text_sha = files.sha(path)
+        except (OSError, UnicodeDecodeError):
+            text_sha = None
+        files.record("modified" if rel in current else "created", path, text_sha)
+        changed.append(rel)
+    for rel in sorted(set(current) - set(manifest["files"])):
+        path = os.path.join(root, *rel.split("/"))
+        os.remove(path)
+        files.record("deleted", path)
+        removed.append(rel)
+    return manifest, changed, removed, damaged
+
+
+def _text(path: str) -> list:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read().splitlines(keepends=True)
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+def diff(root: str, snapshot_id: int = 0, only: str = None):
+    """
+    Returns (manifest, unified diff text) of the workdir against a snapshot, limited to the path only if
+    given, or None if there is no such snapshot.
+    """
+    manifest = load(root, snapshot_id)
+    if manifest is None:
+        return None
+    current = scan(root)
+    paths = sorted(set(current) | set(manifest["files"]))
+    if only:
+        paths = [rel for rel in paths if rel == only or rel.startswith(only.rstrip("/") + "/")]
+    chunks = []
+    for rel in paths:
+        old, new = manifest["files"].get(rel), current.get(rel)
+        if old == new:
+            continue
+        before = _text(_object(root, old)) if old else []
+        after = _text(os.path.join(root, *rel.split("/"))) if new else []
+        if before is None or after is None:
+            chunks.append(f"Binary file {rel} differs\n")
+            continue
+        lines = difflib.unified_diff(
+            before, after, f"a/{rel}" if old else "/dev/null", f"b/{rel}" if new else "/dev/null"
+        )
+        chunks.append("".join(line if line.endswith("\n") else line + "\n" for line in lines))
+    return manifest, "".join(chunks)
@@ -0,0 +1,233 @@
+"""
+Speculative coder turns: K candidate fixes written side by side, and the first one that passes is kept.
+
+When the same tests have failed for after_failures test runs in a row (see routing.failing_streak), the
+Scheduler hands the coder's turn to a Speculator instead of running the coder once. The Speculator forks
+the workdir K times and runs the coder in every fork concurrently, each on its own copy of the session
+and with a note asking for a different approach, so the model calls differ (and miss the response
+cache). A candidate that finishes runs the failing tests in its fork. The first one to pass wins: the
+other candidates are cancelled, the files it changed are written to the workdir through its FileCache
+(so they are journaled), and its events are added to the session as the coder's turn. When no candidate
+passes, the workdir is left as it was and the coder is told so.
+
+A fork is cheap: every file is hardlinked rather than copied, except the config files (which uv rewrites
+in place), and .venv is a symlink to the workdir's environment. Of the .teddy state only the test map,
+the dependency check, the test durations and the run history are copied (CARRIED_STATE). Test runs in a
+fork use the workdir's warm test worker (see Workspace.worker_dir). The file tools replace files instead of
+writing into them (see FileCache.write), so a candidate never changes the workdir through a shared link.
+Code under test that rewrites its own files in place would; the same goes for a candidate installing
+packages, which lands in the shared environment.
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+from typing import AsyncGenerator
+
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event
+from google.genai import types
+
+import deps
+import report
+import shards
+import tools
+from routing import failing_streak
+from selection import MAP_FILE, REWRITTEN_IN_PLACE, walk
+from state import state_path
+from workspace import Workspace, bind, current
+
+
+FORK_DIR = "forks"
+# .teddy state copied into a fork, so a candidate's run_pytest selects tests and checks imports from where the
+# workdir left off instead of from scratch
+CARRIED_STATE = (MAP_FILE, deps.DEPS_FILE, shards.DURATIONS_FILE, report.HISTORY_FILE)
+APPROACH = (
+    "You are candidate {number} of {count} working on this in parallel, each in its own copy of the workdir. "
+    "Failing: {target}. {approach} Fix the code so that the tests pass, then stop."
+)
+APPROACHES = (
+    "Make the most direct fix.",
+    "Take a different approach than the previous attempts: re-read the failing tests and the code they call first.",
+    "Assume the previous attempts misread the problem: rewrite the failing unit from scratch if that is simpler.",
+)
+
+
+def fork(root: str, dest: str) -> Workspace:
+    """
+    Returns a workspace at dest holding the files of the workdir at root, hardlinked where possible.
+    """
+    shutil.rmtree(dest, ignore_errors=True)
+    os.makedirs(dest)
+    for path in walk(root):
+        target = os.path.join(dest, os.path.relpath(path, root))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.basename(path) in REWRITTEN_IN_PLACE or os.path.islink(path):
+            shutil.copy2(path, target, follow_symlinks=False)
+            continue
+        try:
+            os.link(path, target)
+        except OSError:
+            shutil.copy2(path, target)
+    if os.path.isdir(os.path.join(root, ".venv")):
+        os.symlink(os.path.join(root, ".venv"), os.path.join(dest, ".venv"))
+    for name in CARRIED_STATE:
+        if os.path.isfile(state_path(root, name)):
+            os.makedirs(os.path.dirname(state_path(dest, name)), exist_ok=True)
+            shutil.copy2(state_path(root, name), state_path(dest, name))
+    workspace = Workspace(dest, current().limits)
+    workspace.origin = os.path.realpath(root)
+    return workspace
+
+
+def _files(root: str) -> dict:
+    return {os.path.relpath(path, root): path for path in walk(root)}
+
+
+def _same(a: str, b: str) -> bool:
+    if os.path.samefile(a, b):
+        return True
+    with open(a, "rb") as first, open(b, "rb") as second:
+        return first.read() == second.read()
+
+
+def _apply(candidate: Workspace, main: Workspace) -> list:
+    """
+    Makes the workdir of main match the fork candidate, through main's FileCache. Returns the changed paths.
+    """
+    ours, theirs = _files(main.root), _files(candidate.root)
+    changed = []
+    for rel, path in theirs.items():
+        target = os.path.join(main.root, rel)
+        if rel in ours and _same(path, target):
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            with open(path, encoding="utf-8") as f:
+                main.files.write(target, f.read())
+        except UnicodeDecodeError:
+            shutil.copy2(path, target)
+        changed.append(rel)
+    for rel in set(ours) - set(theirs):
+        os.remove(ours[rel])
+        main.files.record("deleted", ours[rel])
+        changed.append(rel)
+    return sorted(changed)
+
+
+class Candidate:
+    def __init__(self, number: int, workspace: Workspace):
+        self.number = number
+        self.workspace = workspace
+        self.events = []
+        self.passed = False
+
+
+class Speculator:
+    """
+    Runs K candidates of an agent's turn, see the module docstring. The Scheduler uses it for the coder
+    once the same tests failed after_failures times in a row.
+    """
+
+    def __init__(self, candidates: int = 3, after_failures: int = 2):
+        self.candidates = candidates
+        self.after_failures = after_failures
+
+    def wanted(self, root: str) -> bool:
+        return self.candidates > 1 and failing_streak(report.history(root)) >= self.after_failures
+
+    async def _candidate(self, ctx: InvocationContext, agent, candidate: Candidate, tests: list) -> Candidate:
+        session = ctx.session.model_copy(deep=True)
+        note = APPROACH.format(
+            number=candidate.number,
+            count=self.candidates,
+            target=", ".join(tests) or "the test suite",
+            approach=APPROACHES[(candidate.number - 1) % len(APPROACHES)],
+        )
+        session.events.append(
+            Event(
+                invocation_id=ctx.invocation_id,
+                author="user",
+                content=types.Content(role="user", parts=[types.Part(text=note)]),
+            )
+        )
+        branch = f"candidate_{candidate.number}"
+        candidate_ctx = ctx.model_copy(
+            update={
+                "session": session,
+                "branch": f"{ctx.branch}.{branch}" if ctx.branch else branch,
+                # keeps the telemetry spans of concurrent turns of the same agent apart
+                "invocation_id": f"{ctx.invocation_id}-{branch}",
+            }
+        )
+        with bind(candidate.workspace):
+            async for event in agent.run_async(candidate_ctx):
+                # what the runner does for the real session, so the agent sees its own tool results
+                if not event.partial:
+                    session.events.append(event)
+                    session.state.update(event.actions.state_delta or {})
+                    candidate.events.append(event)
+            fork_ws = candidate.workspace
+            returncode, _, _ = await tools._run("pytest", tests, fork_ws.cwd, fork_ws.limits, fork_ws.worker_dir())
+        candidate.passed = returncode == 0
+        outcome = "pass" if candidate.passed else "still fail"
+        logging.info(f"[{agent.name}] Candidate {candidate.number}: the failing tests {outcome}")
+        return candidate
+
+    def _event(self, ctx: InvocationContext, text: str) -> Event:
+        # the outcome is the scheduler's to report; as the coder's, a text-only turn would read as the coder
+        # talking instead of coding (see aligner.py)
+        return Event(
+            invocation_id=ctx.invocation_id,
+            author=ctx.agent.name,
+            branch=ctx.branch,
+            content=types.Content(role="model", parts=[types.Part(text=text)]),
+        )
+
+    async def run(self, ctx: InvocationContext, agent) -> AsyncGenerator[Event, None]:
+        """
+        Runs the candidates of agent's turn and yields the events of the winner, or a note that none won.
+        """
+        main = current()
+        tests = report.history(main.root)[-1]["failing"]
+        # a run that failed without naming a test is retried whole
+        target = ", ".join(tests) or "the test suite"
+        logging.info(f"[{agent.name}] Speculating with {self.candidates} candidates on {target}")
+        candidates = []
+        try:
+            for number in range(1, self.candidates + 1):
+                workspace = fork(main.root, state_path(main.root, os.path.join(FORK_DIR, f"candidate-{number}")))
+                workspace.files.iteration = main.files.iteration
+                candidates.append(Candidate(number, workspace))
+            pending = [asyncio.create_task(self._candidate(ctx, agent, c, tests)) for c in candidates]
+            winner = None
+            try:
+                for next_done in asyncio.as_completed(pending):
+                    try:
+                        candidate = await next_done
+                    except Exception as e:
+                        logging.warning(f"[{agent.name}] A candidate failed: {e}")
+                        continue
+                    if candidate.passed:
+                        winner = candidate
+                        break
+            finally:
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+            if winner is None:
+                text = f"None of the {self.candidates} candidate fixes made {target} pass; nothing was changed."
+                yield self._event(ctx, text)
+                return
+            changed = _apply(winner.workspace, main)
+            for event in winner.events:
+                yield event.model_copy(update={"invocation_id": ctx.invocation_id, "branch": ctx.branch})
+            text = (
+                f"Kept candidate {winner.number} of {self.candidates}, the first to make {target} pass. "
+                f"Changed: {', '.join(changed) or 'nothing'}."
+            )
+            yield self._event(ctx, text)
+        finally:
+            for candidate in candidates:
+                shutil.rmtree(candidate.workspace.root, ignore_errors=True)
@@ -0,0 +1,36 @@
+"""
+Small JSON state files kept by the tools inside the workdir, under .teddy/.
+"""
+
+import json
+import os
+
+
+STATE_DIR = ".teddy"
+
+
+def state_path(root: str, name: str) -> str:
+    return os.path.join(root, STATE_DIR, name)
+
+
+def load_json(root: str, name: str, default=None):
+    """
+    Loads a state file, returning default when it is missing or unreadable.
+    """
+    try:
+        with open(state_path(root, name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def save_json(root: str, name: str, data):
+    """
+    Atomically replaces a state file with data.
+    """
+    path = state_path(root, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
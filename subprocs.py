@@ -0,0 +1,201 @@
+"""
+Non-blocking subprocesses for the tools.
+
+run_process runs a command on an asyncio subprocess, so the event loop (and every other session in it)
+keeps going while a test run or package install is in progress. Output lines are passed to on_output as
+they arrive, and a cancelled call kills the whole process group before re-raising.
+
+Generated code runs under Limits: a wall-clock timeout, after which the process group is killed and
+LimitExceeded is raised, and CPU time and address space rlimits. The defaults can be changed with the
+TEDDY_TIMEOUT, TEDDY_CPU_SECONDS and TEDDY_MEMORY_MB environment variables or per run, see Workspace.
+"""
+
+import asyncio
+import logging
+import os
+import signal
+
+try:
+    import resource
+except ImportError:  # not available on Windows; only the timeout applies there
+    resource = None
+
+
+# wheels and built environments are shared by the uv runs of all workdirs
+UV_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".teddy_cache", "uv")
+DEFAULT_TIMEOUT = 120
+DEFAULT_MEMORY_MB = 2048
+DEFAULT_INSTALL_TIMEOUT = 600
+TAIL_LINES = 20
+PUMP_CHUNK = 1 << 16
+
+
+def _env(name: str, default):
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+def uv_env() -> dict:
+    """
+    The environment for uv commands: the shared cache unless UV_CACHE_DIR is already set.
+    """
+    env = dict(os.environ)
+    env.setdefault("UV_CACHE_DIR", UV_CACHE_DIR)
+    return env
+
+
+class Limits:
+    """
+    Limits for one run: timeout (wall-clock seconds), cpu_seconds, memory_mb (address space) and
+    install_timeout for package installs. None takes the environment or built-in default, 0 disables.
+    The CPU limit defaults to the timeout.
+    """
+
+    def __init__(self, timeout=None, cpu_seconds=None, memory_mb=None, install_timeout=None):
+        self.timeout = timeout if timeout is not None else _env("TEDDY_TIMEOUT", DEFAULT_TIMEOUT)
+        self.cpu_seconds = cpu_seconds if cpu_seconds is not None else _env("TEDDY_CPU_SECONDS", self.timeout)
+        self.memory_mb = memory_mb if memory_mb is not None else _env("TEDDY_MEMORY_MB", DEFAULT_MEMORY_MB)
+        self.install_timeout = install_timeout if install_timeout is not None else DEFAULT_INSTALL_TIMEOUT
+
+    def rlimits(self) -> dict:
+        """
+        The rlimits for a job process, as sent to the test worker.
+        """
+        return {"cpu_seconds": self.cpu_seconds or 0, "memory_mb": self.memory_mb or 0}
+
+    def __repr__(self):
+        return (
+            f"Limits(timeout={self.timeout}, cpu_seconds={self.cpu_seconds}, memory_mb={self.memory_mb}, "
+            f"install_timeout={self.install_timeout})"
+        )
+
+
+class LimitExceeded(Exception):
+    """
+    Raised when a job hits one of its limits; holds the output produced until it was stopped.
+    """
+
+    def __init__(self, message: str, stdout: str = "", stderr: str = ""):
+        super().__init__(message)
+        self.stdout = stdout
+        self.stderr = stderr
+
+    def tail(self) -> str:
+        lines = (self.stdout + self.stderr).strip().splitlines()[-TAIL_LINES:]
+        return "\n".join(lines)
+
+
+def set_rlimits(cpu_seconds: float, memory_mb: float):
+    """
+    Applies CPU and address space limits to the calling process; used in the job process itself.
+    """
+    if resource is None:
+        return
+    if cpu_seconds:
+        # SIGXCPU at the soft limit, SIGKILL a second later if it is ignored
+        resource.setrlimit(resource.RLIMIT_CPU, (int(cpu_seconds), int(cpu_seconds) + 1))
+    if memory_mb:
+        resource.setrlimit(resource.RLIMIT_AS, (int(memory_mb * 1024 * 1024),) * 2)
+
+
+def check_limits(limits: Limits, returncode: int, stdout: str, stderr: str, memory_errors: bool = True):
+    """
+    Raises LimitExceeded if a finished job was stopped by its CPU or memory limit. A MemoryError only
+    counts when memory_errors is set, since pytest reports one inside a test as an ordinary failure. The
+    memory limit caps the address space, so it surfaces as a MemoryError rather than a signal; any other
+    signal or exit code is left for the caller to report as it is (see describe_exit).
+    """
+    message = None
+    if returncode in (-signal.SIGXCPU, 128 + signal.SIGXCPU):
+        message = f"was killed after exceeding the CPU time limit of {limits.cpu_seconds:g} s"
+    elif memory_errors and limits.memory_mb and returncode and "MemoryError" in stderr[-2000:]:
+        message = f"ran out of memory at the {limits.memory_mb:g} MB limit"
+    if message:
+        raise LimitExceeded(message, stdout, stderr)
+
+
+def describe_exit(returncode: int) -> str:
+    """
+    Describes how a process ended, e.g. "exited with code 3" or "was killed by SIGSEGV".
+    """
+    if returncode < 0:
+        try:
+            return f"was killed by {signal.Signals(-returncode).name}"
+        except ValueError:
+            return f"was killed by signal {-returncode}"
+    return f"exited with code {returncode}"
+
+
+def log_output(label: str):
+    """
+    Returns an on_output callback that writes each line to the log, prefixed with label.
+    """
+
+    def on_output(stream: str, line: str):
+        logging.info(f"[{label}] {stream}: {line}")
+
+    return on_output
+
+
+async def _pump(stream, name: str, lines: list, on_output):
+    # read in chunks rather than with readline, which fails on lines longer than the stream's buffer limit
+    def emit(line: bytes):
+        text = line.decode(errors="replace")
+        lines.append(text)
+        if on_output:
+            on_output(name, text.rstrip("\n"))
+
+    partial = []
+    while True:
+        chunk = await stream.read(PUMP_CHUNK)
+        if not chunk:
+            break
+        *complete, rest = chunk.split(b"\n")
+        for piece in complete:
+            emit(b"".join(partial) + piece + b"\n")
+            partial = []
+        if rest:
+            partial.append(rest)
+    if partial:
+        emit(b"".join(partial))
+
+
+def kill_group(pid: int):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+async def run_process(command: list, cwd: str, on_output=None, timeout=None, rlimits=None, env=None) -> tuple:
+    """
+    Runs command in cwd and returns (returncode, stdout, stderr). After timeout seconds the process group
+    is killed and LimitExceeded is raised; rlimits ({"cpu_seconds", "memory_mb"}) apply to the process.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        cwd=cwd,
+        env=env,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True,
+        preexec_fn=(lambda: set_rlimits(**rlimits)) if rlimits else None,
+    )
+    stdout, stderr = [], []
+    pumps = asyncio.gather(
+        _pump(process.stdout, "stdout", stdout, on_output),
+        _pump(process.stderr, "stderr", stderr, on_output),
+        process.wait(),
+    )
+    try:
+        returncode = (await asyncio.wait_for(pumps, timeout or None))[-1]
+    except asyncio.TimeoutError:
+        kill_group(process.pid)
+        await process.wait()
+        raise LimitExceeded(f"timed out after {timeout:g} s", "".join(stdout), "".join(stderr))
+    except asyncio.CancelledError:
+        kill_group(process.pid)
+        await process.wait()
+        raise
+    return returncode, "".join(stdout), "".join(stderr)
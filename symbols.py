@@ -0,0 +1,173 @@
+"""
+An AST symbol index of the python files in a workspace, for the find_symbol and grep tools.
+
+Every module, class, function, method, test function and import is recorded with its file, line and
+signature. Test functions also keep the names they use, so find_symbol can say which tests refer to a
+symbol. The index is refreshed before each lookup, re-parsing only the files whose mtime or size changed
+(writes by the tools, and by the code being run, alike), so a lookup costs a walk of the workdir plus
+whatever was edited since the previous one.
+"""
+
+import ast
+import os
+import re
+
+from filecache import MAX_CACHED_BYTES, is_binary
+from selection import is_test_file, walk
+
+
+# find_symbol and grep list at most this many matches
+MAX_MATCHES = 50
+
+
+class Symbol:
+    """
+    A definition or import: kind is "module", "class", "function", "method", "test" or "import".
+    """
+
+    def __init__(self, kind: str, name: str, qualname: str, path: str, line: int, signature: str, refs=()):
+        self.kind = kind
+        self.name = name
+        self.qualname = qualname
+        self.path = path
+        self.line = line
+        self.signature = signature
+        self.refs = set(refs)
+
+    @property
+    def location(self) -> str:
+        return f"{self.path}:{self.line}"
+
+    def __str__(self):
+        return f"{self.location} {self.signature}" + (" [test]" if self.kind == "test" else "")
+
+
+def _signature(node, qualname: str) -> str:
+    if isinstance(node, ast.ClassDef):
+        bases = ", ".join(ast.unparse(base) for base in node.bases)
+        return f"class {qualname}({bases})" if bases else f"class {qualname}"
+    prefix = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+    returns = f" -> {ast.unparse(node.returns)}" if node.returns else ""
+    return f"{prefix} {qualname}({ast.unparse(node.args)}){returns}"
+
+
+def _refs(node) -> set:
+    names = set()
+    for child in ast.walk(node):
+        if isinstance(child, ast.Name):
+            names.add(child.id)
+        elif isinstance(child, ast.Attribute):
+            names.add(child.attr)
+    return names
+
+
+def parse(source: str, path: str) -> list:
+    """
+    Returns the symbols of one python file; path is the file's path relative to the workspace root.
+    """
+    tree = ast.parse(source)
+    module = os.path.splitext(path)[0].replace(os.sep, ".")
+    symbols = [Symbol("module", module.rsplit(".", 1)[-1], module, path, 1, f"module {module}")]
+    test_file = is_test_file(os.path.basename(path))
+
+    def visit(body, scope, in_class):
+        for node in body:
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                for alias in node.names:
+                    name = alias.asname or alias.name.split(".")[0]
+                    symbols.append(Symbol("import", name, name, path, node.lineno, ast.unparse(node)))
+            elif isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+                qualname = f"{scope}.{node.name}" if scope else node.name
+                if isinstance(node, ast.ClassDef):
+                    kind = "class"
+                elif test_file and node.name.startswith("test"):
+                    kind = "test"
+                else:
+                    kind = "method" if in_class else "function"
+                refs = _refs(node) if kind == "test" else ()
+                symbols.append(Symbol(kind, node.name, qualname, path, node.lineno, _signature(node, qualname), refs))
+                visit(node.body, qualname, isinstance(node, ast.ClassDef))
+
+    visit(tree.body, "", False)
+    return symbols
+
+
+class SymbolIndex:
+    """
+    The symbols of the python files under root, re-parsed per file when it changes. files is the
+    workspace's FileCache, which the sources are read through.
+    """
+
+    def __init__(self, root: str, files):
+        self.root = root
+        self.files = files
+        self._parsed = {}  # path -> (mtime_ns, size, [Symbol])
+
+    def refresh(self) -> list:
+        """
+        Brings the index up to date and returns all symbols.
+        """
+        seen = set()
+        for path in walk(self.root):
+            if not path.endswith(".py"):
+                continue
+            seen.add(path)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            cached = self._parsed.get(path)
+            if cached and cached[:2] == (st.st_mtime_ns, st.st_size):
+                continue
+            try:
+                symbols = parse(self.files.read(path), os.path.relpath(path, self.root))
+            except (OSError, SyntaxError, ValueError, UnicodeDecodeError):
+                # files that do not parse (yet) are simply left out
+                symbols = []
+            self._parsed[path] = (st.st_mtime_ns, st.st_size, symbols)
+        for path in set(self._parsed) - seen:
+            del self._parsed[path]
+        return [symbol for entry in self._parsed.values() for symbol in entry[2]]
+
+    def find(self, name: str) -> list:
+        """
+        Returns the definitions and imports matching name: exact (also as the end of a dotted name such as
+        Class.method) if there are any, else those containing it, case-insensitively.
+        """
+        symbols = self.refresh()
+        exact = [s for s in symbols if s.name == name or s.qualname == name or s.qualname.endswith("." + name)]
+        if exact:
+            return exact
+        lower = name.lower()
+        return [symbol for symbol in symbols if lower in symbol.qualname.lower()]
+
+    def tests_using(self, name: str) -> list:
+        """
+        Returns the test functions that refer to name.
+        """
+        short = name.rsplit(".", 1)[-1]
+        return [symbol for symbol in self.refresh() if symbol.kind == "test" and short in symbol.refs]
+
+
+def grep(root: str, files, pattern: str, top: str) -> list:
+    """
+    Returns [(path relative to root, line number, line)] for the lines of the text files under top that
+    match the regular expression pattern, or contain it literally if it is not a valid one.
+    """
+    try:
+        regex = re.compile(pattern)
+    except re.error:
+        regex = re.compile(re.escape(pattern))
+    matches = []
+    paths = [top] if os.path.isfile(top) else walk(top)
+    for path in paths:
+        try:
+            if os.path.getsize(path) > MAX_CACHED_BYTES or is_binary(path):
+                continue
+            text = files.read(path)
+        except (OSError, UnicodeDecodeError):
+            continue
+        for number, line in enumerate(text.splitlines(), 1):
+            if regex.search(line):
+                matches.append((os.path.relpath(path, root), number, line.strip()))
+    return matches
@@ -1,15 +1,29 @@
-from google.adk.agents import Agent, LoopAgent
-from google.adk.models.lite_llm import LiteLlm
+from google.adk.agents import Agent
+import argparse
 import asyncio
 import logging
 import os
 
 # Local imports
+from aligner import LocalAligner
+from compaction import Compactor
+from convergence import ConvergenceController
 from encrypt_api import get_api_key
+from llm_cache import CachingLiteLLMClient
+from routing import Router
+from scheduler import Scheduler
+from sessions import SqliteSessionService
+from speculate import Speculator
+from state import STATE_DIR
+from subprocs import Limits
+import telemetry
 from utils import call_agent_async
+from workspace import Workspace
 from tools import (
     read_file,
     write_file,
+    apply_patch,
+    replace_lines,
     cd,
     ls,
     mv,
@@ -18,7 +32,13 @@ from tools import (
     touch,
     run_python_file,
     run_pytest,
+    pytest_report,
     pip_install,
+    changed_files,
+    rollback,
+    diff_snapshot,
+    find_symbol,
+    grep,
 )
 
 
@@ -33,35 +53,65 @@ unix_tools = [
     touch,
     read_file,
     write_file,
+    apply_patch,
+    replace_lines,
     pip_install,
     run_python_file,
     run_pytest,
+    pytest_report,
+    changed_files,
+    rollback,
+    diff_snapshot,
+    find_symbol,
+    grep,
 ]
 
 
+# record (default), replay or passthrough, see llm_cache.py
+LLM_CLIENT = CachingLiteLLMClient(os.environ.get("TEDDY_LLM_CACHE", "record"))
+# every agent starts on the cheapest model; the coder and tester move up a tier per two failed test runs on
+# the same tests, see routing.py
+ROUTER = Router(agents={"coder": (0, 2), "tester": (0, 1)}, escalate_after=2, llm_client=LLM_CLIENT)
+# once the same tests failed twice in a row, the coder writes three candidate fixes in forks of the workdir
+# at once and the first that makes them pass is kept, see speculate.py
+SPECULATOR = Speculator(candidates=3, after_failures=2)
+# older tool calls and results are digested, and history beyond the budget is dropped, see compaction.py
+COMPACTOR = Compactor(budget_tokens=16000, keep_recent=12)
+# spans for agent turns, model calls and tool calls in .teddy/telemetry.jsonl, see telemetry.py
+TELEMETRY = telemetry.Telemetry()
+
 APP_NAME = "teddy"
 USER_ID = "dan"
 SESSION_ID = "1"
+SESSION_DB = "sessions.db"
 
-os.environ["OPENAI_API_KEY"] = get_api_key(0)
-if not os.path.exists("workdir"):
-    os.mkdir("workdir")
-os.chdir('workdir')
 
-logging.getLogger("LiteLLM").setLevel(logging.WARNING)
-logging.basicConfig(
-    filename="teddy.log",
-    level=logging.INFO,
-)
+def setup(workdir="workdir", log_file="teddy.log"):
+    """
+    Reads the API key, enters the workdir and starts logging to log_file inside it.
+    """
+    os.environ["OPENAI_API_KEY"] = get_api_key(0)
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
 
+    logging.getLogger("LiteLLM").setLevel(logging.WARNING)
+    logging.basicConfig(
+        filename=log_file,
+        level=logging.INFO,
+        force=True,
+    )
+    logging.info("Starting Teddy...")
 
-logging.info("Starting Teddy...")
+    # this ini avoids import errors in pytest by adding the current directory to the python path
+    with open("pytest.ini", "w") as f:
+        f.write("[pytest]\npythonpath = .\n")
 
 
 # Agents
 
 _planner = Agent(
-    model=LiteLlm(model="openai/gpt-4.1-nano"),
+    model=ROUTER.llm("planner"),
+    before_model_callback=COMPACTOR,
     name="planner",
     description="You are a planner agent responsible for planning the big picture and tracking "
     "the little picture of the test-driven development process, setting each next step's goal. "
@@ -79,7 +129,8 @@ _planner = Agent(
     "plan. Where are we, and what's the concrete next step in this interative test-driven development process? \n"
     "Occasionally, the system gets stuck, and the agents keep passing the baton, telling you"
     " to proceed, without making progress. BREAK THESE LOOPS by issuing a new task.\n "
-    "Lastly, only when the user's task is completely fulfilled, RUN PYTEST one more time, and"
+    "To see what the other agents changed, call changed_files instead of listing and reading everything.\n "
+    "Lastly, only when the user's task is completely fulfilled, RUN PYTEST one more time with full=True, and"
     " if it passes, issue the termination token 'TASK_COMPLETE'. Don't go on forever. Stick only to the requirements.",
     disallow_transfer_to_peers=True,
     disallow_transfer_to_parent=True,
@@ -87,7 +138,8 @@ _planner = Agent(
 )
 
 _specifier = Agent(
-    model=LiteLlm(model="openai/gpt-4.1-nano"),
+    model=ROUTER.llm("specifier"),
+    before_model_callback=COMPACTOR,
     name="specifier",
     description="You are a specifier agent responsible for specifying how the current unit of"
     " planned code needs to be implemented, so that the coder has unambiguous instructions. "
@@ -106,7 +158,8 @@ _specifier = Agent(
 )
 
 _coder = Agent(
-    model=LiteLlm(model="openai/gpt-4.1-nano"),
+    model=ROUTER.llm("coder"),
+    before_model_callback=COMPACTOR,
     name="coder",
     description="You are a coder agent responsible for programming the specification "
     "provided by the specifier. You only write one unit of code at a time by "
@@ -116,14 +169,18 @@ _coder = Agent(
     "You are part of a larger cycle of agents [planner, specifier, coder, tester, reviewer]. "
     "If there is a pending request for code to be written, it is your job to write it in a "
     "file using the write_file function. No raw code, always use write_file to write code "
-    "to the disk. To edit a file, read it using read_file, then write the modified content with write_file. ",
+    "to the disk. To change an existing file, do not rewrite it: send only the change with apply_patch "
+    "(SEARCH/REPLACE blocks or a unified diff) or replace_lines, after reading the lines it touches. "
+    "If your changes broke tests that passed before, see them with diff_snapshot and undo them with rollback "
+    "rather than editing everything back by hand. ",
     tools=unix_tools,
     disallow_transfer_to_peers=True,
     disallow_transfer_to_parent=True,
 )
 
 _tester = Agent(
-    model=LiteLlm(model="openai/gpt-4.1-nano"),
+    model=ROUTER.llm("tester"),
+    before_model_callback=COMPACTOR,
     name="tester",
     description="You are a tester agent responsible for both designing and running unit tests for the last unit of "
     "code written.You are part of a larger cycle of agents [planner, specifier, coder, tester, reviewer]. "
@@ -140,7 +197,8 @@ _tester = Agent(
 )
 
 _reviewer = Agent(
-    model=LiteLlm(model="openai/gpt-4.1-nano"),
+    model=ROUTER.llm("reviewer"),
+    before_model_callback=COMPACTOR,
     name="reviewer",
     description="You are a reviewer agent responsible for verifying that the tests did indeed pass and the code "
     "does indeed look good. Provide feedback. Focus on ensuring that the code is modular, testable, and adheres "
@@ -154,105 +212,96 @@ _reviewer = Agent(
     "when it is ready to be committed to the codebase. Summarize how each step of the test-driven "
     "development process was successful. Focus on ensuring that the code is modular, testable, and "
     "adheres to best practices. Do not write or execute code yourself. You need to report what unit of "
-    "code is being written, which unit tests cover it, and that all unit tests pass.",
+    "code is being written, which unit tests cover it, and that all unit tests pass. Use find_symbol and grep "
+    "to locate code and the tests that use it instead of reading whole files.",
     tools=unix_tools,
     disallow_transfer_to_peers=True,
     disallow_transfer_to_parent=True,
 )
 
-# _aligner = Agent(
-#     model=LiteLlm(model="openai/gpt-4.1-nano"),
-#     name="aligner",
-#     description="You are an aligner agent responsible for breaking the loop of agents that "
-#     "are stuck in a cycle. You are part of a larger cycle of agents [planner, specifier, coder, tester, reviewer]. "
-#     "Your job is to identify when the agents are stuck and issue a new task to break the loop.",
-#     instruction="Be brief. You are an aligner agent responsible for breaking the loop of agents "
-#     "that are stuck in a cycle. Your job is to identify when the agents are stuck and let everyone know really "
-#     "loudly. If you detect that the agents are not making progress, passing the batton, saying they will "
-#     "do thing but not, then say in all caps, 'GUYS, YOU ARE STUCK IN A LOOP. PLANNER, ISSUE A NEW TASK TO A SPECIFIC AGENT.' "
-#     "Do not write or execute code yourself; focus solely on breaking the loop. If there is no loop, "
-#     "say `Continue` and nothing else. Don't let the agents ask eachother to run specific files or "
-#     "commands repeatedly, that's a loop. If they say 'please let me know' a lot, then that's a loop. "
-#     "If the coder is speaking but not coding, say 'Coder, stop talking and code.'\n"
-#     "If there's a lot of talking and not a lot of tool use, say 'Guys, you are stuck in a loop. Planner, issue a new task to a specific agent.'\n"
-#     "If any of the agents expect the user to do something or run something, say 'Guys, the user is not available to do anything. You have the tools to do it yourself.'\n"
-#     "If any of the agents are saying 'I will do this' or 'Once this happens, I'll...' but not actually doing it, say 'Guys, stop passing it off and actually do the thing.'\n"
-#     "If the agents are asking any question at all, say 'Guys, stop asking questions and just do the thing.'\n",
-#     disallow_transfer_to_peers=True,
-#     disallow_transfer_to_parent=True,
-# )
-
-
-_aligner = Agent(
-    model=LiteLlm(model="openai/gpt-4.1-nano"),
+
+# A local stuck detector instead of a model call per iteration; it only speaks when agents are stuck.
+_aligner = LocalAligner(
     name="aligner",
-    description="Your job is get the system unstuck by telling agent's what they are stuck on and break them out of it.",
-    instruction="""If agents are not making progress (e.g., passing tasks without action or repeating themselves),
-                    then say:
-                    "GUYS, YOU ARE STUCK IN A LOOP. PLANNER, ISSUE A NEW TASK TO A SPECIFIC AGENT."
-
-                    If agents repeatedly ask each other to run specific files or commands,
-                    then say:
-                    "GUYS, YOU ARE STUCK IN A LOOP. PLANNER, ISSUE A NEW TASK TO A SPECIFIC AGENT."
-
-                    If agents frequently say "please let me know,"
-                    then say:
-                    "GUYS, YOU ARE STUCK IN A LOOP. PLANNER, ISSUE A NEW TASK TO A SPECIFIC AGENT."
-
-                    If the coder is talking but not coding,
-                    then say:
-                    "Coder, stop talking and code."
-
-                    If there is excessive talking and not enough tool usage,
-                    then say:
-                    "GUYS, YOU ARE STUCK IN A LOOP. PLANNER, ISSUE A NEW TASK TO A SPECIFIC AGENT."
-
-                    If agents expect the user to perform an action or run something,
-                    then say:
-                    "Guys, the user is not available to do anything. You have the tools to do it yourself."
-
-                    If agents say "I will do this" or "Once this happens, I'll..." but don’t act,
-                    then say:
-                    "Guys, stop passing it off and actually do the thing."
-
-                    If agents are asking any question at all,
-                    then say:
-                    "Guys, stop asking questions and just do the thing."
-
-                    If no loop is detected,
-                    then say:
-                    Continue and nothing else.""",
-    disallow_transfer_to_peers=True,
-    disallow_transfer_to_parent=True,
+    description="Gets the system unstuck by telling the agents what they are stuck on and how to break out of it.",
+)
+
+
+# Ends the run as soon as the whole suite passes on the current code, or when the tests stop improving.
+_convergence = ConvergenceController(
+    name="convergence",
+    description="Ends the run when the whole test suite passes, or when the tests stop improving.",
+    patience=5,
 )
 
 
-system = LoopAgent(
+# Picks the next agent from the test state instead of cycling through all of them, see scheduler.py.
+system = Scheduler(
     name="system",
-    description="Loops Teddy 20 times, and then stops.",
+    description="Runs Teddy for up to 20 rounds of the agents that have something to do, and then stops.",
     max_iterations=20,
-    sub_agents=[_planner, _specifier, _coder, _tester, _reviewer, _aligner],
+    max_turns=60,
+    monitors=["convergence", "aligner"],
+    speculator=SPECULATOR,
+    sub_agents=[_planner, _specifier, _coder, _tester, _reviewer, _convergence, _aligner],
 )
+TELEMETRY.instrument(system)
 
 
-async def task():
-
-    task = "Write a program that fetches accepts a stock ticker and returns a formatted text "
+TASK = (
+    "Write a program that fetches accepts a stock ticker and returns a formatted text "
     "report of important metrics for investing in the stock, including volatility, volume, price, "
     "moving averages, rsi, short float, etc. It doesn't need a gui. Just a python program is fine."
+    " Make your code very modular, and pytest testable. Code should never contain input statements, and should always run without any user input. "
+)
+
 
-    task += " Make your code very modular, and pytest testable. Code should never contain input statements, and should always run without any user input. "
-    await call_agent_async(task, system, APP_NAME, USER_ID, SESSION_ID)
+async def task(query=TASK, resume=False, session_id=SESSION_ID, workspace=None):
+    """
+    Runs the system on query in workspace (by default the current directory) and returns the result of
+    call_agent_async, with the number of loop iterations it took and the tokens and cost it used.
+    """
+    root = workspace.root if workspace else "."
+    if not resume:
+        telemetry.reset(root)
+    session_service = SqliteSessionService(os.path.join(root, STATE_DIR, SESSION_DB))
+    try:
+        result = await call_agent_async(
+            query,
+            system,
+            APP_NAME,
+            USER_ID,
+            session_id,
+            session_service,
+            resume=resume,
+            workspace=workspace,
+            accept_complete=lambda bound: _convergence.check(bound.root),
+        )
+        session = session_service.get_session(app_name=APP_NAME, user_id=USER_ID, session_id=session_id)
+        result["iterations"] = session.state.get(system.iterations_key, 0) if session else 0
+        summary = telemetry.summarize(root)
+        logging.info(f"Telemetry:\n{telemetry.render(summary)}")
+        result["tokens"] = summary["totals"]["prompt_tokens"] + summary["totals"]["completion_tokens"]
+        result["cost"] = round(summary["totals"]["cost"], 4)
+        return result
+    finally:
+        session_service.close()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resume", action="store_true", help="continue the last session where it stopped")
+    parser.add_argument("--timeout", type=float, help="seconds a program or test run may take (default 120)")
+    parser.add_argument("--cpu-seconds", type=float, help="CPU seconds a program or test run may use")
+    parser.add_argument("--memory-mb", type=float, help="address space a program or test run may use (default 2048)")
+    args = parser.parse_args()
     try:
-        # setup - this ini avoids import errors in pytest by adding the current directory to the python path
-        with open("pytest.ini", "w") as f:
-            f.write("[pytest]\npythonpath = .\n")
+        setup()
+        limits = Limits(timeout=args.timeout, cpu_seconds=args.cpu_seconds, memory_mb=args.memory_mb)
 
         # run
-        asyncio.run(task())
+        asyncio.run(task(resume=args.resume, workspace=Workspace(".", limits)))
+        print(telemetry.render(telemetry.summarize(".")))
 
         # # teardown
         # os.remove("pytest.ini")
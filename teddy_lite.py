@@ -1,15 +1,29 @@
-from google.adk.agents import Agent, LoopAgent
-from google.adk.models.lite_llm import LiteLlm
+from google.adk.agents import Agent
+import argparse
 import asyncio
 import logging
 import os
 
 # Local imports
+from aligner import LocalAligner
+from compaction import Compactor
+from convergence import ConvergenceController
 from encrypt_api import get_api_key
+from llm_cache import CachingLiteLLMClient
+from routing import Router
+from scheduler import Scheduler
+from sessions import SqliteSessionService
+from speculate import Speculator
+from state import STATE_DIR
+from subprocs import Limits
+import telemetry
 from utils import call_agent_async
+from workspace import Workspace
 from tools import (
     read_file,
     write_file,
+    apply_patch,
+    replace_lines,
     cd,
     ls,
     mv,
@@ -18,7 +32,13 @@ from tools import (
     touch,
     run_python_file,
     run_pytest,
+    pytest_report,
     pip_install,
+    changed_files,
+    rollback,
+    diff_snapshot,
+    find_symbol,
+    grep,
 )
 
 
@@ -33,55 +53,91 @@ unix_tools = [
     touch,
     read_file,
     write_file,
+    apply_patch,
+    replace_lines,
     pip_install,
     run_python_file,
     run_pytest,
+    pytest_report,
+    changed_files,
+    rollback,
+    diff_snapshot,
+    find_symbol,
+    grep,
 ]
 
 
+# record (default), replay or passthrough, see llm_cache.py
+LLM_CLIENT = CachingLiteLLMClient(os.environ.get("TEDDY_LLM_CACHE", "record"))
+# every agent starts on the cheapest model; the coder and tester move up a tier per two failed test runs on
+# the same tests, see routing.py
+ROUTER = Router(agents={"coder": (0, 2), "tester": (0, 1)}, escalate_after=2, llm_client=LLM_CLIENT)
+# once the same tests failed twice in a row, the coder writes three candidate fixes in forks of the workdir
+# at once and the first that makes them pass is kept, see speculate.py
+SPECULATOR = Speculator(candidates=3, after_failures=2)
+# older tool calls and results are digested, and history beyond the budget is dropped, see compaction.py
+COMPACTOR = Compactor(budget_tokens=16000, keep_recent=12)
+# spans for agent turns, model calls and tool calls in .teddy/telemetry.jsonl, see telemetry.py
+TELEMETRY = telemetry.Telemetry()
+
 APP_NAME = "teddy"
 USER_ID = "dan"
 SESSION_ID = "1"
+SESSION_DB = "sessions_lite.db"
 
-os.environ["OPENAI_API_KEY"] = get_api_key(0)
-if not os.path.exists("workdir"):
-    os.mkdir("workdir")
-os.chdir('workdir')
 
-logging.getLogger("LiteLLM").setLevel(logging.WARNING)
-logging.basicConfig(
-    filename="teddy_lite.log",
-    level=logging.INFO,
-)
+def setup(workdir="workdir", log_file="teddy_lite.log"):
+    """
+    Reads the API key, enters the workdir and starts logging to log_file inside it.
+    """
+    os.environ["OPENAI_API_KEY"] = get_api_key(0)
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
 
+    logging.getLogger("LiteLLM").setLevel(logging.WARNING)
+    logging.basicConfig(
+        filename=log_file,
+        level=logging.INFO,
+        force=True,
+    )
+    logging.info("Starting Teddy...")
 
-logging.info("Starting Teddy...")
+    # this ini avoids import errors in pytest by adding the current directory to the python path
+    with open("pytest.ini", "w") as f:
+        f.write("[pytest]\npythonpath = .\n")
 
 
 # Agents
 
 _planner = Agent(
-    model=LiteLlm(model="openai/gpt-4.1-nano"),
+    model=ROUTER.llm("planner"),
+    before_model_callback=COMPACTOR,
     name="planner",
     description="You plan and track the test-driven development process.",
     instruction=(
         "Write a global plan and then track each next step in the test-driven development process. "
         "Give clear, actionable instructions, always leaving the work to the other agents. "
-        "The termination token is 'TASK_COMPLETE.'"
+        "Call `changed_files` to see what the other agents changed since an earlier iteration. "
+        "The termination token is 'TASK_COMPLETE.' Before issuing it, run `run_pytest` with full=True "
+        "and only finish if the whole suite passes."
     ),
     disallow_transfer_to_peers=True,
     disallow_transfer_to_parent=True,
-    tools=[cd, ls, pwd, read_file, run_pytest]
+    tools=[cd, ls, pwd, read_file, changed_files, find_symbol, grep, run_pytest, pytest_report]
 )
 
 _coder = Agent(
-    model=LiteLlm(model="openai/gpt-4.1-nano"),
+    model=ROUTER.llm("coder"),
+    before_model_callback=COMPACTOR,
     name="coder",
     description="You write one unit of code at a time by calling write_file.",
     instruction=(
         "Write one unit of code at a time. "
         "Use `write_file` to save code to disk. "
-        "If editing, read the file first with `read_file` and then save changes with `write_file`. "
+        "To edit an existing file, send only the change with `apply_patch` (SEARCH/REPLACE blocks or a "
+        "unified diff) or `replace_lines` instead of rewriting the whole file. "
+        "If your changes broke tests that passed before, call `diff_snapshot` to see them and `rollback` to undo "
+        "them instead of editing them back by hand. "
         "Stop after writing the code to allow testing."
     ),
     tools=unix_tools,
@@ -90,12 +146,14 @@ _coder = Agent(
 )
 
 _tester = Agent(
-    model=LiteLlm(model="openai/gpt-4.1-nano"),
+    model=ROUTER.llm("tester"),
+    before_model_callback=COMPACTOR,
     name="tester",
     description="You design and run tests for the coder's work.",
     instruction=(
         "Write unit tests for the coder's code and save them to a file. "
-        "Run the tests using `run_pytest` and report the results. "
+        "Run the tests using `run_pytest` with coverage=True and report the results. The task asks for complete "
+        "coverage: write tests for the untested functions, lines and branches the report lists. "
         "Focus only on testing and providing feedback; do not fix the code."
     ),
     tools=unix_tools,
@@ -104,46 +162,90 @@ _tester = Agent(
 )
 
 
-_aligner = Agent(
-    model=LiteLlm(model="openai/gpt-4.1-nano"),
+# A local stuck detector instead of a model call per iteration; it only speaks when agents are stuck.
+_aligner = LocalAligner(
     name="aligner",
     description="You break loops and get the system unstuck.",
-    instruction=(
-        "If agents are stuck (e.g., repeating tasks, asking questions, or not acting), "
-        "say: 'GUYS, YOU ARE STUCK IN A LOOP. PLANNER, ISSUE A NEW TASK TO A SPECIFIC AGENT.' "
-        "If no loop is detected, say `Continue` and nothing else."
-    ),
-    disallow_transfer_to_peers=True,
-    disallow_transfer_to_parent=True,
 )
 
 
-system = LoopAgent(
+# Ends the run as soon as the whole suite passes with full coverage on the current code, or when the tests
+# stop improving. The task asks for at least 3 tests and complete coverage.
+_convergence = ConvergenceController(
+    name="convergence",
+    description="Ends the run when the whole test suite passes, or when the tests stop improving.",
+    min_tests=3, min_coverage=100, patience=5,
+)
+
+
+# Picks the next agent from the test state instead of cycling through all of them, see scheduler.py.
+system = Scheduler(
     name="system",
-    description="Loops Teddy 20 times, and then stops.",
+    description="Runs Teddy for up to 20 rounds of the agents that have something to do, and then stops.",
     max_iterations=20,
-    sub_agents=[_planner, _coder, _tester,_aligner],
+    max_turns=60,
+    monitors=["convergence", "aligner"],
+    speculator=SPECULATOR,
+    sub_agents=[_planner, _coder, _tester, _convergence, _aligner],
 )
+TELEMETRY.instrument(system)
 
 
-async def task():
-
-    task = "Create a python program thats takes two locations (say, nyc to chicago), "
+TASK = (
+    "Create a python program thats takes two locations (say, nyc to chicago), "
     "and gives the weather along the road trip route between those locations. "
     "First, it should get the route from google maps. Then, it should collect locations at one hour intervals along the route. "
     "Then, it should get the weather for each of those locations. Finally, it should print the hour and the weather for each location. "
-    task += " Make your code very modular, and pytest testable with complete code coverage. At least 3 tests. Code should never contain input statements, no GUIs, no servers or other blocking code. It should always run without any user input. "
-    await call_agent_async(task, system, APP_NAME, USER_ID, SESSION_ID)
+    " Make your code very modular, and pytest testable with complete code coverage. At least 3 tests. Code should never contain input statements, no GUIs, no servers or other blocking code. It should always run without any user input. "
+)
+
+
+async def task(query=TASK, resume=False, session_id=SESSION_ID, workspace=None):
+    """
+    Runs the system on query in workspace (by default the current directory) and returns the result of
+    call_agent_async, with the number of loop iterations it took and the tokens and cost it used.
+    """
+    root = workspace.root if workspace else "."
+    if not resume:
+        telemetry.reset(root)
+    session_service = SqliteSessionService(os.path.join(root, STATE_DIR, SESSION_DB))
+    try:
+        result = await call_agent_async(
+            query,
+            system,
+            APP_NAME,
+            USER_ID,
+            session_id,
+            session_service,
+            resume=resume,
+            workspace=workspace,
+            accept_complete=lambda bound: _convergence.check(bound.root),
+        )
+        session = session_service.get_session(app_name=APP_NAME, user_id=USER_ID, session_id=session_id)
+        result["iterations"] = session.state.get(system.iterations_key, 0) if session else 0
+        summary = telemetry.summarize(root)
+        logging.info(f"Telemetry:\n{telemetry.render(summary)}")
+        result["tokens"] = summary["totals"]["prompt_tokens"] + summary["totals"]["completion_tokens"]
+        result["cost"] = round(summary["totals"]["cost"], 4)
+        return result
+    finally:
+        session_service.close()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resume", action="store_true", help="continue the last session where it stopped")
+    parser.add_argument("--timeout", type=float, help="seconds a program or test run may take (default 120)")
+    parser.add_argument("--cpu-seconds", type=float, help="CPU seconds a program or test run may use")
+    parser.add_argument("--memory-mb", type=float, help="address space a program or test run may use (default 2048)")
+    args = parser.parse_args()
     try:
-        # setup - this ini avoids import errors in pytest by adding the current directory to the python path
-        with open("pytest.ini", "w") as f:
-            f.write("[pytest]\npythonpath = .\n")
+        setup()
+        limits = Limits(timeout=args.timeout, cpu_seconds=args.cpu_seconds, memory_mb=args.memory_mb)
 
         # run
-        asyncio.run(task())
+        asyncio.run(task(resume=args.resume, workspace=Workspace(".", limits)))
+        print(telemetry.render(telemetry.summarize(".")))
 
         # # teardown
         # os.remove("pytest.ini")
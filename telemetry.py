@@ -0,0 +1,235 @@
+"""
+Structured telemetry: spans for agent turns, model calls and tool calls, written as JSONL.
+
+Telemetry.instrument(agent) installs ADK callbacks on an agent tree that time every agent turn, model call
+and tool call. CachingLiteLLMClient reports the LiteLLM usage (prompt and completion tokens, cost) of
+each completion with record_usage(), which lands on the model call span that is open in the same task.
+Each finished span is appended as one JSON line to .teddy/telemetry.jsonl in the workspace:
+
+    {"kind": "model", "name": "openai/gpt-4.1-nano", "agent": "coder", "iteration": 3, "start": ...,
+     "duration": 1.82, "prompt_tokens": 5120, "completion_tokens": 310, "cost": 0.0006, "cached": false}
+
+summarize() totals the spans by agent, by tool and by iteration, and render() prints that as tables.
+
+With profile=True (or TEDDY_PROFILE=1) every tool call also runs under cProfile, and the stats are saved to
+.teddy/profiles/<tool>-<n>.prof for pstats or snakeviz.
+"""
+
+import contextvars
+import cProfile
+import json
+import logging
+import os
+import time
+
+import litellm
+
+from state import state_path
+from workspace import current
+
+
+TELEMETRY_FILE = "telemetry.jsonl"
+PROFILE_DIR = "profiles"
+
+# the model call span open in the running task, for record_usage
+_model_span = contextvars.ContextVar("model_span", default=None)
+
+
+def record_usage(response, cached: bool):
+    """
+    Adds the usage of a LiteLLM response to the open model call span, if any.
+    """
+    span = _model_span.get()
+    if span is None:
+        return
+    usage = getattr(response, "usage", None)
+    span["prompt_tokens"] = span.get("prompt_tokens", 0) + (getattr(usage, "prompt_tokens", 0) or 0)
+    span["completion_tokens"] = span.get("completion_tokens", 0) + (getattr(usage, "completion_tokens", 0) or 0)
+    span["cached"] = cached
+    if cached:
+        return
+    try:
+        span["cost"] = span.get("cost", 0.0) + (litellm.completion_cost(completion_response=response) or 0.0)
+    except Exception:
+        # models without pricing information
+        pass
+
+
+def annotate(**fields):
+    """
+    Adds fields to the open model call span, if any, e.g. the model a router picked for it.
+    """
+    span = _model_span.get()
+    if span is not None:
+        span.update(fields)
+
+
+def _write(span: dict):
+    try:
+        # spans of speculative candidates go to the workdir they were forked from, which outlives the fork
+        path = state_path(current().state_root(), TELEMETRY_FILE)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "a") as f:
+            f.write(json.dumps(span) + "\n")
+    except OSError as e:
+        logging.warning(f"Could not write telemetry. {e}")
+
+
+def reset(root: str):
+    """
+    Starts a fresh telemetry file for a new run in root.
+    """
+    try:
+        os.remove(state_path(root, TELEMETRY_FILE))
+    except FileNotFoundError:
+        pass
+
+
+class Telemetry:
+    """
+    ADK callbacks that record spans. Open spans are keyed by invocation and agent, or by function call id
+    for tools, so agents and sessions running side by side do not mix.
+    """
+
+    def __init__(self, profile: bool = None):
+        self.profile = profile if profile is not None else os.environ.get("TEDDY_PROFILE", "") not in ("", "0")
+        self._open = {}
+        self._profiles = 0
+
+    def _span(self, kind: str, name: str, agent: str) -> dict:
+        return {
+            "kind": kind,
+            "name": name,
+            "agent": agent,
+            "iteration": current().files.iteration,
+            "start": time.time(),
+            "_clock": time.perf_counter(),
+        }
+
+    def _finish(self, span: dict, **fields):
+        span.update(fields)
+        span["duration"] = round(time.perf_counter() - span.pop("_clock"), 4)
+        _write(span)
+
+    def instrument(self, agent):
+        """
+        Installs the callbacks on agent and all its sub-agents, keeping existing before_model_callbacks.
+        Turns are timed for the agents without sub-agents, so a loop's time is not counted twice.
+        """
+        if not agent.sub_agents:
+            agent.before_agent_callback = self.before_agent
+            agent.after_agent_callback = self.after_agent
+        if hasattr(agent, "before_model_callback"):
+            existing = agent.before_model_callback or []
+            existing = existing if isinstance(existing, list) else [existing]
+            agent.before_model_callback = [*existing, self.before_model]
+            agent.after_model_callback = self.after_model
+            agent.before_tool_callback = self.before_tool
+            agent.after_tool_callback = self.after_tool
+        for sub_agent in agent.sub_agents:
+            self.instrument(sub_agent)
+        return agent
+
+    def before_agent(self, callback_context):
+        key = (callback_context.invocation_id, callback_context.agent_name)
+        self._open[key] = self._span("agent", callback_context.agent_name, callback_context.agent_name)
+
+    def after_agent(self, callback_context):
+        span = self._open.pop((callback_context.invocation_id, callback_context.agent_name), None)
+        if span:
+            self._finish(span)
+
+    def before_model(self, callback_context, llm_request):
+        span = self._span("model", llm_request.model or "", callback_context.agent_name)
+        self._open[("model", callback_context.invocation_id, callback_context.agent_name)] = span
+        _model_span.set(span)
+
+    def after_model(self, callback_context, llm_response):
+        span = self._open.pop(("model", callback_context.invocation_id, callback_context.agent_name), None)
+        if span:
+            _model_span.set(None)
+            self._finish(span, error=bool(llm_response.error_code))
+
+    def before_tool(self, tool, args, tool_context):
+        span = self._span("tool", tool.name, tool_context.agent_name)
+        if self.profile and not any("_profiler" in other for other in self._open.values()):
+            # one profiler at a time; tools overlapping a profiled one are timed only
+            span["_profiler"] = cProfile.Profile()
+            span["_profiler"].enable()
+        self._open[("tool", tool_context.function_call_id)] = span
+
+    def after_tool(self, tool, args, tool_context, tool_response):
+        span = self._open.pop(("tool", tool_context.function_call_id), None)
+        if not span:
+            return
+        profiler = span.pop("_profiler", None)
+        if profiler:
+            profiler.disable()
+            self._profiles += 1
+            path = state_path(current().state_root(), os.path.join(PROFILE_DIR, f"{tool.name}-{self._profiles}.prof"))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            profiler.dump_stats(path)
+        result = tool_response.get("result", tool_response) if isinstance(tool_response, dict) else tool_response
+        self._finish(span, error=isinstance(result, str) and result.startswith("Error"))
+
+
+def load(root: str) -> list:
+    try:
+        with open(state_path(root, TELEMETRY_FILE)) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except (OSError, ValueError):
+        return []
+
+
+def summarize(root: str) -> dict:
+    """
+    Totals the spans of root's telemetry file by agent, by tool and by iteration.
+    """
+    totals = {"time": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0, "model_calls": 0}
+    agents, tools, iterations = {}, {}, {}
+    for span in load(root):
+        if span["kind"] == "agent":
+            agent = agents.setdefault(span["agent"], {"turns": 0, "time": 0.0, "model_time": 0.0, "tokens": 0})
+            agent["turns"] += 1
+            agent["time"] += span["duration"]
+            iteration = iterations.setdefault(str(span["iteration"]), {"time": 0.0, "tokens": 0})
+            iteration["time"] += span["duration"]
+            totals["time"] += span["duration"]
+        elif span["kind"] == "model":
+            tokens = span.get("prompt_tokens", 0) + span.get("completion_tokens", 0)
+            agent = agents.setdefault(span["agent"], {"turns": 0, "time": 0.0, "model_time": 0.0, "tokens": 0})
+            agent["model_time"] += span["duration"]
+            agent["tokens"] += tokens
+            iterations.setdefault(str(span["iteration"]), {"time": 0.0, "tokens": 0})["tokens"] += tokens
+            totals["model_calls"] += 1
+            totals["prompt_tokens"] += span.get("prompt_tokens", 0)
+            totals["completion_tokens"] += span.get("completion_tokens", 0)
+            totals["cost"] += span.get("cost", 0.0)
+        elif span["kind"] == "tool":
+            tool = tools.setdefault(span["name"], {"calls": 0, "time": 0.0, "errors": 0})
+            tool["calls"] += 1
+            tool["time"] += span["duration"]
+            tool["errors"] += bool(span.get("error"))
+    return {"totals": totals, "agents": agents, "tools": tools, "iterations": iterations}
+
+
+def _table(title: str, rows: dict, columns: tuple) -> str:
+    lines = [f"{title:<16}" + "".join(f"{column:>12}" for column in columns)]
+    for name, row in rows.items():
+        cells = [f"{row[column]:.2f}" if isinstance(row[column], float) else str(row[column]) for column in columns]
+        lines.append(f"{name:<16}" + "".join(f"{cell:>12}" for cell in cells))
+    return "\n".join(lines)
+
+
+def render(summary: dict) -> str:
+    totals = summary["totals"]
+    return "\n\n".join(
+        [
+            f"{totals['time']:.1f} s in agent turns, {totals['model_calls']} model calls, "
+            f"{totals['prompt_tokens']} prompt + {totals['completion_tokens']} completion tokens, "
+            f"${totals['cost']:.4f}",
+            _table("agent", summary["agents"], ("turns", "time", "model_time", "tokens")),
+            _table("tool", summary["tools"], ("calls", "time", "errors")),
+            _table("iteration", summary["iterations"], ("time", "tokens")),
+        ]
+    )
@@ -1,17 +1,70 @@
+import functools
 import os
-import subprocess
 import logging
+import time
 
+import coverage_map
+import deps
+import filecache
+import patching
+import report
+import snapshots
+import symbols
+import worker
+from selection import TestMap
+from shards import run_serial, run_sharded
+from subprocs import LimitExceeded, check_limits, describe_exit, log_output, run_process, uv_env
+from workspace import WorkspaceError, current
 
-def read_file(file_path: str) -> str:
+
+# read_file returns at most this many characters at once, see filecache.FileCache.page
+READ_MAX_CHARS = 20000
+
+# Tools resolve their paths against the workspace of the running session, see workspace.py. Paths outside
+# the workspace root raise WorkspaceError, which the tools report like any other error.
+
+
+def read_file(file_path: str, offset: int = 0, limit: int = 0) -> str:
     """
     Reads the contents of a file and returns it as a string.
+    offset:int - The number of lines to skip, to read a later part of a long file.
+    limit:int - The maximum number of lines to return; 0 returns as much as fits in one reply.
+    Long files are cut off with a note saying how to read the rest.
     """
-    if not os.path.exists(file_path):
+    workspace = current()
+    try:
+        path = workspace.resolve(file_path)
+    except WorkspaceError as e:
+        return f"Error: {e}"
+    if not os.path.exists(path):
         return f"Error: The file {file_path} does not exist."
+    if os.path.isdir(path):
+        return f"Error: {file_path} is a directory; use ls to list it."
 
-    with open(file_path, "r") as file:
-        return file.read()
+    try:
+        if filecache.is_binary(path):
+            return f"Error: {file_path} is a binary file ({os.path.getsize(path)} bytes) and cannot be read as text."
+        page = workspace.files.page(path, max(0, offset), max(0, limit), READ_MAX_CHARS)
+    except UnicodeDecodeError:
+        return f"Error: {file_path} is not a UTF-8 text file."
+    except Exception as e:
+        return f"Error: Could not read file {file_path}. {e}"
+    if page.offset >= page.total > 0:
+        return f"Error: {file_path} has only {page.total} lines."
+    if not page.truncated and page.offset == 0:
+        return page.text
+    text = page.text if page.text.endswith("\n") else page.text + "\n"
+    shown = f"lines {page.offset + 1}-{page.end} of {page.total}"
+    if page.cut:
+        shown = f"line {page.end} cut at {READ_MAX_CHARS} characters, {shown}"
+    if page.truncated and page.end < page.total:
+        return (
+            f"{text}[truncated, {shown} shown, {page.total - page.end} more lines. "
+            f"Call read_file with offset={page.end} to continue.]"
+        )
+    if page.truncated:
+        return f"{text}[truncated, {shown} shown.]"
+    return f"{text}[{shown}]"
 
 
 def write_file(file_path: str, content: str) -> str:
@@ -19,22 +72,107 @@ def write_file(file_path: str, content: str) -> str:
     Writes the given content to a file and returns a success message.
     """
     try:
-        with open(file_path, "w") as file:
-            file.write(content)
+        # identical content is not rewritten, so the file keeps its mtime
+        if not current().files.write(current().resolve(file_path), content):
+            return f"{file_path} already has this content, nothing written."
         return f"Content written to {file_path}"
     except Exception as e:
         return f"Error: Could not write to file {file_path}. {e}"
 
 
+def _edit(file_path: str, edit) -> str:
+    # edit(text) returns (new text, changed line ranges) or raises patching.PatchError
+    workspace = current()
+    try:
+        path = workspace.resolve(file_path)
+        if not os.path.isfile(path):
+            return f"Error: The file {file_path} does not exist."
+        text, regions = edit(workspace.files.read(path))
+        workspace.files.write(path, text)
+        changed = patching.excerpt(text, regions)
+        return f"Edited {file_path}, now {len(text.splitlines())} lines. Changed region:\n{changed}"
+    except patching.PatchError as e:
+        return f"Error: {e} Nothing was changed; read the lines again with read_file and retry."
+    except Exception as e:
+        return f"Error: Could not edit file {file_path}. {e}"
+
+
+def apply_patch(file_path: str, patch: str) -> str:
+    """
+    Edits a file with a small patch instead of rewriting it, and returns the changed region.
+    patch:str - Either a unified diff of the file (hunks starting with @@ -start,count +start,count @@ and
+    lines prefixed with space, - or +), or one or more blocks of the form
+    <<<<<<< SEARCH
+    exact existing lines
+    =======
+    replacement lines
+    >>>>>>> REPLACE
+    Every hunk or block must match the file exactly once, otherwise nothing is changed.
+    """
+    return _edit(file_path, lambda text: patching.apply_patch(text, patch))
+
+
+def replace_lines(file_path: str, start_line: int, end_line: int, content: str) -> str:
+    """
+    Replaces lines start_line to end_line (1-based, inclusive) of a file with content and returns the
+    changed region. Use end_line = start_line - 1 to insert content before start_line.
+    """
+    return _edit(file_path, lambda text: patching.replace_lines(text, start_line, end_line, content))
+
+
+def find_symbol(name: str) -> str:
+    """
+    Finds where a module, class, function, method or test is defined or imported in the workdir and
+    returns the locations (file:line) with signatures, plus the tests that use it. Matches exact names
+    and dotted names like Class.method first, then any name containing the given text.
+    """
+    try:
+        index = current().symbols
+        found = index.find(name)
+        if not found:
+            return f"No symbol matching {name} found."
+        lines = [str(symbol) for symbol in found[: symbols.MAX_MATCHES]]
+        if len(found) > symbols.MAX_MATCHES:
+            lines.append(f"... {len(found) - symbols.MAX_MATCHES} more, use a more specific name.")
+        tests = [test for test in index.tests_using(name) if test not in found]
+        if tests:
+            lines.append("Tests using it:")
+            lines.extend(f"{test.location} {test.qualname}" for test in tests[: symbols.MAX_MATCHES])
+        return "\n".join(lines)
+    except Exception as e:
+        return f"Error: Could not search for symbol {name}. {e}"
+
+
+def grep(pattern: str, path: str = "") -> str:
+    """
+    Searches the text files under path (a directory or file, default the current directory) for lines
+    matching a regular expression and returns them as file:line: text.
+    """
+    workspace = current()
+    try:
+        top = workspace.resolve(path)
+        if not os.path.exists(top):
+            return f"Error: The path {path} does not exist."
+        matches = symbols.grep(workspace.root, workspace.files, pattern, top)
+    except Exception as e:
+        return f"Error: Could not search for {pattern}. {e}"
+    if not matches:
+        return f"No lines matching {pattern} found."
+    lines = [f"{file}:{number}: {line}" for file, number, line in matches[: symbols.MAX_MATCHES]]
+    if len(matches) > symbols.MAX_MATCHES:
+        lines.append(f"... {len(matches) - symbols.MAX_MATCHES} more matches, narrow the pattern or path.")
+    return "\n".join(lines)
+
+
 def cd(path: str) -> str:
     """
     Changes the current working directory to the specified path and returns the new path.
     """
-    if not os.path.exists(path):
-        return f"Error: The path {path} does not exist."
+    workspace = current()
     try:
-        os.chdir(path)
-        return os.getcwd()
+        if not os.path.exists(workspace.resolve(path)):
+            return f"Error: The path {path} does not exist."
+        return workspace.chdir(path)
     except Exception as e:
         return f"Error: Could not change directory to {path}. {e}"
 
@@ -45,10 +183,11 @@ def ls(path: str) -> str:
     """
     if not path:
         path = "."
-    if not os.path.exists(path):
-        return f"Error: The path {path} does not exist."
     try:
-        return "\n".join(os.listdir(path))
+        resolved = current().resolve(path)
+        if not os.path.exists(resolved):
+            return f"Error: The path {path} does not exist."
+        return "\n".join(os.listdir(resolved))
     except Exception as e:
         return f"Error: Could not list contents of {path}. {e}"
 
@@ -57,10 +196,13 @@ def mv(src: str, dest: str) -> str:
     """
     Moves a file or directory from src to dest and returns a success message.
     """
-    if not os.path.exists(src):
-        return f"Error: The source {src} does not exist."
+    workspace = current()
     try:
-        os.rename(src, dest)
+        if not os.path.exists(workspace.resolve(src)):
+            return f"Error: The source {src} does not exist."
+        source, target = workspace.resolve(src), workspace.resolve(dest)
+        os.rename(source, target)
+        workspace.files.record("moved", target, source=source)
         return f"Moved {src} to {dest}"
     except Exception as e:
         return f"Error: Could not move {src} to {dest}. {e}"
@@ -71,7 +213,7 @@ def pwd() -> str:
     Returns the current working directory.
     """
     try:
-        return os.getcwd()
+        return current().cwd
     except Exception as e:
         return f"Error: Could not retrieve current working directory. {e}"
 
@@ -80,10 +222,13 @@ def mkdir(directory_path: str) -> str:
     """
     Creates a new directory at the specified path and returns a success message.
     """
-    if os.path.exists(directory_path):
-        return f"Error: The directory {directory_path} already exists."
     try:
-        os.makedirs(directory_path)
+        workspace = current()
+        path = workspace.resolve(directory_path)
+        if os.path.exists(path):
+            return f"Error: The directory {directory_path} already exists."
+        os.makedirs(path)
+        workspace.files.record("mkdir", path)
         return f"Directory {directory_path} created."
     except Exception as e:
         return f"Error: Could not create directory {directory_path}. {e}"
@@ -94,66 +239,267 @@ def touch(file_path: str) -> str:
     Creates an empty file at the specified path and returns a success message.
     """
     try:
-        with open(file_path, "a"):
-            pass
+        workspace = current()
+        path = workspace.resolve(file_path)
+        if not os.path.exists(path):
+            workspace.files.write(path, "")
+        else:
+            os.utime(path)
         return f"File {file_path} created."
     except Exception as e:
         return f"Error: Could not create file {file_path}. {e}"
 
 
-def run_python_file(file_path: str) -> str:
+def changed_files(since_iteration: int) -> str:
+    """
+    Lists the files the agents created, modified or moved since the given loop iteration (1 for the whole
+    task), without reading them. Changes made by the programs being run are not included.
+    """
+    files = current().files
+    changes = files.changes(since_iteration)
+    if not changes:
+        return f"No files changed since iteration {since_iteration} (current iteration: {files.iteration})."
+    # the latest change of each path is enough
+    latest = {}
+    for change in changes:
+        latest.pop(change.path, None)
+        latest[change.path] = change
+    lines = [f"iteration {change.iteration}: {change}" for change in latest.values()]
+    return f"{len(latest)} paths changed since iteration {since_iteration}:\n" + "\n".join(lines)
+
+
+async def _run(kind: str, args: list, cwd: str, limits, root: str = None, coverage=None):
+    """
+    Runs a "pytest" or "python" job in cwd in the warm test worker of root (by default cwd, see
+    Workspace.worker_dir), falling back to a `uv run` subprocess when the worker is unavailable. Returns
+    (returncode, stdout, stderr). Either way the event loop keeps running and the output is streamed to
+    the log as it is produced. coverage ({"rcfile", "data_file"}) runs pytest under coverage.py. Raises
+    LimitExceeded if the job hits its timeout, CPU or memory limit.
+    """
+    on_output = log_output(kind)
+    result = await worker.run_job(kind, args, cwd, on_output, limits, root, coverage)
+    if result is None:
+        command = ["uv", "run", "pytest", *args] if kind == "pytest" else ["uv", "run", *args]
+        if coverage and kind == "pytest":
+            measure = [f"--rcfile={coverage['rcfile']}", f"--data-file={coverage['data_file']}"]
+            command = ["uv", "run", "coverage", "run", *measure, "-m", "pytest", *args]
+        result = await run_process(command, cwd, on_output, limits.timeout, limits.rlimits(), uv_env())
+    check_limits(limits, *result, memory_errors=kind == "python")
+    return result
+
+
+def _limit_error(what: str, e: LimitExceeded) -> str:
+    message = (
+        f"Error: {what} {e} and was stopped. Look for infinite loops, blocking network calls or unbounded "
+        "memory use in the code being run."
+    )
+    tail = e.tail()
+    return f"{message}\nLast output:\n{tail}" if tail else message
+
+
+async def run_python_file(file_path: str) -> str:
     """
     Executes a Python file and returns the output or an error message.
     """
-    if not os.path.exists(file_path):
+    workspace = current()
+    try:
+        path = workspace.resolve(file_path)
+    except WorkspaceError as e:
+        return f"Error: {e}"
+    if not os.path.exists(path):
         return f"Error: The file {file_path} does not exist."
 
     try:
+        # packages newly imported by the code are installed first, all in one go
+        note = await deps.ensure(workspace.root, workspace.limits)
         # run the python file and capture the output and return it
-        result = subprocess.run(
-            ["uv", "run", file_path],
-            capture_output=True,
-            text=True,
-        )
-        if result.returncode == 0:
-            return result.stdout.strip()
-        else:
-            return f"Error: {result.stderr.strip()}"
+        args = [workspace.relpath(path)]
+        returncode, stdout, stderr = await _run("python", args, workspace.cwd, workspace.limits, workspace.worker_dir())
+        if returncode == 0:
+            return f"{note}\n{stdout.strip()}" if note else stdout.strip()
+        # e.g. a segfault or os._exit leaves no traceback, so the status and the output have to say it
+        output = stderr.strip() or stdout.strip()
+        status = f"{file_path} {describe_exit(returncode)}."
+        error = f"{output}\n{status}" if output else status
+        return f"Error: {error}\n{note}" if note else f"Error: {error}"
+    except LimitExceeded as e:
+        return _limit_error(file_path, e)
     except Exception as e:
         return f"Error: Could not execute Python file {file_path}. {e}"
 
 
-def run_pytest(tests_dir: str) -> str:
+async def run_pytest(tests_dir: str, full: bool = False, parallel: bool = False, coverage: bool = False) -> str:
     """
     Runs pytest command on the current directory and returns the output or an error message.
     tests_dir:str - The directory containing the tests to run. Defaults to current directory if an empty string is passed.
     If the directory does not exist, it runs pytest on the current directory.This is common if the tests are at the root level.
+    full:bool - By default only the test files affected by changes since the last green run are run.
+    Pass True to run the whole suite, e.g. as the final check before declaring the task complete.
+    parallel:bool - Pass True to split a large suite across all CPU cores.
+    coverage:bool - Pass True to measure line and branch coverage and list the functions, lines and branches
+    no test covers yet, per module.
     """
 
     try:
+        workspace = current()
         if not tests_dir:
             tests_dir = "."
-        if tests_dir != "." and os.path.exists(tests_dir):
-            result = subprocess.run(["uv", "run", "pytest", tests_dir], capture_output=True, text=True)
-            logging.debug(f"tests/ output: {result.stdout.strip()}")
-            return "Output:\n" + result.stdout.strip() + "\nErrors:\n" + result.stderr.strip()
+        if tests_dir != "." and not os.path.exists(workspace.resolve(tests_dir)):
+            tests_dir = "."
+        # first, since `uv add` rewrites pyproject.toml and uv.lock, which the selection hashes
+        note = await deps.ensure(workspace.root, workspace.limits, ("coverage",) if coverage else ())
+        # all .teddy state lives at the workspace root, whatever the cwd, so the controllers reading it
+        # see the same runs; tests_dir is relative to the cwd
+        test_map = TestMap(workspace.root)
+        affected, tests = test_map.select(workspace.resolve(tests_dir))
+        if full or len(affected) == len(tests):
+            selected = tests
+            args = [tests_dir] if tests_dir != "." else []
+        elif not affected:
+            # everything is green at its current hash, which counts as a passing run of this code
+            report.record_run(test_map.root, True, [], test_map.fingerprint())
+            return (
+                f"No tests affected by changes since the last green run ({len(tests)} test files unchanged). "
+                "Call run_pytest with full=True to run the whole suite."
+            )
+        else:
+            selected = affected
+            args = [workspace.relpath(test_map.abspath(test)) for test in affected]
+            note += f"\nRan {len(affected)} of {len(tests)} test files affected since the last green run: {', '.join(affected)}"
+        start = time.perf_counter()
+        run = functools.partial(_run, cwd=workspace.cwd, limits=workspace.limits, root=workspace.worker_dir())
+        rcfile = coverage_map.prepare(test_map.root) if coverage else None
+        if parallel:
+            # the collected node ids are relative to the rootdir, so collection and the shards run from there
+            run = functools.partial(run, cwd=test_map.root)
+            args = [os.path.relpath(os.path.join(workspace.cwd, arg), test_map.root) for arg in args or ["."]]
+            returncode, stdout, stderr, junits = await run_sharded(run, test_map.root, args, rcfile=rcfile)
         else:
-            result = subprocess.run(["uv", "run", "pytest"], capture_output=True, text=True)
-            logging.debug(f"output: {result.stdout.strip()}")
-            return "Output:\n" + result.stdout.strip() + "\nErrors:\n" + result.stderr.strip()
+            returncode, stdout, stderr, junits = await run_serial(run, test_map.root, args, rcfile)
+        elapsed = time.perf_counter() - start
+        logging.debug(f"output: {stdout.strip()}")
+        snapshot = None
+        if returncode == 0:
+            test_map.record_green(selected)
+        # a fork (see speculate.py) is thrown away, and so would its snapshots be
+        if returncode == 0 and workspace.origin is None:
+            snapshot = snapshots.take(workspace.root, workspace.files, test_map.fingerprint())
+        result = report.parse_junit(test_map.root, junits)
+        if result is None:
+            blocks = report.render_raw(returncode, stdout, stderr, note)
+        else:
+            blocks = report.render(result, returncode, elapsed, note, stderr)
+        if snapshot is not None:
+            blocks.append(f"Green state saved as snapshot {snapshot['id']}; rollback() returns the workdir to it.")
+        counts = result and dict(result["counts"])
+        if coverage:
+            files = coverage_map.update(test_map.root)
+            if files is None:
+                blocks.append("Coverage was not measured: coverage.py could not be loaded in the test environment.")
+            else:
+                blocks.append(coverage_map.render(test_map.root, files))
+                if counts is not None:
+                    counts["coverage"] = coverage_map.percent(files)
+        # without a report, the selected test files stand in for the failing tests
+        failing = [failure["id"] for failure in result["failures"]] if result else selected
+        report.record_run(test_map.root, returncode == 0, [] if returncode == 0 else failing, test_map.fingerprint())
+        # a run of the whole suite is what the convergence controller judges the task by
+        whole = selected == tests and len(tests) == len(test_map.tests("."))
+        full_run = {"returncode": returncode, "fingerprint": test_map.fingerprint()} if whole else None
+        return report.store(test_map.root, report.paginate(blocks), counts, full_run)
+    except LimitExceeded as e:
+        return _limit_error("pytest", e)
     except Exception as e:
         return f"Error: Could not run tests. {e}"
 
 
-def pip_install(package: str) -> str:
+def _count(items: list, noun: str) -> str:
+    return f"{len(items)} {noun}" if len(items) == 1 else f"{len(items)} {noun}s"
+
+
+def rollback(snapshot: int = 0) -> str:
     """
-    Installs a Python package using pip and returns the output or an error message.
+    Restores the workdir to the state of an earlier green test run, by default the latest, undoing every
+    change made since, e.g. after an edit broke tests that passed. Call diff_snapshot first to see what
+    would be undone.
+    snapshot:int - The snapshot number reported by run_pytest, or 0 for the latest.
     """
     try:
-        result = subprocess.run(["uv", "add", package], capture_output=True, text=True)
-        if result.returncode == 0:
+        workspace = current()
+        restored = snapshots.restore(workspace.root, workspace.files, snapshot)
+        if restored is None:
+            if snapshot:
+                return f"Error: There is no snapshot {snapshot}. Snapshots kept: {snapshots.ids(workspace.root)}."
+            return "Error: There is no snapshot yet. A snapshot is taken at every green run_pytest."
+        manifest, changed, removed, damaged = restored
+        lines = [f"Workdir restored to snapshot {manifest['id']} (green run in iteration {manifest['iteration']})."]
+        if not changed and not removed:
+            lines.append("Nothing had changed since.")
+        if changed:
+            lines.append(f"Restored {_count(changed, 'file')}: {', '.join(changed)}")
+        if removed:
+            lines.append(f"Removed {_count(removed, 'file')} created since: {', '.join(removed)}")
+        if damaged:
+            lines.append(f"Could not restore {', '.join(damaged)}: the stored copy was changed in place.")
+        return "\n".join(lines)
+    except Exception as e:
+        return f"Error: Could not roll back. {e}"
+
+
+def diff_snapshot(snapshot: int = 0, file_path: str = "") -> str:
+    """
+    Shows a unified diff of the workdir against an earlier green test run, by default the latest.
+    snapshot:int - The snapshot number reported by run_pytest, or 0 for the latest.
+    file_path:str - Limits the diff to this file or directory. Pass an empty string for the whole workdir.
+    """
+    try:
+        workspace = current()
+        only = os.path.relpath(workspace.resolve(file_path), workspace.root).replace(os.sep, "/") if file_path else None
+        result = snapshots.diff(workspace.root, snapshot, only)
+        if result is None:
+            if snapshot:
+                return f"Error: There is no snapshot {snapshot}. Snapshots kept: {snapshots.ids(workspace.root)}."
+            return "Error: There is no snapshot yet. A snapshot is taken at every green run_pytest."
+        manifest, text = result
+        if not text:
+            return f"No changes since snapshot {manifest['id']}."
+        if len(text) > snapshots.DIFF_MAX_CHARS:
+            text = text[: snapshots.DIFF_MAX_CHARS] + "\n... diff cut off; pass file_path to see one file."
+        return f"Changes since snapshot {manifest['id']} (green run in iteration {manifest['iteration']}):\n{text}"
+    except WorkspaceError as e:
+        return f"Error: {e}"
+    except Exception as e:
+        return f"Error: Could not diff against the snapshot. {e}"
+
+
+def pytest_report(page: int) -> str:
+    """
+    Returns the given page (starting at 1) of the latest run_pytest report, for reports too long to fit in one reply.
+    """
+    try:
+        return report.page(current().root, page)
+    except Exception as e:
+        return f"Error: Could not read the test report. {e}"
+
+
+async def pip_install(package: str) -> str:
+    """
+    Installs one or more Python packages (separated by spaces or commas) in a single step and returns a success or error message.
+    Packages imported by the code are also installed automatically before each run_python_file and run_pytest.
+    """
+    try:
+        workspace = current()
+        packages = package.replace(",", " ").split()
+        if not packages:
+            return "Error: No package given."
+        installed, failed = await deps.install(workspace.root, packages, workspace.limits)
+        if not failed:
             return f"Package {package} installed successfully."
-        else:
-            return f"Error: {result.stderr.strip()}"
+        errors = "\n".join(f"{name}: {error}" for name, error in failed.items())
+        if installed:
+            return f"Installed {', '.join(installed)}, but some packages failed.\nError: {errors}"
+        return f"Error: {errors}"
+    except LimitExceeded as e:
+        return _limit_error(f"Installing {package}", e)
     except Exception as e:
         return f"Error: Could not install package {package}. {e}"
@@ -1,64 +1,126 @@
 from google.adk.runners import Runner
 from google.adk.sessions import InMemorySessionService
 from google.genai import types
+from workspace import bind, current
 from pprint import pprint as print
 import logging
 
 
+# Keeps the workspace's file journal on the loop iteration found in a session state (delta).
+def _track_iteration(workspace, state):
+    for key, value in state.items():
+        if key.endswith(":iterations") and value:
+            workspace.files.iteration = value
+
+
 # Function that runs the agent and parses and logs its events.
-async def call_agent_async(query, agent, app_name, user_id, session_id):
+# With a persistent session_service (e.g. sessions.SqliteSessionService) and resume=True, an existing
+# session is continued where it stopped instead of starting the query over.
+# Returns {"status": "complete" | "stopped" | "error", "final": <last response or error>}; "stopped" means the
+# agent finished without declaring TASK_COMPLETE, e.g. a loop that ran out of iterations.
+# The tools work in workspace (a workspace.Workspace), bound for this run only, so several sessions can run
+# concurrently in one event loop; without one they use the default workspace of the process.
+# accept_complete(workspace) -> (accepted, reason) vets a TASK_COMPLETE before the run ends on it, e.g.
+# convergence.ConvergenceController.check; a rejected one is logged and the run goes on.
+async def call_agent_async(
+    query,
+    agent,
+    app_name,
+    user_id,
+    session_id,
+    session_service=None,
+    resume=False,
+    workspace=None,
+    accept_complete=None,
+):
     # Create a Runner
-    session_service = InMemorySessionService()
-    session_service.create_session(app_name=app_name, user_id=user_id, session_id=session_id)
-    runner = Runner(agent=agent, app_name=app_name, session_service=session_service)
+    session_service = session_service or InMemorySessionService()
+    session = session_service.get_session(app_name=app_name, user_id=user_id, session_id=session_id)
+    if session and resume:
+        completed = any(
+            part.text and "TASK_COMPLETE" in part.text
+            for event in session.events
+            if event.content and event.content.parts
+            for part in event.content.parts
+        )
+        if completed and accept_complete:
+            completed = accept_complete(workspace or current())[0]
+        if completed:
+            logging.info(f"Session {session_id} already completed its task, nothing to resume.")
+            print(f"Session {session_id} already completed its task, nothing to resume.")
+            return {"status": "complete", "final": "Already completed."}
+        content = None
+        logging.info(f"Resuming session {session_id} with {len(session.events)} events")
+        print(f"\n--- Resuming session {session_id} ({len(session.events)} events) ---")
+    else:
+        if session:
+            session_service.delete_session(app_name=app_name, user_id=user_id, session_id=session_id)
+        session = session_service.create_session(app_name=app_name, user_id=user_id, session_id=session_id)
+        content = types.Content(role="user", parts=[types.Part(text=query)])
+        logging.info(f"Running query: {query}")
+        print(f"\n--- Running Query: {query} ---")
+    with bind(workspace or current()) as bound:
+        _track_iteration(bound, session.state)
+        runner = Runner(agent=agent, app_name=app_name, session_service=session_service)
 
-    content = types.Content(role="user", parts=[types.Part(text=query)])
-    logging.info(f"Running query: {query}")
-    print(f"\n--- Running Query: {query} ---")
-    final_response_text = "No final text response captured."
-    try:
-        async for event in runner.run_async(user_id=user_id, session_id=session_id, new_message=content):
-            has_specific_part = False
-            if event.content and event.content.parts:
-                for part in event.content.parts:
-                    if part.text and not part.text.isspace():
-                        if "TASK_COMPLETE" in part.text:
-                            logging.info(f"[{event.author}] Task Complete: {part.text.strip()}")
-                            print(f"[{event.author}] Task Complete: {part.text.strip()}")
-                            return
-                        logging.info(f"[{event.author}] {part.text.strip()}")
-                        print(f"[{event.author}]{part.text.strip()}", compact=True)
-                    elif part.function_response:
-                        logging.info(
-                            f"[{event.author}]Function response: {part.function_response.name, part.function_response.response}"
-                        )
-                        print(
-                            f"[{event.author}]Function response: {part.function_response.name, part.function_response.response}"
-                        )
-                    elif part.function_call:
-                        if event.author == "coder":
+        final_response_text = "No final text response captured."
+        try:
+            async for event in runner.run_async(user_id=user_id, session_id=session_id, new_message=content):
+                if not event.content and event.actions.state_delta:
+                    # bookkeeping events, e.g. the loop position of a ResumableLoopAgent; the iteration
+                    # count tags the changes in the workspace's file journal
+                    _track_iteration(bound, event.actions.state_delta)
+                    continue
+                has_specific_part = False
+                if event.content and event.content.parts:
+                    for part in event.content.parts:
+                        if part.text and not part.text.isspace():
+                            if "TASK_COMPLETE" in part.text and accept_complete:
+                                accepted, reason = accept_complete(bound)
+                                if not accepted:
+                                    logging.info(f"[{event.author}] TASK_COMPLETE not accepted: {reason}")
+                                    print(f"[{event.author}] TASK_COMPLETE not accepted: {reason}")
+                            if "TASK_COMPLETE" in part.text and (not accept_complete or accepted):
+                                logging.info(f"[{event.author}] Task Complete: {part.text.strip()}")
+                                print(f"[{event.author}] Task Complete: {part.text.strip()}")
+                                return {"status": "complete", "final": part.text.strip()}
+                            logging.info(f"[{event.author}] {part.text.strip()}")
+                            print(f"[{event.author}]{part.text.strip()}", compact=True)
+                        elif part.function_response:
                             logging.info(
-                                f"[{event.author}]Function call: {part.function_call.name, part.function_call.args}"
+                                f"[{event.author}]Function response: {part.function_response.name, part.function_response.response}"
                             )
-                            print(f"[{event.author}]Function call: {part.function_call.name, part.function_call.args}")
-                        else:
-                            logging.info(
-                                f"[{event.author}]Function call: {part.function_call.name, part.function_call.args}"
+                            print(
+                                f"[{event.author}]Function response: {part.function_response.name, part.function_response.response}"
                             )
-                            print(f"[{event.author}]Function call: {part.function_call.name, part.function_call.args}")
-            if not has_specific_part and event.is_final_response():
-                if event.content and event.content.parts and event.content.parts[0].text:
-                    final_response_text = event.content.parts[0].text.strip()
-                    logging.info(f"[{event.author}]==> Final Agent Response: {final_response_text}")
-                    print(f"[{event.author}]==> Final Agent Response: {final_response_text}")
-                else:
-                    logging.info(f"[{event.author}]==> Final Agent Response: [No text content in final event]")
-                    print(f"[{event.author}]==> Final Agent Response: [No text content in final event]")
-            logging.info("" * 50)
-            print("-" * 50)
+                        elif part.function_call:
+                            if event.author == "coder":
+                                logging.info(
+                                    f"[{event.author}]Function call: {part.function_call.name, part.function_call.args}"
+                                )
+                                print(f"[{event.author}]Function call: {part.function_call.name, part.function_call.args}")
+                            else:
+                                logging.info(
+                                    f"[{event.author}]Function call: {part.function_call.name, part.function_call.args}"
+                                )
+                                print(f"[{event.author}]Function call: {part.function_call.name, part.function_call.args}")
+                if not has_specific_part and event.is_final_response():
+                    if event.content and event.content.parts and event.content.parts[0].text:
+                        final_response_text = event.content.parts[0].text.strip()
+                        logging.info(f"[{event.author}]==> Final Agent Response: {final_response_text}")
+                        print(f"[{event.author}]==> Final Agent Response: {final_response_text}")
+                    else:
+                        logging.info(f"[{event.author}]==> Final Agent Response: [No text content in final event]")
+                        print(f"[{event.author}]==> Final Agent Response: [No text content in final event]")
+                logging.info("" * 50)
+                print("-" * 50)
 
-    except Exception as e:
-        logging.error(f"ERROR during agent run: {e}")
-        print(f"ERROR during agent run: {e}")
-    logging.info("-" * 50)
-    print("-" * 50)
+        except Exception as e:
+            logging.error(f"ERROR during agent run: {e}")
+            print(f"ERROR during agent run: {e}")
+            return {"status": "error", "final": str(e)}
+        finally:
+            session_service.close_session(session=session)
+        logging.info("-" * 50)
+        print("-" * 50)
+        return {"status": "stopped", "final": final_response_text}
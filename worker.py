@@ -0,0 +1,529 @@
+"""
+A long-lived, pre-warmed runner for pytest and python jobs (a "zygote").
+
+One zygote is started per workdir inside the workdir's uv environment. It imports pytest and the
+third-party packages used by the generated code once, then forks a clean child for every job, so a
+run only pays for the tests themselves instead of uv resolution, interpreter startup and imports.
+
+Clients await `run_job`, which returns None whenever the zygote is unavailable so that callers can fall
+back to a plain `uv run` subprocess. Job output is streamed to the caller while the job runs, and every
+job child leads its own process group, so a cancelled job is killed with everything it started. A job's
+exit status is the one waitpid reports for it, so a crash or a signal reads the same as in a subprocess.
+"""
+
+import ast
+import asyncio
+import atexit
+import importlib
+import importlib.util
+import json
+import logging
+import os
+import select
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from subprocs import LimitExceeded, set_rlimits, uv_env
+
+
+SUPPORTED = hasattr(os, "fork") and hasattr(socket, "AF_UNIX")
+SKIP_DIRS = {".venv", "venv", ".git", "__pycache__", ".pytest_cache", ".teddy"}
+
+_zygotes = {}
+_broken = set()
+_imports = {}
+# _lock guards _root_locks only; a zygote is started under the lock of its own root, so a slow start in
+# one workdir does not hold up the jobs of the others
+_lock = threading.Lock()
+_root_locks = {}
+TAIL_INTERVAL = 0.2
+# a zygote not ready after this many seconds (e.g. a hung `uv run`) is killed and its workdir falls back
+START_TIMEOUT = 180
+
+
+class Zygote:
+    """
+    Client handle for one zygote process serving a single workdir.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.sock_dir = tempfile.mkdtemp(prefix="teddy-")
+        self.sock_path = os.path.join(self.sock_dir, "zygote.sock")
+        self.process = None
+
+    def start(self) -> bool:
+        try:
+            self.process = subprocess.Popen(
+                ["uv", "run", "python", os.path.abspath(__file__), self.sock_path, self.root],
+                cwd=self.root,
+                env=uv_env(),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                text=True,
+                start_new_session=True,
+            )
+        except Exception as e:
+            logging.warning(f"Could not start test worker for {self.root}. {e}")
+            return False
+        # the zygote prints a single line once it is warm and listening; this runs under the root's lock, so
+        # it must not wait forever
+        readable, _, _ = select.select([self.process.stdout], [], [], START_TIMEOUT)
+        if not readable:
+            logging.warning(f"Test worker for {self.root} was not ready after {START_TIMEOUT} s, stopping it.")
+            _kill_group(self.process.pid)
+            self.stop()
+            return False
+        ready = self.process.stdout.readline().strip()
+        if ready != "ready":
+            logging.warning(f"Test worker for {self.root} failed to start.")
+            self.stop()
+            return False
+        logging.info(f"Test worker started for {self.root} (pid {self.process.pid})")
+        return True
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    async def run(self, job: dict, on_output=None, timeout=None):
+        """
+        Sends a job to the zygote and returns (returncode, stdout, stderr), or None if the zygote died.
+        While the job runs, new output lines are passed to on_output(stream, line). A job still running
+        after timeout seconds is killed and LimitExceeded is raised.
+        """
+        out_fd, out_path = tempfile.mkstemp(prefix="teddy-out-")
+        err_fd, err_path = tempfile.mkstemp(prefix="teddy-err-")
+        os.close(out_fd)
+        os.close(err_fd)
+        tails = [_Tail(out_path, "stdout", on_output), _Tail(err_path, "stderr", on_output)]
+        pid = None
+        writer = reply = None
+        deadline = time.monotonic() + timeout if timeout else None
+        try:
+            reader, writer = await asyncio.open_unix_connection(self.sock_path)
+            writer.write((json.dumps(dict(job, stdout=out_path, stderr=err_path)) + "\n").encode())
+            await writer.drain()
+            try:
+                handshake = await asyncio.wait_for(reader.readline(), deadline and deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                # the zygote never forked the job, e.g. stuck in an import: it is of no further use
+                logging.warning(f"Test worker for {self.root} did not start a job within {timeout:g} s, stopping it.")
+                _kill_group(self.process.pid)
+                self.stop()
+                raise LimitExceeded(f"timed out after {timeout:g} s")
+            pid = json.loads(handshake)["pid"]
+            reply = asyncio.ensure_future(reader.readline())
+            while not reply.done():
+                await asyncio.wait({reply}, timeout=TAIL_INTERVAL)
+                for tail in tails:
+                    tail.poll()
+                if deadline and time.monotonic() > deadline and not reply.done():
+                    _kill_group(pid)
+                    pid = None
+                    raise LimitExceeded(f"timed out after {timeout:g} s", *(tail.finish() for tail in tails))
+            # the job's waitpid status, sent by the process that forked it; no reply means the zygote died
+            returncode = json.loads(reply.result())["returncode"]
+            pid = None
+            return (returncode, *(tail.finish() for tail in tails))
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"Test worker for {self.root} failed. {e}")
+            return None
+        finally:
+            if pid is not None:
+                # cancelled (or failed) while the job was running: kill the job and whatever it started
+                _kill_group(pid)
+            if reply is not None and not reply.done():
+                reply.cancel()
+            if writer is not None:
+                writer.close()
+            os.remove(out_path)
+            os.remove(err_path)
+
+    def stop(self):
+        if self.alive():
+            try:
+                os.killpg(self.process.pid, signal.SIGTERM)
+            except OSError:
+                pass
+            self.process.wait()
+        shutil.rmtree(self.sock_dir, ignore_errors=True)
+
+
+class _Tail:
+    """
+    Follows a job's output file and reports complete lines as they are written.
+    """
+
+    def __init__(self, path: str, stream: str, on_output):
+        self.path = path
+        self.stream = stream
+        self.on_output = on_output
+        self.data = b""
+        self.reported = 0
+
+    def poll(self):
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(len(self.data))
+                self.data += f.read()
+        except OSError:
+            return
+        end = self.data.rfind(b"\n") + 1
+        if self.on_output and end > self.reported:
+            for line in self.data[self.reported : end].decode(errors="replace").splitlines():
+                self.on_output(self.stream, line)
+        self.reported = max(self.reported, end)
+
+    def finish(self) -> str:
+        self.poll()
+        if self.on_output and len(self.data) > self.reported:
+            self.on_output(self.stream, self.data[self.reported :].decode(errors="replace"))
+        return self.data.decode(errors="replace")
+
+
+def _kill_group(pid: int):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _root_lock(root: str) -> threading.Lock:
+    with _lock:
+        return _root_locks.setdefault(root, threading.Lock())
+
+
+def _acquire(root: str):
+    with _root_lock(root):
+        return _zygote(root)
+
+
+async def run_job(kind: str, args: list, cwd: str, on_output=None, limits=None, root: str = None, coverage=None):
+    """
+    Runs a "pytest" or "python" job in cwd and returns (returncode, stdout, stderr). The job runs in the
+    zygote of root (by default cwd), e.g. a fork of a workdir uses the workdir's zygote, whose warm imports
+    are all third-party. Returns None if no zygote can serve the job; the caller is expected to fall back
+    to a subprocess. Output lines are passed to on_output(stream, line) as the job writes them. limits
+    (subprocs.Limits) sets the job's timeout and rlimits. coverage ({"rcfile", "data_file"}, see
+    coverage_map.py) measures a pytest job with coverage.py.
+    """
+    if not SUPPORTED:
+        return None
+    root = os.path.realpath(root or cwd)
+    # starting a zygote blocks until it is warm, so it happens off the event loop
+    zygote = await asyncio.to_thread(_acquire, root)
+    if zygote is None:
+        return None
+    job = {
+        "kind": kind,
+        "args": list(args),
+        "cwd": os.path.realpath(cwd),
+        "limits": limits.rlimits() if limits else {},
+        "coverage": coverage,
+    }
+    result = await zygote.run(job, on_output, limits.timeout if limits else None)
+    if result is None:
+        with _root_lock(root):
+            zygote.stop()
+            if _zygotes.get(root) is zygote:
+                del _zygotes[root]
+    return result
+
+
+def _zygote(root: str):
+    if root in _broken:
+        return None
+    zygote = _zygotes.get(root)
+    if zygote is None or not zygote.alive():
+        if zygote is not None:
+            logging.warning(f"Test worker for {root} died, restarting it.")
+            zygote.stop()
+        zygote = Zygote(root)
+        if not zygote.start():
+            _broken.add(root)
+            _zygotes.pop(root, None)
+            return None
+        _zygotes[root] = zygote
+    return zygote
+
+
+def stop(cwd: str):
+    """
+    Stops the zygote serving cwd, e.g. after new packages are installed.
+    """
+    zygote = _zygotes.pop(os.path.realpath(cwd), None)
+    if zygote is not None:
+        zygote.stop()
+
+
+def stop_all():
+    for root in list(_zygotes):
+        stop(root)
+
+
+atexit.register(stop_all)
+
+
+# Zygote side
+
+
+def resolve(parts: list, bases: list) -> list:
+    """
+    Returns the files executed by importing the dotted name parts from the first of the directories bases
+    that has it, or [] if none does.
+    """
+    for base in bases:
+        if not parts:
+            init = os.path.join(base, "__init__.py")
+            return [init] if os.path.isfile(init) else []
+        files = []
+        current = base
+        for i, part in enumerate(parts):
+            current = os.path.join(current, part)
+            last = i == len(parts) - 1
+            if os.path.isfile(os.path.join(current, "__init__.py")):
+                files.append(os.path.join(current, "__init__.py"))
+            elif last and os.path.isfile(current + ".py"):
+                files.append(current + ".py")
+            elif last or not os.path.isdir(current):
+                files = []
+                break
+        if files:
+            return files
+    return []
+
+
+def third_party_imports(root: str) -> set:
+    """
+    Returns the top-level names imported by the python files under root that resolve to no module, package
+    or directory anywhere under root (scripts import their sibling modules from wherever they are).
+    """
+    names = set()
+    dirs = []
+    local = set()
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS and not d.startswith(".")]
+        dirs.append(dirpath)
+        # namespace packages have no __init__.py to resolve
+        local.update(dirnames)
+        for filename in filenames:
+            if filename.endswith(".py"):
+                names.update(_file_imports(os.path.join(dirpath, filename)))
+    return {name for name in names - local if not resolve([name], dirs)}
+
+
+def _file_imports(path: str) -> set:
+    try:
+        mtime = os.stat(path).st_mtime_ns
+        if path in _imports and _imports[path][0] == mtime:
+            return _imports[path][1]
+        with open(path, encoding="utf-8") as f:
+            tree = ast.parse(f.read())
+    except (OSError, SyntaxError, ValueError):
+        return set()
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module.split(".")[0])
+    _imports[path] = (mtime, names)
+    return names
+
+
+def _warm_pytest():
+    """
+    Runs one empty collection so that pytest, its default plugins and any installed pytest11 plugins are
+    imported through pytest's own assertion-rewriting loader, as a real run would import them.
+    """
+    import pytest
+
+    empty = tempfile.mkdtemp(prefix="teddy-warm-")
+    try:
+        pytest.main(["--collect-only", "-q", "-p", "no:cacheprovider", empty])
+    except BaseException:
+        pass
+    finally:
+        shutil.rmtree(empty, ignore_errors=True)
+
+
+def _prewarm(root: str):
+    for name in sorted(third_party_imports(root)):
+        if name in sys.modules:
+            continue
+        try:
+            spec = importlib.util.find_spec(name)
+            origin = spec and spec.origin or ""
+            if spec is None or os.path.realpath(origin).startswith(root):
+                continue
+            importlib.import_module(name)
+        except BaseException:
+            # a broken or side-effectful import is simply left to the child
+            continue
+
+
+def _execute(job: dict) -> int:
+    os.chdir(job["cwd"])
+    importlib.invalidate_caches()
+    if job["kind"] == "pytest":
+        import pytest
+
+        sys.argv = ["pytest", *job["args"]]
+        if not job.get("coverage"):
+            return int(pytest.main(job["args"]))
+        try:
+            import coverage
+        except ImportError:
+            print("coverage is not installed in this environment, running without it", file=sys.stderr)
+            return int(pytest.main(job["args"]))
+        cov = coverage.Coverage(data_file=job["coverage"]["data_file"], config_file=job["coverage"]["rcfile"])
+        cov.start()
+        try:
+            return int(pytest.main(job["args"]))
+        finally:
+            cov.stop()
+            cov.save()
+
+    import runpy
+    import traceback
+
+    path = job["args"][0]
+    sys.argv = list(job["args"])
+    sys.path.insert(0, os.path.dirname(os.path.abspath(path)))
+    try:
+        runpy.run_path(path, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        if isinstance(e.code, int):
+            return e.code
+        print(e.code, file=sys.stderr)
+        return 1
+    except BaseException as e:
+        # drop the worker and runpy frames so the traceback reads like `python path`
+        tb = e.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename != path:
+            tb = tb.tb_next
+        traceback.print_exception(type(e), e, tb)
+        return 1
+    return 0
+
+
+def _monitor(conn: socket.socket, job: dict):
+    """
+    Forks the job and replies with its real exit status: the exit code, or minus the signal that killed
+    it (a segfault, the OOM killer, os._exit), as subprocess reports them.
+    """
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    pid = os.fork()
+    if pid == 0:
+        conn.close()
+        _child(job)
+    # the job leads its own process group, which the client kills if the job is cancelled; both sides set
+    # it so the client never sees the pid before the group exists
+    try:
+        os.setpgid(pid, pid)
+    except OSError:
+        pass
+    try:
+        try:
+            conn.sendall((json.dumps({"pid": pid}) + "\n").encode())
+        except OSError:
+            # the client is gone (e.g. it gave up waiting), so nobody would ever stop the job
+            _kill_group(pid)
+        _, status, usage = os.wait4(pid, 0)
+        returncode = os.waitstatus_to_exitcode(status)
+        cpu_seconds = (job.get("limits") or {}).get("cpu_seconds") or 0
+        if returncode == -signal.SIGKILL and cpu_seconds and usage.ru_utime + usage.ru_stime >= cpu_seconds:
+            # a job that handled SIGXCPU is killed at the hard limit a second later
+            returncode = -signal.SIGXCPU
+        conn.sendall((json.dumps({"returncode": returncode}) + "\n").encode())
+    finally:
+        os._exit(0)
+
+
+def _child(job: dict):
+    os.setpgid(0, 0)
+    _limit(job.get("limits") or {})
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    out = os.open(job["stdout"], os.O_WRONLY | os.O_TRUNC)
+    err = os.open(job["stderr"], os.O_WRONLY | os.O_TRUNC)
+    os.dup2(out, 1)
+    os.dup2(err, 2)
+    returncode = 1
+    try:
+        returncode = _execute(job)
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        # as the interpreter would, keep the low byte
+        os._exit(returncode & 0xFF)
+
+
+def _limit(limits: dict):
+    def on_cpu_limit(signum, frame):
+        # flush what the job printed, then die of the signal so the status says why
+        sys.stdout.flush()
+        sys.stderr.flush()
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+    signal.signal(signal.SIGXCPU, on_cpu_limit)
+    memory_mb = limits.get("memory_mb") or 0
+    if memory_mb:
+        # the child starts with the zygote's address space (pytest and the prewarmed packages), which
+        # must fit under the limit for the job to run at all
+        try:
+            with open("/proc/self/statm") as f:
+                mapped_mb = int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+            memory_mb = max(memory_mb, mapped_mb + 256)
+        except (OSError, ValueError):
+            pass
+    set_rlimits(limits.get("cpu_seconds") or 0, memory_mb)
+
+
+def serve(sock_path: str, root: str):
+    # the protocol channel is the original stdout; everything else printed by the zygote is discarded
+    ready = os.fdopen(os.dup(1), "w")
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    if sys.path and os.path.realpath(sys.path[0]) == os.path.dirname(os.path.realpath(__file__)):
+        sys.path.pop(0)
+    _warm_pytest()
+    _prewarm(root)
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(sock_path)
+    listener.listen()
+    ready.write("ready\n")
+    ready.flush()
+    ready.close()
+
+    while True:
+        conn, _ = listener.accept()
+        try:
+            job = json.loads(conn.makefile("r").readline())
+        except ValueError:
+            conn.close()
+            continue
+        if os.fork() == 0:
+            listener.close()
+            _monitor(conn, job)
+        conn.close()
+        # imports what the code started using since, for later jobs; done after the fork, so a slow import
+        # delays at most the next job's handshake, which counts against that job's timeout
+        _prewarm(root)
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1], os.path.realpath(sys.argv[2]))
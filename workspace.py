@@ -0,0 +1,109 @@
+"""
+Per-session workspaces for the tools.
+
+A Workspace is a root directory plus a virtual current directory. Tool paths are resolved against the
+current directory and must stay under the root, and cd only moves the virtual directory, so sessions
+never touch the process-wide cwd. call_agent_async binds a session's workspace to the running task with
+bind(); tools look it up with current(). Asyncio tasks copy the context, so sessions running side by side
+in one event loop each see their own workspace. Without a binding, tools use a process default rooted at
+the directory the process was in when it first needed one. Each workspace also has a FileCache (see
+filecache.py) that the file tools read and write through, and a SymbolIndex (see symbols.py).
+"""
+
+import contextvars
+import os
+from contextlib import contextmanager
+
+from filecache import FileCache
+from subprocs import Limits
+from symbols import SymbolIndex
+
+
+class WorkspaceError(Exception):
+    """
+    Raised when a path escapes the workspace root.
+    """
+
+
+class Workspace:
+    """
+    A root directory and a virtual cwd under it, with the limits (subprocs.Limits) for code run there
+    and the cache, change journal and symbol index of its files.
+    """
+
+    def __init__(self, root: str, limits: Limits = None):
+        self.root = os.path.realpath(root)
+        self.cwd = self.root
+        # the workdir this one is a fork of, if any (see speculate.py)
+        self.origin = None
+        self.limits = limits or Limits()
+        self.files = FileCache(self.root)
+        self.symbols = SymbolIndex(self.root, self.files)
+
+    def resolve(self, path: str) -> str:
+        """
+        Returns the absolute path of path relative to the virtual cwd, refusing paths outside the root.
+        """
+        resolved = os.path.realpath(os.path.join(self.cwd, os.path.expanduser(path or ".")))
+        if resolved != self.root and not resolved.startswith(self.root + os.sep):
+            raise WorkspaceError(f"The path {path} is outside the workspace {self.root}.")
+        return resolved
+
+    def chdir(self, path: str) -> str:
+        resolved = self.resolve(path)
+        if not os.path.isdir(resolved):
+            raise NotADirectoryError(f"The path {path} is not a directory.")
+        self.cwd = resolved
+        return resolved
+
+    def state_root(self) -> str:
+        """
+        Returns the root whose .teddy holds the state of the whole run (test history for routing, telemetry,
+        profiles): the root, or the origin's root for a fork, whose own .teddy is thrown away with it.
+        """
+        return self.origin or self.root
+
+    def worker_dir(self) -> str:
+        """
+        Returns the directory whose test worker (see worker.py) runs the jobs of this workspace, whatever
+        its cwd: the root, or the origin's root for a fork, which then shares the origin's warm worker.
+        """
+        return self.origin or self.root
+
+    def relpath(self, path: str) -> str:
+        """
+        Returns path relative to the virtual cwd, e.g. for command line arguments of jobs run there.
+        """
+        return os.path.relpath(path, self.cwd)
+
+    def __repr__(self):
+        return f"Workspace({self.root!r}, cwd={self.cwd!r}, limits={self.limits!r})"
+
+
+_current = contextvars.ContextVar("workspace", default=None)
+_default = None
+
+
+def current() -> Workspace:
+    """
+    Returns the workspace bound to the running session, or the process default.
+    """
+    global _default
+    workspace = _current.get()
+    if workspace is not None:
+        return workspace
+    if _default is None:
+        _default = Workspace(os.getcwd())
+    return _default
+
+
+@contextmanager
+def bind(workspace: Workspace):
+    """
+    Binds workspace for the current context, e.g. the asyncio task running one agent session.
+    """
+    token = _current.set(workspace)
+    try:
+        yield workspace
+    finally:
+        _current.reset(token)